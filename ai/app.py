@@ -3,18 +3,28 @@ from flask_cors import CORS
 import base64
 import cv2
 import numpy as np
-from handtracking import HandTracker
+from handtracking import HandTrackerRegistry, HandTrackerPool, HandTrackerBusy
+from frame_decoding import decode_frame
+from batch_tracking_jobs import BatchTrackingJobQueue, BatchTrackingQueueFull
 import logging
 import os 
 from dotenv import load_dotenv 
 import json
-import requests
+import multiprocessing
+import shutil
+import tempfile
+import threading
 
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
 from PIL import Image
 from io import BytesIO
-from transform import apply_spell
+from transform import (SPELL_REGISTRY, PREVIEW_OPTIONS, available_output_formats, background_remover,
+                       check_image_size, output_mimetype, parse_output_options, parse_pipeline)
+from transform_jobs import TransformJobQueue, TransformQueueFull
+from transform_cache import default_cache as transform_cache
 
 
 
@@ -22,36 +32,104 @@ load_dotenv()
 
 # Import the news generation blueprint and its initializer
 from news_generator import news_bp, init_news_model 
+from diary import diary_bp
+from llm_client import LLMBusy, LLMEmptyResponse, LLMError, LLMTimeout, get_client as get_llm_client
+from llm_cache import get_cache as get_response_cache
+from sse import stream_llm_response
+from lore_index import get_lore_index
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-CORS(app) 
-
-# Initialize hand tracker 
-hand_tracker = HandTracker()
+# Landmark response formats accepted via ?format= / the 'format' field
+TRACKING_FORMATS = ('json', 'packed', 'binary', 'events')
+# Response headers describing a binary landmark buffer
+TRACKING_BINARY_HEADERS = ['X-Hands-Detected', 'X-Landmark-Shape', 'X-Handedness', 'X-Handedness-Scores',
+                           'X-Gestures', 'X-Gesture-Spells', 'X-Spell-Events']
+# Response headers of the batch extraction endpoint (besides X-Hands-Detected)
+BATCH_TRACKING_HEADERS = ['X-Frames-Processed', 'X-Frames-Failed', 'X-Frames-Per-Second']
 
-# IMPORTANT: For local development, you MUST provide your Gemini API key here
+app = Flask(__name__)
+CORS(app, expose_headers=TRACKING_BINARY_HEADERS + BATCH_TRACKING_HEADERS) 
+sock = Sock(app)
+
+# Initialize hand tracking. Every client session gets its own MediaPipe graph
+# so concurrent webcams do not share tracking state. With HAND_TRACKER_WORKERS > 0
+# the sessions are spread over a pool of worker processes instead of running
+# inside the Flask request threads.
+HAND_TRACKER_WORKERS = int(os.getenv("HAND_TRACKER_WORKERS", "0"))
+hand_tracker_options = {
+    'max_sessions': int(os.getenv("HAND_TRACKER_MAX_SESSIONS", "16")),
+    'session_ttl': float(os.getenv("HAND_TRACKER_SESSION_TTL", "120")),
+    # Frames are downscaled to this width (0 = full resolution) and cropped to the hands
+    'inference_width': int(os.getenv("HAND_TRACKER_INFERENCE_WIDTH", "640")) or None,
+    'full_scan_interval': int(os.getenv("HAND_TRACKER_FULL_SCAN_INTERVAL", "30")),
+    # Frames closer than this (mean abs. difference, 0-255) to the last processed one reuse its result
+    'change_threshold': float(os.getenv("HAND_TRACKER_CHANGE_THRESHOLD", "2.0")),
+    # The frontend mirrors frames itself; only clients sending raw camera frames need this
+    'mirror_strokes': os.getenv("HAND_TRACKER_MIRROR_STROKES", "0") == "1"
+}
+# JPEG frames are decoded at a reduced scale as long as they stay at least this wide
+FRAME_DECODE_WIDTH = hand_tracker_options['inference_width']
+if HAND_TRACKER_WORKERS > 0:
+    hand_tracker = HandTrackerPool(
+        num_workers=HAND_TRACKER_WORKERS,
+        queue_depth=int(os.getenv("HAND_TRACKER_QUEUE_DEPTH", "2")),
+        **hand_tracker_options
+    )
+else:
+    hand_tracker = HandTrackerRegistry(**hand_tracker_options)
+# /track_hands/batch uploads are extracted by background jobs on a long-lived worker pool
+batch_tracking_jobs = BatchTrackingJobQueue(
+    num_workers=int(os.getenv("HAND_TRACKER_BATCH_WORKERS", "2")),
+    max_pending=int(os.getenv("HAND_TRACKER_BATCH_QUEUE_DEPTH", "2")),
+    result_ttl=float(os.getenv("HAND_TRACKER_BATCH_RESULT_TTL", "600")),
+    inference_width=hand_tracker_options['inference_width']
+)
+
+# Load the Evanesco background removal model in the background so the first
+# transform request does not wait for it (not in spawned worker processes,
+# which re-import this module)
+if os.getenv("REMBG_WARMUP", "1") == "1" and multiprocessing.parent_process() is None:
+    background_remover.warm_up_async()
+
+# Image transforms run on a bounded job queue (worker processes for CPU spells)
+# instead of inside the request threads
+transform_jobs = TransformJobQueue(
+    num_workers=int(os.getenv("TRANSFORM_WORKERS", "2")),
+    max_pending=int(os.getenv("TRANSFORM_QUEUE_DEPTH", "8")),
+    result_ttl=float(os.getenv("TRANSFORM_RESULT_TTL", "300")),
+    # Results by (image content, spell): memory LRU plus optional TRANSFORM_CACHE_DIR disk tier
+    cache=transform_cache
+)
+# Seconds a synchronous /ai/transform_image request waits for its job
+TRANSFORM_SYNC_TIMEOUT = float(os.getenv("TRANSFORM_SYNC_TIMEOUT", "60"))
+# Upper bound on a single long-poll wait
+TRANSFORM_MAX_WAIT = 30.0
+# Encoded images are written to the client in chunks of this size
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# IMPORTANT: For local development, you MUST provide your Gemini API key
 # Get your API key from Google AI Studio: https://aistudio.google.com/app/apikey
-# It's recommended to store this in a .env file and load it using os.getenv()
-# Example: API_KEY = os.getenv("GEMINI_API_KEY")
-# For Canvas environment, leave it as an empty string.
-API_KEY = os.getenv("GEMINI_API_KEY", "") # Load from .env or default to empty
-
-def decode_base64_image(image_data_url):
+# Store it as GEMINI_API_KEY in a .env file; GEMINI_API_BASE points the client at a
+# local stub for benchmarks and offline development, LLM_* tune timeouts and retries.
+# Every Gemini caller shares this pooled client.
+llm_client = get_llm_client()
+# Repeated librarian questions are answered from this cache (LLM_CACHE_* settings)
+response_cache = get_response_cache()
+
+# Lore passages the librarian grounds its answers in (LORE_CORPUS_PATH, LORE_INDEX_DIR)
+lore_index = get_lore_index()
+# Passages retrieved per question, and the size cap of the archive text in the prompt
+LORE_TOP_K = int(os.getenv("LORE_TOP_K", "3"))
+LORE_MAX_CONTEXT_CHARS = int(os.getenv("LORE_MAX_CONTEXT_CHARS", "1200"))
+
+def decode_image_bytes(image_bytes):
     """
-    Decode base64 image data URL to OpenCV image format
+    Decode raw encoded image bytes (e.g. JPEG) to OpenCV image format
     """
     try:
-        if ',' in image_data_url:
-            header, encoded = image_data_url.split(',', 1)
-        else:
-            encoded = image_data_url
-        
-        image_bytes = base64.b64decode(encoded)
-        
         nparr = np.frombuffer(image_bytes, np.uint8)
         
         image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
@@ -61,26 +139,230 @@ def decode_base64_image(image_data_url):
             
         return image
         
+    except Exception as e:
+        logger.error(f"Error decoding image bytes: {e}")
+        return None
+
+def decode_base64_bytes(image_data_url):
+    """
+    Decode a base64 image data URL to the encoded image bytes
+    """
+    try:
+        # Only look for the data URL header at the start instead of splitting the whole string
+        comma = image_data_url.find(',', 0, 256)
+        return base64.b64decode(image_data_url[comma + 1:] if comma != -1 else image_data_url)
+        
     except Exception as e:
         logger.error(f"Error decoding base64 image: {e}")
         return None
 
+def decode_base64_image(image_data_url):
+    """
+    Decode base64 image data URL to OpenCV image format
+    """
+    image_bytes = decode_base64_bytes(image_data_url)
+    if image_bytes is None:
+        return None
+    return decode_image_bytes(image_bytes)
+
+# Request content types that carry an encoded frame as the raw body
+RAW_FRAME_MIMETYPES = ('image/jpeg', 'image/png', 'image/webp', 'application/octet-stream')
+
+def read_frame_bytes():
+    """
+    Extract the encoded frame of a hand tracking request.
+    Accepts a multipart 'image' file, a raw image body, or the original JSON
+    body with a base64 data URL in 'image'.
+
+    Returns:
+        (image_bytes, fields) - fields holds the other request fields (JSON
+        body or form), image_bytes is None if no frame was sent
+    """
+    if 'image' in request.files:
+        # Form fields (session_id, format) travel next to the file
+        return request.files['image'].read(), request.form
+    if request.mimetype in RAW_FRAME_MIMETYPES:
+        return request.get_data(cache=False), None
+
+    data = request.get_json(silent=True)
+    if not data or 'image' not in data:
+        return None, data
+    return decode_base64_bytes(data['image']), data
+
+def get_session_id(data=None):
+    """
+    Resolve the hand tracking session id of the current request.
+    Prefers an explicit 'session_id' field or query parameter, then the
+    X-Session-ID header, and falls back to the client address.
+    """
+    if data and data.get('session_id'):
+        return str(data['session_id'])
+    if request.args.get('session_id'):
+        return request.args['session_id']
+    header_session_id = request.headers.get('X-Session-ID')
+    if header_session_id:
+        return header_session_id
+    return f"{request.remote_addr}|{request.headers.get('User-Agent', '')}"
+
+def get_tracking_format(data=None):
+    """
+    Resolve the landmark response format of the current request.
+    An explicit 'format' field or query parameter wins; otherwise clients that
+    only accept application/octet-stream get the raw binary buffer.
+    """
+    requested = (data or {}).get('format') or request.args.get('format')
+    if requested:
+        requested = requested.lower()
+        if requested not in TRACKING_FORMATS:
+            raise ValueError(f"Unknown format '{requested}', expected one of {', '.join(TRACKING_FORMATS)}")
+        return requested
+    best = request.accept_mimetypes.best_match(['application/json', 'application/octet-stream'])
+    return 'binary' if best == 'application/octet-stream' else 'json'
+
+def build_tracking_response(detections, response_format='json'):
+    """
+    Build the JSON payload shared by the hand tracking endpoints
+
+    'json' keeps the original list-of-dicts landmarks; 'packed' returns the
+    little-endian float32 (hands x 21 x 3) landmark buffer as base64; 'events'
+    leaves out landmarks entirely and only reports gestures and spell events.
+    """
+    hands_detected = len(detections) if detections is not None else 0
+    if hands_detected:
+        logger.debug(f"Detected {hands_detected} hands")
+    else:
+        logger.debug("No hands detected")
+
+    gestures = detections.gestures if detections is not None else []
+    spell_events = detections.events if detections is not None else []
+
+    if response_format == 'events':
+        return {
+            'gestures': gestures,
+            'spell_events': spell_events,
+            'status': 'success',
+            'hands_detected': hands_detected
+        }
+
+    if response_format == 'packed':
+        landmarks = detections.landmarks if detections is not None else np.zeros((0, 21, 3), np.float32)
+        return {
+            'landmarks': base64.b64encode(landmarks.astype('<f4', copy=False).tobytes()).decode('ascii'),
+            'shape': list(landmarks.shape),
+            'dtype': 'float32',
+            'handedness': detections.handedness if detections is not None else [],
+            'scores': detections.scores if detections is not None else [],
+            'gestures': gestures,
+            'spell_events': spell_events,
+            'status': 'success',
+            'hands_detected': hands_detected
+        }
+
+    return {
+        'hand_landmarks': detections.to_dicts() if detections is not None else None,
+        'gestures': gestures,
+        'spell_events': spell_events,
+        'status': 'success',
+        'hands_detected': hands_detected
+    }
+
+def build_binary_tracking_response(detections):
+    """
+    Return landmarks as a raw little-endian float32 (hands x 21 x 3) buffer.
+    Handedness labels and scores travel in response headers.
+    """
+    if detections is None:
+        landmarks, handedness, scores, gestures = np.zeros((0, 21, 3), np.float32), [], [], []
+    else:
+        landmarks, handedness, scores, gestures = (detections.landmarks, detections.handedness,
+                                                   detections.scores, detections.gestures)
+
+    response = app.response_class(landmarks.astype('<f4', copy=False).tobytes(),
+                                  mimetype='application/octet-stream')
+    response.headers['X-Hands-Detected'] = str(len(landmarks))
+    response.headers['X-Landmark-Shape'] = ','.join(str(dim) for dim in landmarks.shape)
+    response.headers['X-Handedness'] = ','.join(handedness)
+    response.headers['X-Handedness-Scores'] = ','.join(f"{score:.4f}" for score in scores)
+    response.headers['X-Gestures'] = ','.join(gesture['name'] for gesture in gestures)
+    response.headers['X-Gesture-Spells'] = ','.join(gesture['spell'] or '' for gesture in gestures)
+    response.headers['X-Spell-Events'] = ','.join(event['spell'] for event in (detections.events if detections is not None else []))
+    return response
+
+class LatestFrameSlot:
+    """
+    Single-slot mailbox holding only the newest frame received on a stream.
+    A frame that is overwritten before the tracker picks it up is dropped,
+    so a slow server never builds up a backlog of stale frames.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        with self._condition:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame = frame
+            self.received += 1
+            self._condition.notify()
+
+    def take(self):
+        """
+        Block until a frame is available and return it, or None once closed
+        """
+        with self._condition:
+            while self._frame is None and not self._closed:
+                self._condition.wait()
+            frame, self._frame = self._frame, None
+            return frame
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+def track_stream_frame(session_id, frame, response_format):
+    """
+    Landmark message for one frame of a hand tracking stream
+    (shared by the WebSocket endpoint here and in the ASGI mode)
+    """
+    image, color = decode_frame(frame, FRAME_DECODE_WIDTH)
+    if image is None:
+        return {
+            'error': 'Failed to decode image',
+            'hand_landmarks': []
+        }
+
+    try:
+        detections = hand_tracker.detect(session_id, image, color)
+    except HandTrackerBusy:
+        return {
+            'status': 'busy',
+            'hand_landmarks': []
+        }
+    return build_tracking_response(detections, response_format)
+
 @app.route('/track_hands', methods=['POST'])
 def track_hands():
     """
     Main endpoint for hand tracking 
-    Receives base64 encoded image and returns hand landmarks
+    Receives an image (base64 JSON, multipart file or raw JPEG body) and returns hand landmarks
     """
     try:
-        data = request.get_json()
+        image_bytes, data = read_frame_bytes()
         
-        if not data or 'image' not in data:
+        if not image_bytes:
             return jsonify({
                 'error': 'No image data provided',
                 'hand_landmarks': []
             }), 400
         
-        image = decode_base64_image(data['image'])
+        # Decode straight to RGB, at reduced scale for large JPEGs
+        image, color = decode_frame(image_bytes, FRAME_DECODE_WIDTH)
         
         if image is None:
             return jsonify({
@@ -88,21 +370,29 @@ def track_hands():
                 'hand_landmarks': []
             }), 400
         
+        try:
+            response_format = get_tracking_format(data)
+        except ValueError as e:
+            return jsonify({
+                'error': str(e),
+                'hand_landmarks': []
+            }), 400
+        
         logger.debug(f"Received image with shape: {image.shape}")
         
-        landmarks = hand_tracker.process_frame(image)
+        detections = hand_tracker.detect(get_session_id(data), image, color)
         
-        if landmarks:
-            logger.debug(f"Detected {len(landmarks)} hands")
-        else:
-            logger.debug("No hands detected")
+        if response_format == 'binary':
+            return build_binary_tracking_response(detections)
+        return jsonify(build_tracking_response(detections, response_format))
         
+    except HandTrackerBusy as e:
+        logger.warning(f"Hand tracking overloaded: {e}")
         return jsonify({
-            'hand_landmarks': landmarks,
-            'status': 'success',
-            'hands_detected': len(landmarks) if landmarks else 0
-        })
-        
+            'status': 'busy',
+            'error': 'Hand tracking is at capacity, frame dropped',
+            'hand_landmarks': []
+        }), 503
     except Exception as e:
         logger.error(f"Error in track_hands endpoint: {e}")
         return jsonify({
@@ -110,11 +400,170 @@ def track_hands():
             'hand_landmarks': []
         }), 500
 
+@app.route('/track_hands/batch', methods=['POST'])
+def track_hands_batch():
+    """
+    Offline landmark extraction for datasets and fixtures
+    Receives a multipart 'video' file or several 'images' files and returns a job id; the landmarks
+    are fetched as an NPZ file from the job's result_url once extracted
+    """
+    video = request.files.get('video')
+    images = request.files.getlist('images')
+    if video is None and not images:
+        return jsonify({'error': 'Upload a \'video\' file or one or more \'images\' files'}), 400
+    
+    try:
+        frame_step = max(1, int(request.form.get('step', 1)))
+    except ValueError:
+        return jsonify({'error': 'step must be an integer'}), 400
+    
+    # The job owns the upload's directory from here on and deletes it when it is done
+    workdir = tempfile.mkdtemp(prefix='track_hands_batch_')
+    try:
+        if video is not None:
+            extension = os.path.splitext(video.filename or '')[1] or '.mp4'
+            source = os.path.join(workdir, 'video' + extension)
+            video.save(source)
+        else:
+            source = workdir
+            for index, image in enumerate(images):
+                # Zero-padded names keep the upload order as the frame order
+                extension = os.path.splitext(image.filename or '')[1] or '.jpg'
+                image.save(os.path.join(workdir, f"{index:06d}{extension.lower()}"))
+        job = batch_tracking_jobs.submit(workdir, source, frame_step)
+    except BatchTrackingQueueFull as e:
+        shutil.rmtree(workdir, ignore_errors=True)
+        logger.warning(f"Batch tracking queue full: {e}")
+        return jsonify({'status': 'busy', 'error': 'Too many batch tracking jobs in progress, try again later'}), 503
+    except Exception as e:
+        shutil.rmtree(workdir, ignore_errors=True)
+        logger.error(f"Error in track_hands_batch endpoint: {e}")
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+    
+    response = dict(job.to_dict(),
+                    status_url=f"/track_hands/batch/{job.id}",
+                    result_url=f"/track_hands/batch/{job.id}/result")
+    return jsonify(response), 202
+
+@app.route('/track_hands/batch/<job_id>', methods=['GET'])
+def track_hands_batch_status(job_id):
+    """
+    Status of a batch tracking job; ?wait=<seconds> long-polls until it finishes
+    """
+    job = batch_tracking_jobs.wait(job_id, get_wait_seconds())
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/track_hands/batch/<job_id>/result', methods=['GET'])
+def track_hands_batch_result(job_id):
+    """
+    Landmarks of a batch tracking job as an NPZ file; 202 while it is still running (?wait=<seconds> long-polls)
+    """
+    job = batch_tracking_jobs.wait(job_id, get_wait_seconds())
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job.status == 'error':
+        return jsonify(job.to_dict()), 500
+    if job.status != 'done':
+        return jsonify(job.to_dict()), 202
+    
+    response = send_file(BytesIO(job.result),
+                         mimetype='application/octet-stream',
+                         as_attachment=True,
+                         download_name='landmarks.npz')
+    response.headers['X-Frames-Processed'] = str(job.stats['frames_processed'])
+    response.headers['X-Frames-Failed'] = str(job.stats['frames_failed'])
+    response.headers['X-Hands-Detected'] = str(job.stats['hands_detected'])
+    response.headers['X-Frames-Per-Second'] = str(job.stats['frames_per_second'])
+    return response
+
+@sock.route('/ws/track_hands')
+def track_hands_stream(ws):
+    """
+    Streaming endpoint for hand tracking
+    Receives raw JPEG frames as binary WebSocket messages and pushes a JSON
+    landmark result back on the same connection for every processed frame.
+    Frames that arrive while the previous one is still being processed are
+    replaced by newer ones, keeping latency bounded.
+    """
+    session_id = get_session_id()
+    # Results go out as JSON text messages, so the binary format does not apply here
+    response_format = request.args.get('format', 'json')
+    if response_format not in ('json', 'packed', 'events'):
+        response_format = 'json'
+    slot = LatestFrameSlot()
+
+    def receive_frames():
+        try:
+            while True:
+                message = ws.receive()
+                # Text messages are reserved for control data; only binary frames are tracked
+                if isinstance(message, (bytes, bytearray)):
+                    slot.put(message)
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            logger.error(f"Error receiving hand tracking stream: {e}")
+        finally:
+            slot.close()
+
+    receiver = threading.Thread(target=receive_frames, daemon=True)
+    receiver.start()
+    logger.info(f"Hand tracking stream opened for session {session_id}")
+
+    try:
+        while True:
+            frame = slot.take()
+            if frame is None:
+                break
+
+            payload = track_stream_frame(session_id, frame, response_format)
+            payload['frames_received'] = slot.received
+            payload['frames_dropped'] = slot.dropped
+            ws.send(json.dumps(payload))
+    except ConnectionClosed:
+        pass
+    finally:
+        slot.close()
+        logger.info(f"Hand tracking stream closed for session {session_id} "
+                    f"({slot.received} frames received, {slot.dropped} dropped)")
+
+# Served while Gemini is unavailable and no earlier answer to the question is cached
+LIBRARIAN_FALLBACK_REPLY = ("Madam Pince has drawn the curtains over the archives for a short while, so I cannot "
+                            "consult the shelves just now. Please ask me again in a few minutes.")
+
+def build_librarian_prompt(user_query):
+    """
+    Librarian prompt for a user query, with whatever the library archives know about it
+    """
+    # Step 1: Look the question up in the local lore index (no external search service)
+    search_results_text = lore_index.context_for(user_query, k=LORE_TOP_K, max_chars=LORE_MAX_CONTEXT_CHARS)
+
+    # Step 2: Use gemini-2.0-flash to generate a librarian-style response
+    # based on the search results and the user's query.
+    
+    # Construct the prompt for the LLM
+    return f"""
+    You are a helpful and knowledgeable Hogwarts Librarian AI.
+    Based on the following information from the library archives and the user's query,
+    provide a concise and helpful answer in a formal, librarian-like tone.
+    If the information is not directly available, state that politely.
+
+    User Query: "{user_query}"
+
+    Library Archives Information:
+    {search_results_text}
+
+    Librarian AI Response:
+    """
+
+
 @app.route('/api/chatbot', methods=['POST'])
 def chatbot():
     """
     Handles chatbot queries.
-    Receives a user query, uses a mock search or integrates with a real search API,
+    Receives a user query, retrieves matching passages from the local lore index,
     then uses gemini-2.0-flash to generate a librarian-style response.
     """
     try:
@@ -126,104 +575,59 @@ def chatbot():
 
         print(f"Received query from frontend: {user_query}")
 
-        # --- FIX for 'google_search' is not defined ---
-        # When running locally, 'google_search' tool is not available.
-        # You need to either:
-        # 1. Integrate a real search API (e.g., Google Custom Search API)
-        # 2. Provide a mock search result for local development.
-        
-        search_results_text = ""
-        # Option 1: Mock Search Results (for quick local testing)
-        if "harry potter" in user_query.lower():
-            search_results_text = "Harry Potter is a famous wizard, known as 'The Boy Who Lived'. He attended Hogwarts School of Witchcraft and Wizardry, sorted into Gryffindor House. His parents were James and Lily Potter."
-        elif "spells" in user_query.lower():
-            search_results_text = "Common spells include Wingardium Leviosa (levitation), Expelliarmus (disarming), and Lumos (light). Advanced spells require more practice and focus."
-        elif "hogwarts founders" in user_query.lower():
-            search_results_text = "Hogwarts was founded by Godric Gryffindor, Helga Hufflepuff, Rowena Ravenclaw, and Salazar Slytherin, each representing a house."
-        else:
-            search_results_text = "No specific information found in the immediate library archives for that query."
-
-        # Option 2: Integrate a real search API (uncomment and configure if needed)
-        # from googleapiclient.discovery import build # pip install google-api-python-client
-        # GOOGLE_CSE_ID = os.getenv("GOOGLE_CSE_ID") # Your Custom Search Engine ID
-        # GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY") # Your Google API Key for Custom Search
-        # if GOOGLE_CSE_ID and GOOGLE_API_KEY:
-        #     try:
-        #         service = build("customsearch", "v1", developerKey=GOOGLE_API_KEY)
-        #         res = service.cse().list(q=user_query, cx=GOOGLE_CSE_ID, num=3).execute()
-        #         if res.get('items'):
-        #             search_results_text = "\n".join([item['snippet'] for item in res['items']])
-        #         else:
-        #             search_results_text = "No specific information found via external search."
-        #     except Exception as e:
-        #         print(f"Error during real Google Search API call: {e}")
-        #         search_results_text = "Could not access the wider magical knowledge network at this moment."
-        # else:
-        #     print("GOOGLE_CSE_ID or GOOGLE_API_KEY not set for real search.")
-        #     search_results_text = "External search not configured. Using mock data."
-        
-        # End of FIX for 'google_search' is not defined ---
-
-        # Step 2: Use gemini-2.0-flash to generate a librarian-style response
-        # based on the search results and the user's query.
-        
-        # Construct the prompt for the LLM
-        prompt = f"""
-        You are a helpful and knowledgeable Hogwarts Librarian AI.
-        Based on the following information from the library archives and the user's query,
-        provide a concise and helpful answer in a formal, librarian-like tone.
-        If the information is not directly available, state that politely.
-
-        User Query: "{user_query}"
-
-        Library Archives Information:
-        {search_results_text}
+        prompt = build_librarian_prompt(user_query)
+        ai_response, degraded = response_cache.generate_or_fallback(
+            'librarian', user_query, lambda: llm_client.generate_text(prompt, feature='librarian'),
+            canned=LIBRARIAN_FALLBACK_REPLY)
+        if degraded:
+            return jsonify({'response': ai_response, 'degraded': True})
+        return jsonify({'response': ai_response})
 
-        Librarian AI Response:
-        """
+    except Exception as e:
+        body, status = librarian_error_reply(e)
+        return jsonify(body), status
 
-        # Prepare the payload for the Gemini API call
-        payload = {
-            "contents": [
-                {
-                    "role": "user",
-                    "parts": [{"text": prompt}]
-                }
-            ]
-        }
-        
-        # Gemini API endpoint (gemini-2.0-flash is default, no API key needed if empty string)
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={API_KEY}"
 
-        headers = {'Content-Type': 'application/json'}
-        
-        # Make the request to the Gemini API
-        gemini_response = requests.post(api_url, headers=headers, data=json.dumps(payload))
-        gemini_response.raise_for_status() # Raise an exception for HTTP errors (e.g., 403, 404, 500)
+def librarian_error_reply(error):
+    """
+    JSON body and status code answering a chatbot query that failed with `error`
+    (shared with the ASGI mode)
+    """
+    if isinstance(error, LLMEmptyResponse):
+        print(f"Unexpected Gemini API response: {error}")
+        return {'response': "I apologize, I could not generate a response at this time. The magical ink seems to have run dry."}, 200
+    if isinstance(error, LLMBusy):
+        print(f"Gemini busy: {error}")
+        return {'response': 'The library is very busy at the moment. Please ask again in a little while.'}, 503
+    if isinstance(error, LLMTimeout):
+        print(f"Gemini timed out: {error}")
+        return {'response': 'The archives are taking too long to answer. Please try again shortly.'}, 504
+    if isinstance(error, LLMError):
+        print(f"Error connecting to Gemini API: {error}")
+        # Provide a more user-friendly message for API key issues
+        if error.status_code == 403 and not llm_client.configured:
+            return {'response': 'Librarian AI: My apologies, I cannot access the magical knowledge network. Please ensure your Gemini API key is correctly configured for this local server.'}, 500
+        return {'response': 'A magical disruption is preventing me from accessing the knowledge network. Please try again shortly.'}, 500
+    print(f"An unexpected error occurred: {error}")
+    return {'response': 'An unexpected magical anomaly occurred. Please report this to the Headmaster.'}, 500
 
-        gemini_result = gemini_response.json()
-        
-        # Extract the text from the Gemini response
-        # CORRECTED: Changed .text to ['text'] for dictionary access
-        if gemini_result.get('candidates') and gemini_result['candidates'][0].get('content') and \
-           gemini_result['candidates'][0]['content'].get('parts') and \
-           gemini_result['candidates'][0]['content']['parts'][0].get('text'):
-            ai_response = gemini_result['candidates'][0]['content']['parts'][0]['text']
-        else:
-            ai_response = "I apologize, I could not generate a response at this time. The magical ink seems to have run dry."
-            print("Unexpected Gemini API response structure:", gemini_result)
 
-        return jsonify({'response': ai_response})
+@app.route('/api/chatbot/stream', methods=['POST'])
+def chatbot_stream():
+    """
+    Streaming variant of /api/chatbot: relays the librarian's answer as server-sent events
+    ('token' events with the text as it is generated, then a 'done' event with the full 'response')
+    """
+    data = request.get_json(silent=True) or {}
+    user_query = data.get('query')
+    if not user_query:
+        return jsonify({'error': 'Please provide a query.'}), 400
 
-    except requests.exceptions.RequestException as req_err:
-        print(f"Error connecting to Gemini API: {req_err}")
-        # Provide a more user-friendly message for API key issues
-        if "403 Client Error: Forbidden" in str(req_err) and not API_KEY:
-            return jsonify({'response': 'Librarian AI: My apologies, I cannot access the magical knowledge network. Please ensure your Gemini API key is correctly configured for this local server.'}), 500
-        return jsonify({'response': 'A magical disruption is preventing me from accessing the knowledge network. Please try again shortly.'}), 500
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        return jsonify({'response': 'An unexpected magical anomaly occurred. Please report this to the Headmaster.'}), 500
+    prompt = build_librarian_prompt(user_query)
+    chunks = response_cache.stream(
+        'librarian', user_query, lambda: llm_client.stream_text(prompt, feature='librarian'),
+        canned=LIBRARIAN_FALLBACK_REPLY)
+    return stream_llm_response(chunks, 'response')
 
 
 @app.route('/health', methods=['GET'])
@@ -240,6 +644,15 @@ def health_check():
         'status': 'healthy',
         'message': 'Main Flask AI Backend is running (Hand Tracking and News Generation).',
         'hand_tracker_initialized': hand_tracker.is_initialized(),
+        'hand_tracker_stats': hand_tracker.stats(),
+        'background_removal_model_loaded': background_remover.loaded,
+        'background_removal_stats': background_remover.stats(),
+        'transform_queue_stats': transform_jobs.stats(),
+        'transform_cache_stats': transform_cache.stats(),
+        'batch_tracking_stats': batch_tracking_jobs.stats(),
+        'llm_client_stats': llm_client.stats(),
+        'llm_cache_stats': response_cache.stats(),
+        'lore_index_stats': lore_index.stats(),
         'news_generation_initialized': current_news_model_state is not None, 
         'news_generation_service_health_endpoint': f"http://localhost:{request.host.split(':')[-1]}/news-ai/health" 
     })
@@ -255,12 +668,26 @@ def home():
         'endpoints': {
             # Existing Hand Tracking Endpoints
             '/track_hands': 'POST - Send base64 image for hand tracking',
+            '/ws/track_hands': 'WebSocket - Stream raw JPEG frames for hand tracking',
+            '/track_hands/batch': 'POST - Extract landmarks from an uploaded video or image set (returns a job id)',
+            '/track_hands/batch/<job_id>': 'GET - Status of a batch tracking job (?wait=<seconds> to long-poll)',
+            '/track_hands/batch/<job_id>/result': 'GET - Landmarks of a batch tracking job as an NPZ file',
             '/health': 'GET - Overall server health check',
+            '/ai/transform_image': 'POST - Apply a transfiguration spell or chain (e.g. evanesco+lumos) to an image (async=1 to get a job id)',
+            '/ai/spells': 'GET - Available transfiguration spells',
+            '/ai/transform_jobs/<job_id>': 'GET - Status of an async transform job (?wait=<seconds> to long-poll)',
+            '/ai/transform_jobs/<job_id>/result': 'GET - Result image of an async transform job',
+            '/ai/transform_jobs/<job_id>/preview': 'GET - Small low-quality preview of an async transform result',
             # News Generation Endpoints
             '/news-ai/generate-news': 'POST - Generate a news article using Gemini AI for a given category',
+            '/news-ai/generate-news/stream': 'POST - News article streamed as server-sent events',
             '/news-ai/health': 'GET - Check the health of the news generation service',
+            '/diary-ai/generate_entry': 'POST - Write in Tom Riddle\'s diary and receive his reply',
+            '/diary-ai/generate_entry/stream': 'POST - Diary reply streamed as server-sent events',
+            '/diary-ai/health': 'GET - Check the health of the diary service',
             # NEW Chatbot Endpoint
             '/api/chatbot': 'POST - Ask the Librarian AI a question',
+            '/api/chatbot/stream': 'POST - Ask the Librarian AI a question, answer streamed as server-sent events',
             '/': 'GET - This information page'
         },
         'usage': {
@@ -268,14 +695,24 @@ def home():
                 'method': 'POST',
                 'endpoint': '/track_hands',
                 'data_format': {
-                    'image': 'base64 encoded image data URL'
+                    'image': 'base64 encoded image data URL (or send the JPEG as a multipart \'image\' file or raw image/jpeg body)',
+                    'session_id': 'optional client session id (or X-Session-ID header)',
+                    'format': 'optional json (default), packed (base64 float32 buffer), binary (raw float32 buffer, also via Accept: application/octet-stream) or events (gestures and spell events only)'
                 },
                 'response_format': {
                     'hand_landmarks': 'Array of hand landmark arrays',
-                    'status': 'success/error',
+                    'gestures': 'Array of {name, spell} gesture classifications, one per hand',
+                    'spell_events': 'Array of spells recognized from wand strokes that ended on this frame',
+                    'status': 'success/busy/error',
                     'hands_detected': 'Number of hands detected'
                 }
             },
+            'hand_tracking_stream': {
+                'protocol': 'WebSocket',
+                'endpoint': '/ws/track_hands?session_id=<id>&format=json|packed|events',
+                'data_format': 'Binary messages containing raw JPEG frames',
+                'response_format': 'One JSON text message per processed frame (same fields as /track_hands plus frames_received and frames_dropped)'
+            },
             'news_generation': {
                 'method': 'POST',
                 'endpoint': '/news-ai/generate-news',
@@ -284,7 +721,8 @@ def home():
                 },
                 'response_format': {
                     'news_content': 'String of the generated news article',
-                    'category': 'The category that was requested'
+                    'category': 'The category that was requested',
+                    'age_seconds': 'Seconds since a pre-generated article was written (absent for live generation)'
                 }
             },
             'chatbot': { # NEW: Chatbot usage info
@@ -294,7 +732,8 @@ def home():
                     'query': 'string (the user\'s question)'
                 },
                 'response_format': {
-                    'response': 'string (the AI librarian\'s answer)'
+                    'response': 'string (the AI librarian\'s answer)',
+                    'degraded': 'true when Gemini is unavailable and a cached or canned answer was served'
                 }
             }
         },
@@ -303,23 +742,121 @@ def home():
 
 @app.route('/ai/transform_image', methods=['POST'])
 def transform_image():
+    """
+    Apply a transfiguration spell, or a chain of spells ("evanesco+lumos" or repeated 'spell' fields),
+    to an uploaded image
+    By default waits for the result and returns the image; with async=1 returns a job id to poll instead
+    Large uploads are processed at a capped working resolution; full_resolution=1 scales the result back up
+    Encoding: format=jpeg|webp|avif, quality=1-100, progressive=1 (JPEG); preview=1 returns only the small preview
+    """
     if 'image' not in request.files or 'spell' not in request.form:
         return jsonify({'error': 'Missing image or spell'}), 400
 
+    image_bytes = request.files['image'].read()
     try:
-        image = Image.open(request.files['image']).convert('RGB')
-        spell = request.form['spell']
-        result = apply_spell(spell, image)
-
-        buffer = BytesIO()
-        result.save(buffer, format='JPEG')
-        buffer.seek(0)
-        return send_file(buffer, mimetype='image/jpeg')
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        spells = parse_pipeline(request.form.getlist('spell'))
+        # Rejects undecodable and oversized uploads from the header alone
+        check_image_size(image_bytes)
+        output = parse_output_options(request.form.get('format'),
+                                      request.form.get('quality'),
+                                      request.form.get('progressive'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    full_resolution = request.form.get('full_resolution', '').lower() in ('1', 'true', 'yes')
+    try:
+        job = transform_jobs.submit(spells, image_bytes, full_resolution, output)
+    except TransformQueueFull as e:
+        logger.warning(f"Transform queue full: {e}")
+        return jsonify({'status': 'busy', 'error': 'Too many transforms in progress, try again shortly'}), 503
+
+    is_async = (request.form.get('async') or request.args.get('async', '')).lower() in ('1', 'true', 'yes')
+    if is_async:
+        response = dict(job.to_dict(),
+                        status_url=f"/ai/transform_jobs/{job.id}",
+                        result_url=f"/ai/transform_jobs/{job.id}/result",
+                        preview_url=f"/ai/transform_jobs/{job.id}/preview")
+        return jsonify(response), 202
+
+    if not job.done.wait(TRANSFORM_SYNC_TIMEOUT):
+        return jsonify(dict(job.to_dict(), error='Transform timed out, poll the job for the result')), 504
+    if job.status == 'error':
+        return jsonify({'error': job.error}), 500
+    if request.form.get('preview', '').lower() in ('1', 'true', 'yes'):
+        return stream_image(job.preview, output_mimetype(PREVIEW_OPTIONS))
+    return stream_image(job.result, job.mimetype)
+
+def stream_image(data, mimetype):
+    """
+    Stream an encoded image in chunks, without copying it into another buffer
+    """
+    view = memoryview(data)
+
+    def generate():
+        for offset in range(0, len(view), STREAM_CHUNK_SIZE):
+            yield view[offset:offset + STREAM_CHUNK_SIZE].tobytes()
+
+    return Response(generate(), mimetype=mimetype, headers={'Content-Length': str(len(view))},
+                    direct_passthrough=True)
+
+@app.route('/ai/spells', methods=['GET'])
+def list_spells():
+    """
+    Registered transfiguration spells and their metadata
+    """
+    return jsonify({
+        'spells': [spell.to_dict() for spell in SPELL_REGISTRY.values()],
+        'output_formats': available_output_formats()
+    })
+
+def get_wait_seconds():
+    try:
+        return min(max(float(request.args.get('wait', 0)), 0.0), TRANSFORM_MAX_WAIT)
+    except ValueError:
+        return 0.0
+
+@app.route('/ai/transform_jobs/<job_id>', methods=['GET'])
+def transform_job_status(job_id):
+    """
+    Status of a transform job; ?wait=<seconds> long-polls until it finishes
+    """
+    job = transform_jobs.wait(job_id, get_wait_seconds())
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/ai/transform_jobs/<job_id>/result', methods=['GET'])
+def transform_job_result(job_id):
+    """
+    Result image of a transform job; 202 while it is still running (?wait=<seconds> long-polls)
+    """
+    job = transform_jobs.wait(job_id, get_wait_seconds())
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job.status == 'error':
+        return jsonify(job.to_dict()), 500
+    if job.status != 'done':
+        return jsonify(job.to_dict()), 202
+    return stream_image(job.result, job.mimetype)
+
+@app.route('/ai/transform_jobs/<job_id>/preview', methods=['GET'])
+def transform_job_preview(job_id):
+    """
+    Small low-quality preview of a transform result (WebP where available); 202 while the job is running
+    """
+    job = transform_jobs.wait(job_id, get_wait_seconds())
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    if job.status == 'error':
+        return jsonify(job.to_dict()), 500
+    if job.status != 'done':
+        return jsonify(job.to_dict()), 202
+    return stream_image(job.preview, output_mimetype(PREVIEW_OPTIONS))
 
 # Register the news_bp blueprint with a URL prefix
 app.register_blueprint(news_bp, url_prefix='/news-ai')
+# Register the diary_bp blueprint with a URL prefix
+app.register_blueprint(diary_bp, url_prefix='/diary-ai')
 
 if __name__ == '__main__':
     try:
@@ -328,14 +865,17 @@ if __name__ == '__main__':
         # Initialize HandTracker (already happens at module level, but good to confirm its state)
         logger.info(f"Hand tracker initialized: {hand_tracker.is_initialized()}")
         
-        # Initialize the news generation model
-        init_news_model() 
+        debug = True
+
+        # Initialize the news generation model. The debug reloader also runs this block in its
+        # watcher process; only the serving process pre-generates articles.
+        init_news_model(start_buffer=not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
         
         # Run the Flask app
         app.run(
             host='0.0.0.0',    
             port=5001,         
-            debug=True,        
+            debug=debug,        
             threaded=True      
         )
         
@@ -343,4 +883,4 @@ if __name__ == '__main__':
         logger.critical(f"CRITICAL: Failed to start server: {e}", exc_info=True)
         print(f"Error starting server: {e}")
         print("Please make sure you have installed all required dependencies and your GEMINI_API_KEY is set:")
-        print("pip install flask flask-cors opencv-python mediapipe numpy google-generative-ai python-dotenv")
+        print("pip install flask flask-cors opencv-python mediapipe numpy requests python-dotenv")
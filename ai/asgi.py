@@ -0,0 +1,365 @@
+"""
+ASGI serving mode of the AI orchestrator
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5001      (or: python asgi.py)
+
+Serves the same routes and JSON contracts as `python app.py`. The LLM-bound
+routes (librarian chatbot, Tom Riddle's diary, Daily Prophet news and their
+/stream variants) are async handlers over AsyncGeminiClient, so a slow Gemini
+call is a suspended coroutine rather than a blocked thread and one process
+can hold thousands of them. Everything CPU-bound stays off the event loop:
+hand tracking WebSocket frames run on a thread pool, and every other route
+(hand tracking, transforms, health, ...) is the Flask app itself, mounted
+through a WSGI bridge with its own worker threads.
+
+Settings: ASGI_WSGI_WORKERS (threads serving the mounted Flask routes),
+ASGI_TRACKING_WORKERS (threads tracking WebSocket frames) and
+LLM_ASYNC_MAX_CONCURRENCY (Gemini calls in flight).
+"""
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+import app as orchestrator
+import diary
+import news_generator
+from llm_async import get_async_client
+from llm_client import LLMError
+from sse import SSE_HEADERS, llm_error_status, sse_event
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Threads serving the mounted Flask routes (hand tracking, transforms, health, ...)
+ASGI_WSGI_WORKERS = int(os.getenv("ASGI_WSGI_WORKERS", "32"))
+# Threads decoding and tracking hand tracking WebSocket frames
+ASGI_TRACKING_WORKERS = int(os.getenv("ASGI_TRACKING_WORKERS", str(os.cpu_count() or 4)))
+
+llm_client = get_async_client()
+response_cache = orchestrator.response_cache
+tracking_executor = ThreadPoolExecutor(max_workers=ASGI_TRACKING_WORKERS, thread_name_prefix='asgi-tracking')
+
+
+async def read_json(request):
+    """
+    JSON object of a request body, or an empty dict if it has none
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def stream_llm_response(chunks, result_key, extra=None):
+    """
+    Async counterpart of sse.stream_llm_response: relays streamed LLM text as server-sent events
+
+    Args:
+        chunks: Async text chunks, e.g. from ResponseCache.stream_async
+        result_key: Key of the full text in the final 'done' event (matches the non-streaming endpoint)
+        extra: Additional fields of the 'done' event
+    """
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except LLMError as e:
+        logger.error(f"LLM stream failed before the first chunk: {e}")
+        return JSONResponse({'error': str(e)}, status_code=llm_error_status(e))
+
+    async def events():
+        parts = []
+        try:
+            if first is not None:
+                parts.append(first)
+                yield sse_event('token', {'text': first})
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield sse_event('token', {'text': chunk})
+            yield sse_event('done', {result_key: ''.join(parts), **(extra or {})})
+        except LLMError as e:
+            logger.error(f"LLM stream failed after {len(parts)} chunks: {e}")
+            yield sse_event('error', {'error': str(e), 'status': llm_error_status(e)})
+        finally:
+            # Runs on normal completion and when the client disconnected mid-stream
+            await chunks.aclose()
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+
+# --- Librarian chatbot ---
+
+async def chatbot(request):
+    """
+    Async counterpart of app.chatbot
+    """
+    try:
+        data = await read_json(request)
+        user_query = data.get('query')
+        if not user_query:
+            return JSONResponse({'response': 'Please provide a query.'}, status_code=400)
+
+        prompt = orchestrator.build_librarian_prompt(user_query)
+        ai_response, degraded = await response_cache.generate_or_fallback_async(
+            'librarian', user_query, lambda: llm_client.generate_text(prompt, feature='librarian'),
+            canned=orchestrator.LIBRARIAN_FALLBACK_REPLY)
+        if degraded:
+            return JSONResponse({'response': ai_response, 'degraded': True})
+        return JSONResponse({'response': ai_response})
+
+    except Exception as e:
+        body, status = orchestrator.librarian_error_reply(e)
+        return JSONResponse(body, status_code=status)
+
+
+async def chatbot_stream(request):
+    """
+    Async counterpart of app.chatbot_stream
+    """
+    data = await read_json(request)
+    user_query = data.get('query')
+    if not user_query:
+        return JSONResponse({'error': 'Please provide a query.'}, status_code=400)
+
+    prompt = orchestrator.build_librarian_prompt(user_query)
+    chunks = response_cache.stream_async(
+        'librarian', user_query, lambda: llm_client.stream_text(prompt, feature='librarian'),
+        canned=orchestrator.LIBRARIAN_FALLBACK_REPLY)
+    return await stream_llm_response(chunks, 'response')
+
+
+# --- Tom Riddle's diary ---
+
+async def generate_diary_entry(request):
+    """
+    Async counterpart of diary.generate_diary_entry
+    """
+    data = await read_json(request)
+    user_prompt = data.get('prompt', '')
+    if not user_prompt:
+        logger.warning("No prompt provided for diary entry generation.")
+        return JSONResponse({'error': 'Prompt is required.'}, status_code=400)
+
+    ai_prompt = diary.build_diary_prompt(user_prompt)
+    try:
+        generated_text, degraded = await response_cache.generate_or_fallback_async(
+            'diary', user_prompt, lambda: llm_client.generate_text(ai_prompt, feature='diary'),
+            canned=diary.FALLBACK_ENTRY)
+        if degraded:
+            return JSONResponse({'diaryEntry': generated_text, 'degraded': True})
+        return JSONResponse({'diaryEntry': generated_text})
+
+    except Exception as e:
+        body, status = diary.diary_error_reply(e)
+        return JSONResponse(body, status_code=status)
+
+
+async def generate_diary_entry_stream(request):
+    """
+    Async counterpart of diary.generate_diary_entry_stream
+    """
+    data = await read_json(request)
+    user_prompt = data.get('prompt', '')
+    if not user_prompt:
+        logger.warning("No prompt provided for diary entry generation.")
+        return JSONResponse({'error': 'Prompt is required.'}, status_code=400)
+
+    ai_prompt = diary.build_diary_prompt(user_prompt)
+    chunks = response_cache.stream_async(
+        'diary', user_prompt, lambda: llm_client.stream_text(ai_prompt, feature='diary'),
+        canned=diary.FALLBACK_ENTRY)
+    return await stream_llm_response(chunks, 'diaryEntry')
+
+
+# --- Daily Prophet news ---
+
+async def generate_news(request):
+    """
+    Async counterpart of news_generator.generate_news
+    """
+    if news_generator._news_model is None:
+        logger.error("Gemini news model not initialized. Cannot generate news.")
+        return JSONResponse(news_generator.NOT_READY_REPLY, status_code=503)
+
+    data = await read_json(request)
+    category = data.get('category', 'general wizarding news')
+
+    buffered = news_generator.take_buffered_article(category)
+    if buffered is not None:
+        news_content, age = buffered
+        return JSONResponse({"news_content": news_content, "category": category, "age_seconds": round(age, 1)})
+
+    prompt_text = news_generator.build_news_prompt(category)
+    try:
+        news_content, degraded = await response_cache.generate_or_fallback_async(
+            'news', category, lambda: llm_client.generate_text(prompt_text, feature='news'))
+        if degraded:
+            return JSONResponse({"news_content": news_content, "category": category, "degraded": True})
+        return JSONResponse({"news_content": news_content, "category": category})
+
+    except Exception as e:
+        body, status = news_generator.news_error_reply(e, category)
+        return JSONResponse(body, status_code=status)
+
+
+async def generate_news_stream(request):
+    """
+    Async counterpart of news_generator.generate_news_stream
+    """
+    if news_generator._news_model is None:
+        logger.error("Gemini news model not initialized. Cannot generate news.")
+        return JSONResponse(news_generator.NOT_READY_REPLY, status_code=503)
+
+    data = await read_json(request)
+    category = data.get('category', 'general wizarding news')
+
+    buffered = news_generator.take_buffered_article(category)
+    if buffered is not None:
+        news_content, age = buffered
+
+        async def whole_article():
+            yield news_content
+
+        return await stream_llm_response(whole_article(), 'news_content',
+                                         extra={'category': category, 'age_seconds': round(age, 1)})
+
+    prompt_text = news_generator.build_news_prompt(category)
+    chunks = response_cache.stream_async(
+        'news', category, lambda: llm_client.stream_text(prompt_text, feature='news'))
+    return await stream_llm_response(chunks, 'news_content', extra={'category': category})
+
+
+# --- Hand tracking stream ---
+
+class AsyncLatestFrameSlot:
+    """
+    asyncio counterpart of app.LatestFrameSlot: holds only the newest frame received on a stream
+    """
+
+    def __init__(self):
+        self._event = asyncio.Event()
+        self._frame = None
+        self._closed = False
+        self.received = 0
+        self.dropped = 0
+
+    def put(self, frame):
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self.received += 1
+        self._event.set()
+
+    async def take(self):
+        """
+        Wait until a frame is available and return it, or None once closed
+        """
+        while self._frame is None and not self._closed:
+            self._event.clear()
+            await self._event.wait()
+        frame, self._frame = self._frame, None
+        return frame
+
+    def close(self):
+        self._closed = True
+        self._event.set()
+
+
+async def track_hands_stream(websocket):
+    """
+    Async counterpart of app.track_hands_stream (same protocol); frames are tracked on a thread pool
+    """
+    await websocket.accept()
+    session_id = (websocket.query_params.get('session_id') or websocket.headers.get('X-Session-ID')
+                  or f"{websocket.client.host if websocket.client else ''}|{websocket.headers.get('User-Agent', '')}")
+    # Results go out as JSON text messages, so the binary format does not apply here
+    response_format = websocket.query_params.get('format', 'json')
+    if response_format not in ('json', 'packed', 'events'):
+        response_format = 'json'
+    slot = AsyncLatestFrameSlot()
+
+    async def receive_frames():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                # Text messages are reserved for control data; only binary frames are tracked
+                if message.get('bytes') is not None:
+                    slot.put(message['bytes'])
+        except Exception as e:
+            logger.error(f"Error receiving hand tracking stream: {e}")
+        finally:
+            slot.close()
+
+    receiver = asyncio.create_task(receive_frames())
+    logger.info(f"Hand tracking stream opened for session {session_id}")
+    loop = asyncio.get_running_loop()
+
+    try:
+        while True:
+            frame = await slot.take()
+            if frame is None:
+                break
+            payload = await loop.run_in_executor(
+                tracking_executor, orchestrator.track_stream_frame, session_id, frame, response_format)
+            payload['frames_received'] = slot.received
+            payload['frames_dropped'] = slot.dropped
+            await websocket.send_text(json.dumps(payload))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        slot.close()
+        receiver.cancel()
+        logger.info(f"Hand tracking stream closed for session {session_id} "
+                    f"({slot.received} frames received, {slot.dropped} dropped)")
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    # Only the serving process gets here (not uvicorn's reloader), so pre-generation starts once
+    news_generator.init_news_model()
+    yield
+    await llm_client.aclose()
+    if news_generator._article_buffer is not None:
+        news_generator._article_buffer.stop()
+    tracking_executor.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/chatbot', chatbot, methods=['POST']),
+        Route('/api/chatbot/stream', chatbot_stream, methods=['POST']),
+        Route('/diary-ai/generate_entry', generate_diary_entry, methods=['POST']),
+        Route('/diary-ai/generate_entry/stream', generate_diary_entry_stream, methods=['POST']),
+        Route('/news-ai/generate-news', generate_news, methods=['POST']),
+        Route('/news-ai/generate-news/stream', generate_news_stream, methods=['POST']),
+        WebSocketRoute('/ws/track_hands', track_hands_stream),
+        # Everything else is served by the Flask app on the bridge's worker threads
+        Mount('/', app=WSGIMiddleware(orchestrator.app, workers=ASGI_WSGI_WORKERS))
+    ],
+    middleware=[
+        # Same policy as flask_cors in app.py, for the async routes (and preflights) too
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'],
+                   expose_headers=orchestrator.TRACKING_BINARY_HEADERS + orchestrator.BATCH_TRACKING_HEADERS)
+    ],
+    lifespan=lifespan
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=5001)
@@ -1,17 +1,18 @@
 # ashlibrarian.py
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import json
-import os
-import requests
+
+from llm_cache import get_cache
+from llm_client import LLMBusy, LLMEmptyResponse, LLMError, get_client
+from lore_index import get_lore_index
+
+# Served while Gemini is unavailable and no earlier answer to the question is cached
+FALLBACK_REPLY = ("Madam Pince has drawn the curtains over the archives for a short while, so I cannot "
+                  "consult the shelves just now. Please ask me again in a few minutes.")
 
 app = Flask(__name__)
 CORS(app) # Enable CORS for all routes, allowing your React frontend to connect
 
-# Define the path for the API key. In a real application, you'd load this securely.
-# For Canvas environment, leave it empty as it's provided at runtime.
-API_KEY = "" # Leave empty for Canvas environment
-
 @app.route('/')
 def home():
     """Simple home route to confirm the server is running."""
@@ -21,7 +22,7 @@ def home():
 def chatbot():
     """
     Handles chatbot queries.
-    Receives a user query, uses google_search to find relevant info,
+    Receives a user query, looks up relevant lore passages in the local index,
     then uses gemini-2.0-flash to generate a librarian-style response.
     """
     try:
@@ -33,25 +34,13 @@ def chatbot():
 
         print(f"Received query from frontend: {user_query}")
 
-        # Step 1: Use google_search to find relevant information
+        # Step 1: Look up relevant passages in the local lore index
         # This simulates the librarian looking up information
-        search_results_text = ""
         try:
-            # Using the provided google_search tool API
-            search_response = google_search.search(queries=[user_query])
-            
-            if search_response and search_response[0].results:
-                for result in search_response[0].results:
-                    if result.snippet:
-                        search_results_text += f"{result.snippet}\n"
-                if not search_results_text:
-                    search_results_text = "No specific information found in the library archives."
-            else:
-                search_results_text = "No specific information found in the library archives."
-
+            search_results_text = get_lore_index().context_for(user_query)
         except Exception as e:
-            print(f"Error during Google Search: {e}")
-            search_results_text = "Could not access the wider magical knowledge network at this moment."
+            print(f"Error during lore lookup: {e}")
+            search_results_text = "Could not access the library archives at this moment."
 
         # Step 2: Use gemini-2.0-flash to generate a librarian-style response
         # based on the search results and the user's query.
@@ -71,40 +60,22 @@ def chatbot():
         Librarian AI Response:
         """
 
-        # Prepare the payload for the Gemini API call
-        payload = {
-            "contents": [
-                {
-                    "role": "user",
-                    "parts": [{"text": prompt}]
-                }
-            ]
-        }
-        
-        # Gemini API endpoint (gemini-2.0-flash is default, no API key needed if empty string)
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={API_KEY}"
-
-        headers = {'Content-Type': 'application/json'}
-        
-        # Make the request to the Gemini API
-        gemini_response = requests.post(api_url, headers=headers, data=json.dumps(payload))
-        gemini_response.raise_for_status() # Raise an exception for HTTP errors
-
-        gemini_result = gemini_response.json()
-        
-        # Extract the text from the Gemini response
-        if gemini_result.get('candidates') and gemini_result['candidates'][0].get('content') and \
-           gemini_result['candidates'][0]['content'].get('parts') and \
-           gemini_result['candidates'][0]['content']['parts'][0].get('text'):
-            ai_response = gemini_result['candidates'][0]['content']['parts'][0].text
-        else:
+        # Make the request to the Gemini API through the shared pooled client
+        try:
+            ai_response, _ = get_cache().generate_or_fallback(
+                'librarian', user_query, lambda: get_client().generate_text(prompt, feature='librarian'),
+                canned=FALLBACK_REPLY)
+        except LLMEmptyResponse as empty_err:
+            print(f"Unexpected Gemini API response: {empty_err}")
             ai_response = "I apologize, I could not generate a response at this time. The magical ink seems to have run dry."
-            print("Unexpected Gemini API response structure:", gemini_result)
 
         return jsonify({'response': ai_response})
 
-    except requests.exceptions.RequestException as req_err:
-        print(f"Error connecting to Gemini API: {req_err}")
+    except LLMBusy as busy_err:
+        print(f"Gemini busy: {busy_err}")
+        return jsonify({'response': 'The library is very busy at the moment. Please ask again in a little while.'}), 503
+    except LLMError as llm_err:
+        print(f"Error connecting to Gemini API: {llm_err}")
         return jsonify({'response': 'A magical disruption is preventing me from accessing the knowledge network. Please try again shortly.'}), 500
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
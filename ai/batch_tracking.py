@@ -0,0 +1,299 @@
+"""
+Offline hand landmark extraction over image directories and video files
+
+Frames are split into contiguous chunks which are streamed through a pool of
+worker processes, each running its own HandTracker. The landmarks of every
+detected hand are collected into flat columns (one row per hand, with the
+frame index it came from) and written to an NPZ file, which is what gesture
+template datasets and regression fixtures are built from.
+
+Usage:
+    python batch_tracking.py <image directory | video file> -o landmarks.npz [--workers 4] [--step 1]
+"""
+import argparse
+import io
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from frame_decoding import decode_frame
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+NUM_LANDMARKS = 21
+
+
+def list_image_files(directory: str) -> List[str]:
+    """
+    Image files of a directory, sorted by name so frame indices are stable between runs
+    """
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def _tracker_options(inference_width: Optional[int], max_num_hands: int, static_image_mode: bool) -> Dict:
+    # Datasets want the raw per-frame landmarks: no smoothing and no skipped frames
+    return {
+        'static_image_mode': static_image_mode,
+        'max_num_hands': max_num_hands,
+        'temporal_smoothing': False,
+        'inference_width': inference_width,
+        'roi_tracking': not static_image_mode,
+        'change_threshold': 0
+    }
+
+
+def _image_frames(paths: List[Tuple[int, str]], inference_width: Optional[int]) -> Iterator[Tuple]:
+    for frame_index, path in paths:
+        try:
+            with open(path, 'rb') as image_file:
+                image, color = decode_frame(image_file.read(), inference_width)
+        except OSError as e:
+            logger.error(f"Error reading {path}: {e}")
+            image, color = None, 'bgr'
+        yield frame_index, os.path.basename(path), math.nan, image, color
+
+
+def _video_frames(path: str, start: int, stop: Optional[int], step: int) -> Iterator[Tuple]:
+    capture = cv2.VideoCapture(path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+        if start:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        frame_index = start
+        while stop is None or frame_index < stop:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if (frame_index - start) % step == 0:
+                timestamp = frame_index * 1000.0 / fps if fps > 0 else math.nan
+                yield frame_index, os.path.basename(path), timestamp, frame, 'bgr'
+            frame_index += 1
+    finally:
+        capture.release()
+
+
+def _extract_chunk(task: Tuple) -> List[Tuple]:
+    """
+    Worker entry point: run one chunk of frames through a fresh HandTracker
+
+    Returns:
+        One (frame_index, source, timestamp_ms, detections) tuple per frame;
+        detections is None for frames that could not be read
+    """
+    # Imported here so the parent process does not need to load MediaPipe
+    from handtracking import HandTracker
+
+    kind, source, start, stop, step, inference_width, max_num_hands = task
+    if kind == 'images':
+        frames = _image_frames(source, inference_width)
+    else:
+        frames = _video_frames(source, start, stop, step)
+
+    tracker = HandTracker(**_tracker_options(inference_width, max_num_hands, kind == 'images'))
+    results = []
+    try:
+        for frame_index, name, timestamp, image, color in frames:
+            detections = tracker.detect(image, color) if image is not None else None
+            results.append((frame_index, name, timestamp, detections))
+    finally:
+        tracker.cleanup()
+    return results
+
+
+def _build_tasks(source: str, chunk_size: int, frame_step: int,
+                 inference_width: Optional[int], max_num_hands: int) -> Tuple[List[Tuple], int]:
+    """
+    Split a source into chunk tasks
+
+    Returns:
+        (tasks, expected number of frames)
+    """
+    if os.path.isdir(source):
+        paths = list(enumerate(list_image_files(source)))[::frame_step]
+        tasks = [
+            ('images', paths[offset:offset + chunk_size], 0, None, 1, inference_width, max_num_hands)
+            for offset in range(0, len(paths), chunk_size)
+        ]
+        return tasks, len(paths)
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video: {source}")
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+
+    if frame_count <= 0:
+        # Unknown length (some containers/streams): read everything in one chunk
+        return [('video', source, 0, None, frame_step, inference_width, max_num_hands)], 0
+
+    span = chunk_size * frame_step
+    tasks = []
+    for start in range(0, frame_count, span):
+        # The frame count is only an estimate for some codecs, so the last chunk reads to the end
+        stop = start + span if start + span < frame_count else None
+        tasks.append(('video', source, start, stop, frame_step, inference_width, max_num_hands))
+    return tasks, int(math.ceil(frame_count / float(frame_step)))
+
+
+def extract_landmarks(source: str,
+                      num_workers: Optional[int] = None,
+                      chunk_size: int = 64,
+                      frame_step: int = 1,
+                      inference_width: Optional[int] = 640,
+                      max_num_hands: int = 2,
+                      executor: Optional[Executor] = None) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """
+    Extract hand landmarks from every frame of an image directory or video file
+
+    Args:
+        source: Directory of images or path to a video file
+        num_workers: Worker processes (default: CPU count); 0 or 1 runs in this process
+        chunk_size: Frames per worker task; video chunks keep tracking state within a chunk
+        frame_step: Process every n-th frame / image
+        inference_width: Frames are downscaled to this width before inference (None for full size)
+        max_num_hands: Maximum number of hands to detect per frame
+        executor: Long-lived process pool with num_workers workers to run the chunks on,
+            instead of starting one for this call
+
+    Returns:
+        (columns, stats) where columns are the arrays written by write_landmarks_npz and
+        stats holds frame counts, elapsed time and throughput in frames per second
+    """
+    chunk_size = max(1, chunk_size)
+    frame_step = max(1, frame_step)
+    tasks, expected_frames = _build_tasks(source, chunk_size, frame_step, inference_width, max_num_hands)
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(tasks))
+
+    logger.info(f"Extracting landmarks from {source}: {expected_frames or 'unknown'} frames, "
+                f"{len(tasks)} chunks, {max(num_workers, 1)} workers")
+
+    frames = []
+    started = time.perf_counter()
+    if executor is not None:
+        for chunk in executor.map(_extract_chunk, tasks):
+            frames.extend(chunk)
+            logger.debug(f"Extracted {len(frames)}/{expected_frames or '?'} frames")
+    elif num_workers <= 1:
+        for task in tasks:
+            frames.extend(_extract_chunk(task))
+    else:
+        # Spawn keeps MediaPipe's threads out of forked children
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(processes=num_workers) as pool:
+            for chunk in pool.imap(_extract_chunk, tasks):
+                frames.extend(chunk)
+                logger.debug(f"Extracted {len(frames)}/{expected_frames or '?'} frames")
+    elapsed = time.perf_counter() - started
+
+    columns = _to_columns(frames)
+    processed = int(len(columns['frame_index']))
+    stats = {
+        'source': source,
+        'frames_processed': processed,
+        'frames_failed': len(frames) - processed,
+        'hands_detected': int(len(columns['hand_frame_index'])),
+        'elapsed_seconds': round(elapsed, 3),
+        'frames_per_second': round(processed / elapsed, 2) if elapsed > 0 else 0.0
+    }
+    logger.info(f"Extracted {stats['hands_detected']} hands from {processed} frames "
+                f"in {elapsed:.1f}s ({stats['frames_per_second']} fps)")
+    return columns, stats
+
+
+def _to_columns(frames: List[Tuple]) -> Dict[str, np.ndarray]:
+    """
+    Flatten per-frame detections into columnar arrays (frame columns plus one row per hand)
+    """
+    frames = [frame for frame in frames if frame[3] is not None]
+    hand_counts = np.array([len(detections) for _, _, _, detections in frames], dtype=np.int32)
+    offsets = np.zeros(len(frames), dtype=np.int64)
+    if len(frames):
+        offsets[1:] = np.cumsum(hand_counts)[:-1]
+
+    hands = [(frame_index, detections) for frame_index, _, _, detections in frames if len(detections)]
+    if hands:
+        landmarks = np.concatenate([detections.landmarks for _, detections in hands]).astype(np.float32)
+    else:
+        landmarks = np.zeros((0, NUM_LANDMARKS, 3), dtype=np.float32)
+
+    return {
+        'frame_index': np.array([frame[0] for frame in frames], dtype=np.int64),
+        'frame_source': np.array([frame[1] for frame in frames], dtype=str),
+        'frame_timestamp_ms': np.array([frame[2] for frame in frames], dtype=np.float64),
+        'frame_hand_count': hand_counts,
+        'frame_hand_offset': offsets,
+        'hand_frame_index': np.array([frame_index for frame_index, detections in hands
+                                      for _ in range(len(detections))], dtype=np.int64),
+        'landmarks': landmarks,
+        'handedness': np.array([label for _, detections in hands for label in detections.handedness], dtype=str),
+        'handedness_score': np.array([score for _, detections in hands for score in detections.scores],
+                                     dtype=np.float32),
+        'gesture': np.array([gesture['name'] for _, detections in hands for gesture in detections.gestures],
+                            dtype=str),
+        'gesture_spell': np.array([gesture['spell'] or '' for _, detections in hands
+                                   for gesture in detections.gestures], dtype=str)
+    }
+
+
+def write_landmarks_npz(columns: Dict[str, np.ndarray], output) -> None:
+    """
+    Write extracted columns to a compressed NPZ file
+
+    Args:
+        columns: Arrays returned by extract_landmarks
+        output: File path or writable binary file object
+    """
+    np.savez_compressed(output, **columns)
+
+
+def landmarks_npz_bytes(columns: Dict[str, np.ndarray]) -> bytes:
+    """
+    Extracted columns as NPZ file contents
+    """
+    buffer = io.BytesIO()
+    write_landmarks_npz(columns, buffer)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Directory of images or a video file')
+    parser.add_argument('-o', '--output', default='landmarks.npz', help='NPZ file to write')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--chunk-size', type=int, default=64, help='Frames per worker task')
+    parser.add_argument('--step', type=int, default=1, help='Process every n-th frame')
+    parser.add_argument('--width', type=int, default=640, help='Inference width (0 for full resolution)')
+    parser.add_argument('--max-hands', type=int, default=2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    columns, stats = extract_landmarks(args.source,
+                                       num_workers=args.workers,
+                                       chunk_size=args.chunk_size,
+                                       frame_step=args.step,
+                                       inference_width=args.width or None,
+                                       max_num_hands=args.max_hands)
+    write_landmarks_npz(columns, args.output)
+
+    print(f"{stats['frames_processed']} frames ({stats['frames_failed']} unreadable), "
+          f"{stats['hands_detected']} hands in {stats['elapsed_seconds']}s "
+          f"-> {stats['frames_per_second']} fps")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
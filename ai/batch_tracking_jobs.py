@@ -0,0 +1,251 @@
+"""
+Background jobs for /track_hands/batch
+
+Landmark extraction over an uploaded video or image set takes as long as the
+video, so the route only saves the upload and submits a job; the client polls
+for the NPZ result. Jobs run one at a time on a job thread, and their chunks
+on one long-lived pool of worker processes instead of a pool per request.
+"""
+import logging
+import multiprocessing
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+
+from batch_tracking import extract_landmarks, landmarks_npz_bytes
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class BatchTrackingQueueFull(Exception):
+    """
+    Raised when the batch tracking queue is at capacity and a job cannot be accepted
+    """
+
+
+class BatchTrackingJob:
+    """
+    State of one landmark extraction job
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.result: Optional[bytes] = None
+        self.stats: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+
+    def to_dict(self) -> Dict:
+        info = {
+            'job_id': self.id,
+            'status': self.status,
+            'submitted_at': self.submitted_at
+        }
+        if self.finished_at is not None:
+            info['finished_at'] = self.finished_at
+            info['latency_seconds'] = round(self.finished_at - self.submitted_at, 3)
+        if self.stats is not None:
+            info['stats'] = {key: value for key, value in self.stats.items() if key != 'source'}
+        if self.error is not None:
+            info['error'] = self.error
+        return info
+
+
+class BatchTrackingJobQueue:
+    """
+    Bounded queue of offline landmark extraction jobs
+
+    At most max_pending jobs may be queued or running; further submissions are
+    rejected with BatchTrackingQueueFull. Finished results are kept for
+    result_ttl seconds so clients can poll for them. The executors are started
+    lazily on the first job, so importing a module that creates a queue (e.g.
+    in a spawned child process) is cheap.
+    """
+
+    def __init__(self,
+                 num_workers: int = 2,
+                 max_pending: int = 2,
+                 result_ttl: float = 600.0,
+                 max_jobs: int = 32,
+                 inference_width: Optional[int] = 640):
+        """
+        Initialize the BatchTrackingJobQueue
+
+        Args:
+            num_workers: Worker processes extracting landmarks; 0 or 1 runs on the job thread
+            max_pending: Jobs that may be queued or running at the same time
+            result_ttl: Seconds a finished job and its result are kept
+            max_jobs: Upper bound on retained jobs, oldest finished jobs are dropped first
+            inference_width: Frames are downscaled to this width before inference (None for full size)
+        """
+        self.num_workers = max(0, int(num_workers))
+        self.max_pending = max(1, int(max_pending))
+        self.result_ttl = float(result_ttl)
+        self.max_jobs = max(self.max_pending, int(max_jobs))
+        self.inference_width = inference_width
+
+        self._jobs: "OrderedDict[str, BatchTrackingJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._job_thread = None
+        self._process_pool = None
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.frames_processed = 0
+
+    def _process_executor(self) -> Optional[ProcessPoolExecutor]:
+        with self._lock:
+            if self.num_workers <= 1:
+                return None
+            if self._process_pool is None:
+                # Spawn keeps MediaPipe's threads out of the workers
+                self._process_pool = ProcessPoolExecutor(max_workers=self.num_workers,
+                                                         mp_context=multiprocessing.get_context('spawn'))
+                logger.info(f"Batch tracking process pool started with {self.num_workers} workers")
+            return self._process_pool
+
+    def submit(self, workdir: str, source: str, frame_step: int = 1) -> BatchTrackingJob:
+        """
+        Queue a landmark extraction job
+
+        Args:
+            workdir: Directory holding the upload; the job deletes it once it has finished
+            source: Video file or image directory inside workdir
+            frame_step: Process every n-th frame / image
+
+        Raises:
+            BatchTrackingQueueFull: If max_pending jobs are already queued or running
+        """
+        with self._lock:
+            self._evict_expired()
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise BatchTrackingQueueFull(f"{self.pending} batch tracking jobs pending")
+
+            if self._job_thread is None:
+                self._job_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batch-tracking')
+            job = BatchTrackingJob()
+            self._jobs[job.id] = job
+            self.pending += 1
+            future = self._job_thread.submit(self._run, job, workdir, source, frame_step)
+
+        future.add_done_callback(lambda completed: self._finish(job, completed))
+        logger.debug(f"Queued batch tracking job {job.id} ({source})")
+        return job
+
+    def _run(self, job: BatchTrackingJob, workdir: str, source: str, frame_step: int) -> Tuple[bytes, Dict]:
+        job.status = 'running'
+        try:
+            executor = self._process_executor()
+            try:
+                columns, stats = extract_landmarks(source,
+                                                   num_workers=self.num_workers,
+                                                   frame_step=frame_step,
+                                                   inference_width=self.inference_width,
+                                                   executor=executor)
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory); start a fresh pool for the next job
+                with self._lock:
+                    if self._process_pool is executor:
+                        self._process_pool = None
+                raise
+            return landmarks_npz_bytes(columns), stats
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _finish(self, job: BatchTrackingJob, future):
+        try:
+            job.result, job.stats = future.result()
+            job.status = 'done'
+        except BrokenProcessPool as e:
+            logger.error(f"Batch tracking worker crashed during job {job.id}: {e}")
+            job.error = 'Batch tracking worker crashed'
+            job.status = 'error'
+        except Exception as e:
+            logger.error(f"Batch tracking job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = 'error'
+        job.finished_at = time.time()
+
+        with self._lock:
+            self.pending -= 1
+            if job.status == 'done':
+                self.completed += 1
+                self.frames_processed += job.stats['frames_processed']
+            else:
+                self.failed += 1
+        job.done.set()
+
+    def get(self, job_id: str) -> Optional[BatchTrackingJob]:
+        """
+        Look up a job; None if it is unknown or has expired
+        """
+        with self._lock:
+            self._evict_expired()
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id: str, timeout: float) -> Optional[BatchTrackingJob]:
+        """
+        Long-poll: wait up to timeout seconds for a job to finish
+
+        Returns:
+            The job (finished or not), or None if it is unknown or has expired
+        """
+        job = self.get(job_id)
+        if job is not None and timeout > 0:
+            job.done.wait(timeout)
+        return job
+
+    def _evict_expired(self):
+        """
+        Drop finished jobs past their TTL and the oldest finished jobs beyond max_jobs. Caller must hold the lock.
+        """
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.finished_at is not None]
+        overflow = len(self._jobs) - self.max_jobs
+        for job in finished:
+            if now - job.finished_at > self.result_ttl or overflow > 0:
+                del self._jobs[job.id]
+                self.expired += 1
+                overflow -= 1
+
+    def stats(self) -> Dict:
+        """
+        Queue depth and job counters
+        """
+        with self._lock:
+            return {
+                'workers': self.num_workers,
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'retained_jobs': len(self._jobs),
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'expired': self.expired,
+                'frames_processed': self.frames_processed,
+                'result_ttl_seconds': self.result_ttl
+            }
+
+    def cleanup(self):
+        """
+        Shut the executors down
+        """
+        with self._lock:
+            executors = (self._job_thread, self._process_pool)
+            self._job_thread = self._process_pool = None
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("BatchTrackingJobQueue cleaned up")
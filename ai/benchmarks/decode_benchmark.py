@@ -0,0 +1,114 @@
+"""
+Micro-benchmark for the hand tracking frame decode path
+
+Compares the original pipeline (base64 data URL -> BGR decode at full size ->
+resize -> BGR to RGB copy) with the fast path (raw JPEG bytes -> reduced-scale
+RGB decode -> resize into a reused buffer) and reports time and peak memory
+allocated per frame.
+
+Usage:
+    python benchmarks/decode_benchmark.py [--iterations 200] [--width 640]
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from frame_decoding import decode_frame  # noqa: E402
+
+
+def synthetic_frame(width, height, seed=0):
+    """
+    Webcam-like test frame: smooth gradients plus sensor noise, so JPEG sizes are realistic
+    """
+    rng = np.random.default_rng(seed)
+    xs = np.linspace(0, 255, width, dtype=np.float32)
+    ys = np.linspace(0, 255, height, dtype=np.float32)
+    frame = np.empty((height, width, 3), dtype=np.float32)
+    frame[..., 0] = xs[None, :]
+    frame[..., 1] = ys[:, None]
+    frame[..., 2] = (xs[None, :] + ys[:, None]) / 2
+    frame += rng.normal(0, 8, frame.shape)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def resize_to_width(image, width, dst=None):
+    if image.shape[1] <= width:
+        return image
+    height = max(1, int(round(image.shape[0] * width / float(image.shape[1]))))
+    if dst is not None and dst.shape != (height, width, 3):
+        dst = None
+    return cv2.resize(image, (width, height), dst=dst, interpolation=cv2.INTER_AREA)
+
+
+def legacy_pipeline(data_url, width, buffers):
+    """
+    The original path: split the data URL, base64-decode, decode BGR at full size, convert to RGB
+    """
+    header, encoded = data_url.split(',', 1)
+    image_bytes = base64.b64decode(encoded)
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    image = resize_to_width(image, width)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def fast_pipeline(jpeg_bytes, width, buffers):
+    """
+    The fast path: raw bytes, reduced-scale decode straight to RGB, resize into a reused buffer
+    """
+    image, color = decode_frame(jpeg_bytes, width)
+    resized = resize_to_width(image, width, buffers.get('resized'))
+    buffers['resized'] = resized
+    if color == 'bgr':
+        return cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=buffers.get('rgb'))
+    return resized
+
+
+def measure(pipeline, payload, width, iterations):
+    buffers = {}
+    # Warm up (and let the fast path allocate its reusable buffers)
+    for _ in range(5):
+        pipeline(payload, width, buffers)
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        pipeline(payload, width, buffers)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    pipeline(payload, width, buffers)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed / iterations * 1000.0, peak / (1024.0 * 1024.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--width', type=int, default=640, help='Inference width frames are prepared for')
+    args = parser.parse_args()
+
+    print(f"{'frame':>10} {'path':>8} {'ms/frame':>10} {'peak MiB':>10}")
+    for frame_width, frame_height in ((640, 480), (1280, 720), (1920, 1080)):
+        ok, encoded = cv2.imencode('.jpg', synthetic_frame(frame_width, frame_height),
+                                   [cv2.IMWRITE_JPEG_QUALITY, 80])
+        jpeg_bytes = encoded.tobytes()
+        data_url = 'data:image/jpeg;base64,' + base64.b64encode(jpeg_bytes).decode('ascii')
+
+        label = f"{frame_width}x{frame_height}"
+        for name, pipeline, payload in (('legacy', legacy_pipeline, data_url),
+                                        ('fast', fast_pipeline, jpeg_bytes)):
+            ms, peak = measure(pipeline, payload, args.width, args.iterations)
+            print(f"{label:>10} {name:>8} {ms:>10.2f} {peak:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
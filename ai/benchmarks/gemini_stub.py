@@ -0,0 +1,182 @@
+"""
+Local stand-in for the Gemini REST API, for benchmarks and offline development
+
+Answers generateContent (JSON) and streamGenerateContent (server-sent events)
+for any model with a canned reply after a configurable delay, so request
+paths that call Gemini can be measured without network access or quota.
+embedContent returns a hashed bag-of-words vector, so texts sharing words
+are similar.
+
+Usage:
+    python benchmarks/gemini_stub.py [--port 8089] [--latency-ms 200]
+    GEMINI_API_BASE=http://127.0.0.1:8089 python app.py
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = ("Ah, an excellent question. The archives of the Hogwarts library hold many volumes "
+                 "on that very subject; allow me to summarize what the shelves have to say.")
+
+
+def gemini_response(text):
+    """
+    generateContent response body with a single candidate
+    """
+    return {
+        'candidates': [{
+            'content': {'role': 'model', 'parts': [{'text': text}]},
+            'finishReason': 'STOP',
+            'index': 0
+        }],
+        'usageMetadata': {'promptTokenCount': 0, 'candidatesTokenCount': len(text.split())}
+    }
+
+
+def stub_embedding(text, dimensions=256):
+    """
+    Deterministic embedding: each word adds one to a hashed dimension
+    """
+    values = [0.0] * dimensions
+    for word in text.lower().split():
+        values[int(hashlib.md5(word.encode('utf-8')).hexdigest(), 16) % dimensions] += 1.0
+    return values
+
+
+class GeminiStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are separate writes; without TCP_NODELAY a kept-alive
+    # client connection stalls on delayed ACKs for ~40 ms per answer
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Keep benchmark output clean
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        self.server.requests_served += 1
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'code': 400, 'message': 'Invalid JSON payload'}})
+            return
+
+        time.sleep(self.server.latency)
+        if ':streamGenerateContent' in self.path:
+            self._send_stream(self.server.reply)
+        elif ':generateContent' in self.path:
+            self._send_json(200, gemini_response(self.server.reply))
+        elif ':embedContent' in self.path:
+            parts = (request.get('content') or {}).get('parts') or []
+            text = ' '.join(part.get('text', '') for part in parts)
+            self._send_json(200, {'embedding': {'values': stub_embedding(text)}})
+        else:
+            self._send_json(404, {'error': {'code': 404, 'message': f'Unknown method {self.path}'}})
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, text):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        words = text.split(' ')
+        try:
+            for index in range(0, len(words), 4):
+                chunk = ' '.join(words[index:index + 4]) + (' ' if index + 4 < len(words) else '')
+                self.wfile.write(f"data: {json.dumps(gemini_response(chunk))}\r\n\r\n".encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(self.server.chunk_delay)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client hung up mid-stream, like a cancelled request
+            self.server.streams_aborted += 1
+        self.close_connection = True
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    # Bursts of concurrent calls (the ASGI benchmark) must not overflow the listen backlog
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class GeminiStubServer:
+    """
+    Threaded stub server; usable as a context manager that runs it in the background
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.05, chunk_delay=0.005, reply=DEFAULT_REPLY):
+        """
+        Args:
+            host: Interface to bind
+            port: Port to bind, 0 for a free one
+            latency: Seconds to wait before answering, like model time-to-first-token
+            chunk_delay: Seconds between streamed chunks
+            reply: Text of every answer
+        """
+        self.httpd = _StubHTTPServer((host, port), GeminiStubHandler)
+        self.httpd.latency = latency
+        self.httpd.chunk_delay = chunk_delay
+        self.httpd.reply = reply
+        self.httpd.requests_served = 0
+        self.httpd.streams_aborted = 0
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def requests_served(self):
+        return self.httpd.requests_served
+
+    @property
+    def streams_aborted(self):
+        return self.httpd.streams_aborted
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name='gemini-stub')
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency-ms', type=float, default=200.0, help='Delay before every answer')
+    args = parser.parse_args()
+
+    server = GeminiStubServer(args.host, args.port, latency=args.latency_ms / 1000.0)
+    print(f"Gemini stub listening on {server.base_url} (set GEMINI_API_BASE to this URL)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,504 @@
+"""
+Benchmark suite for the AI backend
+
+Measures every registered spell at several image sizes, HandTracker.process_frame
+on synthetic (and optionally recorded) frames, decode_base64_image, lore
+retrieval, and the full /track_hands, /ai/transform_image and /api/chatbot
+request paths (plus the time to the first token of /api/chatbot/stream) through
+the Flask test client, and a burst of concurrent /api/chatbot requests through
+the ASGI app (asgi.py).
+Gemini is replaced by a local stub server. Inputs are generated from fixed
+seeds, so runs on the same machine are comparable.
+
+Every case reports p50/p95/p99 latency, throughput and peak RSS, and the
+results are written as JSON. Cases run one after another in this process, so
+peak RSS is a high-water mark; --isolate runs every case in a fresh process
+to get per-case peaks.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--iterations 30] [--filter spell.] [--output results.json]
+    python benchmarks/run_benchmarks.py --compare baseline.json --output current.json
+    python benchmarks/run_benchmarks.py --frames recordings/cast_01.mp4
+"""
+import argparse
+import base64
+import importlib.metadata
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+AI_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, AI_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from decode_benchmark import synthetic_frame  # noqa: E402
+from gemini_stub import GeminiStubServer  # noqa: E402
+
+IMAGE_SIZES = ((640, 480), (1920, 1080), (4000, 3000))
+FRAME_SIZES = ((640, 480), (1280, 720))
+# Recorded frames loaded for the hand tracking cases
+MAX_RECORDED_FRAMES = 120
+
+
+def benchmark_environment(stub_url):
+    """
+    Configure the app for benchmarking; must run before app is imported
+    """
+    # Measure the work itself, not the caches in front of it
+    os.environ['TRANSFORM_CACHE_MEMORY_MB'] = '0'
+    os.environ.pop('TRANSFORM_CACHE_DIR', None)
+    os.environ['HAND_TRACKER_CHANGE_THRESHOLD'] = '0'
+    os.environ['REMBG_WARMUP'] = '0'
+    os.environ['GEMINI_API_BASE'] = stub_url
+    os.environ['GEMINI_API_KEY'] = 'benchmark'
+    # Iterations would otherwise run into the Gemini rate budget
+    os.environ['LLM_RATE_PER_MINUTE'] = '0'
+
+
+def asgi_dependencies_available():
+    try:
+        import a2wsgi  # noqa: F401
+        import httpx  # noqa: F401
+        import starlette  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def rembg_model_available():
+    """
+    Whether the rembg model is already downloaded; Evanesco is skipped otherwise
+    """
+    model = os.getenv('REMBG_MODEL', 'u2net')
+    home = os.path.expanduser(os.getenv('U2NET_HOME', os.path.join(os.getenv('XDG_DATA_HOME', '~'), '.u2net')))
+    return os.path.exists(os.path.join(home, f"{model}.onnx"))
+
+
+def encode_jpeg(image, quality=85):
+    ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes()
+
+
+def synthetic_frames(width, height, count=8):
+    """
+    A few distinct frames so nothing downstream can short-circuit on identical input
+    """
+    return [synthetic_frame(width, height, seed=seed) for seed in range(count)]
+
+
+def load_recorded_frames(source):
+    """
+    Frames from a video file or an image directory (BGR), for the recorded hand tracking case
+    """
+    from batch_tracking import list_image_files
+
+    frames = []
+    if os.path.isdir(source):
+        for path in list_image_files(source)[:MAX_RECORDED_FRAMES]:
+            image = cv2.imread(path)
+            if image is not None:
+                frames.append(image)
+    else:
+        capture = cv2.VideoCapture(source)
+        while len(frames) < MAX_RECORDED_FRAMES:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames.append(frame)
+        capture.release()
+    return frames
+
+
+def cycle(items):
+    state = {'index': 0}
+
+    def next_item():
+        item = items[state['index'] % len(items)]
+        state['index'] += 1
+        return item
+    return next_item
+
+
+# ---------------------------------------------------------------------------
+# Cases: factory(args) -> operation (a callable timed per iteration)
+# ---------------------------------------------------------------------------
+
+def spell_case(spell, width, height):
+    def factory(args):
+        from transform import run_pipeline
+
+        image = cv2.cvtColor(synthetic_frame(width, height), cv2.COLOR_BGR2RGB)
+        buffer = np.empty_like(image)
+
+        def operation():
+            # Stages work in place, so every iteration starts from a fresh copy
+            np.copyto(buffer, image)
+            run_pipeline([spell], buffer)
+        return operation
+    return factory
+
+
+def process_frame_case(width, height):
+    def factory(args):
+        from handtracking import HandTracker
+
+        tracker = HandTracker(change_threshold=0)
+        next_frame = cycle(synthetic_frames(width, height))
+        return lambda: tracker.process_frame(next_frame())
+    return factory
+
+
+def recorded_process_frame_case(args):
+    from handtracking import HandTracker
+
+    frames = load_recorded_frames(args.frames)
+    if not frames:
+        raise RuntimeError(f"No frames could be read from {args.frames}")
+    tracker = HandTracker(change_threshold=0)
+    next_frame = cycle(frames)
+    return lambda: tracker.process_frame(next_frame())
+
+
+def decode_base64_case(width, height):
+    def factory(args):
+        import app
+
+        data_url = 'data:image/jpeg;base64,' + base64.b64encode(
+            encode_jpeg(synthetic_frame(width, height))).decode('ascii')
+        return lambda: app.decode_base64_image(data_url)
+    return factory
+
+
+def lore_search_case(args):
+    from lore_index import get_lore_index
+
+    index = get_lore_index()
+    queries = cycle(['Who founded Hogwarts?', 'What does Expelliarmus do?', 'expeliarmus',
+                     'What is a Horcrux?', 'what is the capital of france'])
+    return lambda: index.context_for(queries())
+
+
+def track_hands_case(width, height, mode):
+    def factory(args):
+        import app
+
+        client = app.app.test_client()
+        payloads = [encode_jpeg(frame) for frame in synthetic_frames(width, height)]
+        next_payload = cycle(payloads)
+
+        if mode == 'json':
+            urls = ['data:image/jpeg;base64,' + base64.b64encode(payload).decode('ascii') for payload in payloads]
+            next_url = cycle(urls)
+
+            def operation():
+                response = client.post('/track_hands', json={'image': next_url(), 'session_id': 'benchmark'})
+                assert response.status_code == 200, response.status_code
+        else:
+            def operation():
+                response = client.post('/track_hands?session_id=benchmark&format=packed',
+                                       data=next_payload(), content_type='image/jpeg')
+                assert response.status_code == 200, response.status_code
+        return operation
+    return factory
+
+
+def transform_endpoint_case(spell, width, height):
+    def factory(args):
+        import app
+
+        client = app.app.test_client()
+        upload = encode_jpeg(synthetic_frame(width, height))
+
+        def operation():
+            response = client.post('/ai/transform_image',
+                                   data={'image': (io.BytesIO(upload), 'benchmark.jpg'), 'spell': spell},
+                                   content_type='multipart/form-data')
+            assert response.status_code == 200, response.status_code
+            response.get_data()
+        return operation
+    return factory
+
+
+def chatbot_case(cached):
+    def factory(args):
+        import app
+
+        client = app.app.test_client()
+        queries = cycle(['Tell me about Harry Potter', 'Which spells should a first year learn?',
+                         'Who were the Hogwarts founders?', 'What is a Horcrux?'])
+
+        def operation():
+            if not cached:
+                # Measure the round trip to the (stub) model, not the response cache
+                app.response_cache.clear()
+            response = client.post('/api/chatbot', json={'query': queries()})
+            assert response.status_code == 200, response.status_code
+        return operation
+    return factory
+
+
+def chatbot_stream_first_token_case(args):
+    import app
+
+    client = app.app.test_client()
+    queries = cycle(['Tell me about Harry Potter', 'What is a Horcrux?'])
+
+    def operation():
+        # Time to the first streamed token; closing early also exercises upstream cancellation
+        app.response_cache.clear()
+        response = client.post('/api/chatbot/stream', json={'query': queries()})
+        assert response.status_code == 200, response.status_code
+        next(response.iter_encoded())
+        response.close()
+    return operation
+
+
+def asgi_chatbot_burst_case(concurrency):
+    def factory(args):
+        import asyncio
+        import itertools
+
+        import httpx
+
+        import asgi
+
+        # One loop for all iterations: the async Gemini client's pools belong to it
+        loop = asyncio.new_event_loop()
+        question_numbers = itertools.count()
+
+        async def burst():
+            transport = httpx.ASGITransport(app=asgi.app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://asgi') as client:
+                # Distinct questions, so every request reaches the (stub) model
+                responses = await asyncio.gather(*[
+                    client.post('/api/chatbot', json={'query': f"Question number {next(question_numbers)}"})
+                    for _ in range(concurrency)])
+            statuses = {response.status_code for response in responses}
+            assert statuses == {200}, statuses
+
+        def operation():
+            loop.run_until_complete(burst())
+        return operation
+    return factory
+
+
+def build_cases(args):
+    """
+    Ordered {name: (factory, iteration weight)} of all benchmark cases
+    """
+    from transform import SPELL_REGISTRY
+
+    cases = {}
+    for spell in SPELL_REGISTRY.values():
+        for width, height in IMAGE_SIZES:
+            # Bigger images get fewer iterations so a run stays reasonably short
+            weight = min(1.0, 1_000_000.0 / (width * height) + 0.1)
+            cases[f"spell.{spell.name}[{width}x{height}]"] = (spell_case(spell.name, width, height), weight)
+    for width, height in FRAME_SIZES:
+        cases[f"hand_tracking.process_frame[synthetic {width}x{height}]"] = (process_frame_case(width, height), 1.0)
+    if args.frames:
+        cases["hand_tracking.process_frame[recorded]"] = (recorded_process_frame_case, 1.0)
+    for width, height in FRAME_SIZES:
+        cases[f"decode_base64_image[{width}x{height}]"] = (decode_base64_case(width, height), 1.0)
+    cases["lore_index.context_for[top 3]"] = (lore_search_case, 1.0)
+    for mode in ('json', 'raw'):
+        cases[f"endpoint./track_hands[{mode} 640x480]"] = (track_hands_case(640, 480, mode), 1.0)
+    for spell in ('lumos', 'pictorifica'):
+        cases[f"endpoint./ai/transform_image[{spell} 1920x1080]"] = (transform_endpoint_case(spell, 1920, 1080), 0.5)
+    cases["endpoint./api/chatbot[stub]"] = (chatbot_case(cached=False), 1.0)
+    cases["endpoint./api/chatbot[cached]"] = (chatbot_case(cached=True), 1.0)
+    cases["endpoint./api/chatbot/stream[first token]"] = (chatbot_stream_first_token_case, 1.0)
+    cases["asgi./api/chatbot[256 concurrent]"] = (asgi_chatbot_burst_case(256), 0.3)
+    return cases
+
+
+def skip_reason(name):
+    if name.startswith('spell.evanesco') and not rembg_model_available():
+        return 'rembg model not downloaded'
+    if name.startswith('asgi.') and not asgi_dependencies_available():
+        return 'ASGI dependencies (starlette, a2wsgi, httpx) not installed'
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def measure(operation, iterations, warmup):
+    for _ in range(warmup):
+        operation()
+
+    samples = np.empty(iterations)
+    started = time.perf_counter()
+    for index in range(iterations):
+        iteration_started = time.perf_counter()
+        operation()
+        samples[index] = time.perf_counter() - iteration_started
+    elapsed = time.perf_counter() - started
+
+    samples *= 1000.0
+    return {
+        'iterations': iterations,
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+        'throughput_per_second': round(iterations / elapsed, 2) if elapsed > 0 else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+
+
+def run_case(name, args):
+    """
+    Set up and measure one case; returns its result record
+    """
+    cases = build_cases(args)
+    factory, weight = cases[name]
+    reason = skip_reason(name)
+    if reason:
+        return {'name': name, 'skipped': reason}
+
+    operation = factory(args)
+    iterations = max(3, int(round(args.iterations * weight)))
+    warmup = max(1, min(args.warmup, iterations))
+    return dict({'name': name}, **measure(operation, iterations, warmup))
+
+
+def run_isolated_case(name, args, stub_url):
+    benchmark_environment(stub_url)
+    result = run_case(name, args)
+    shutdown_app()
+    return result
+
+
+def shutdown_app():
+    app = sys.modules.get('app')
+    if app is not None:
+        app.hand_tracker.cleanup()
+        app.transform_jobs.cleanup()
+
+
+def run_metadata(args):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=AI_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+
+    versions = {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__}
+    for distribution in ('mediapipe', 'pillow', 'flask', 'onnxruntime', 'rembg'):
+        try:
+            versions[distribution] = importlib.metadata.version(distribution)
+        except importlib.metadata.PackageNotFoundError:
+            versions[distribution] = None
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': commit,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'versions': versions,
+        'iterations': args.iterations,
+        'warmup': args.warmup,
+        'isolated': args.isolate
+    }
+
+
+def compare(results, baseline_path):
+    """
+    Print the p50/p95 change of every case against a previous results file
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = {record['name']: record for record in json.load(baseline_file)['results']}
+
+    print(f"\nCompared with {baseline_path}:")
+    print(f"{'case':<52} {'p50 ms':>18} {'p95 ms':>18}")
+    for record in results:
+        before = baseline.get(record['name'])
+        if before is None or 'p50_ms' not in record or 'p50_ms' not in before:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms'):
+            delta = (record[key] - before[key]) / before[key] * 100.0 if before[key] else 0.0
+            changes.append(f"{before[key]:.1f}->{record[key]:.1f} {delta:+.0f}%")
+        print(f"{record['name']:<52} {changes[0]:>18} {changes[1]:>18}")
+
+
+def print_result(record):
+    if 'skipped' in record:
+        print(f"{record['name']:<52} skipped: {record['skipped']}")
+        return
+    print(f"{record['name']:<52} {record['p50_ms']:>9.2f} {record['p95_ms']:>9.2f} {record['p99_ms']:>9.2f} "
+          f"{record['throughput_per_second']:>9.1f} {record['peak_rss_mb']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=30, help='Timed iterations per case (scaled down for big inputs)')
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed iterations before measuring')
+    parser.add_argument('--filter', default=None, help='Only run cases whose name contains this text')
+    parser.add_argument('--frames', default=None, help='Video file or image directory with recorded frames')
+    parser.add_argument('--isolate', action='store_true', help='Run every case in a fresh process')
+    parser.add_argument('--stub-latency-ms', type=float, default=50.0, help='Latency of the Gemini stub')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON results file')
+    parser.add_argument('--compare', default=None, help='Previous results file to compare against')
+    parser.add_argument('--list', action='store_true', help='List the cases and exit')
+    args = parser.parse_args()
+
+    with GeminiStubServer(latency=args.stub_latency_ms / 1000.0) as stub:
+        benchmark_environment(stub.base_url)
+        names = [name for name in build_cases(args) if not args.filter or args.filter in name]
+        if args.list:
+            print('\n'.join(names))
+            return
+
+        print(f"{'case':<52} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9} {'peak MiB':>9}")
+        results = []
+        for name in names:
+            try:
+                if args.isolate:
+                    context = multiprocessing.get_context('spawn')
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                        record = executor.submit(run_isolated_case, name, args, stub.base_url).result()
+                else:
+                    record = run_case(name, args)
+            except Exception as e:
+                record = {'name': name, 'error': f"{type(e).__name__}: {e}"}
+                print(f"{name:<52} error: {record['error']}")
+                results.append(record)
+                continue
+            print_result(record)
+            results.append(record)
+
+        if not args.isolate:
+            shutdown_app()
+
+    report = {'metadata': run_metadata(args), 'results': results}
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import cv2
+import numpy as np
+import logging
+from typing import Optional, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Decode straight to RGB when this OpenCV build supports it (4.10+),
+# which saves the BGR -> RGB conversion copy before MediaPipe
+IMREAD_COLOR_RGB = getattr(cv2, 'IMREAD_COLOR_RGB', None)
+
+# libjpeg(-turbo) can decode at 1/2, 1/4 or 1/8 scale directly in the DCT
+# domain, which is much cheaper than decoding at full size and resizing.
+# The reduced *grayscale* flags only carry the scale bits and are combined
+# with the colour flag below.
+_REDUCED_SCALE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+
+# JPEG start-of-frame markers carrying the image dimensions
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_dimensions(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Read (width, height) from a JPEG header without decoding the image
+
+    Returns:
+        (width, height) or None if data is not a JPEG or the header is incomplete
+    """
+    view = memoryview(data)
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+
+    offset = 2
+    while offset + 9 < len(view):
+        if view[offset] != 0xFF:
+            return None
+        marker = view[offset + 1]
+        if marker == 0xFF:
+            # Fill byte
+            offset += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        segment_length = (view[offset + 2] << 8) | view[offset + 3]
+        if marker in _SOF_MARKERS:
+            height = (view[offset + 5] << 8) | view[offset + 6]
+            width = (view[offset + 7] << 8) | view[offset + 8]
+            return width, height
+        offset += 2 + segment_length
+    return None
+
+
+def decode_frame(image_bytes, target_width: Optional[int] = None) -> Tuple[Optional[np.ndarray], str]:
+    """
+    Decode an encoded frame (JPEG, PNG, ...) for hand tracking
+
+    JPEGs wider than twice target_width are decoded at a reduced scale, and
+    the result is produced directly in RGB when OpenCV supports it.
+
+    Args:
+        image_bytes: Encoded image (bytes, bytearray or memoryview)
+        target_width: Width the frame is going to be processed at; None for full size
+
+    Returns:
+        (image, color) where color is 'rgb' or 'bgr', or (None, 'bgr') on failure
+    """
+    try:
+        buffer = np.frombuffer(image_bytes, np.uint8)
+
+        scale_flag = 0
+        if target_width:
+            dimensions = jpeg_dimensions(image_bytes)
+            if dimensions is not None:
+                for factor, flag in _REDUCED_SCALE_FLAGS:
+                    if dimensions[0] // factor >= target_width:
+                        scale_flag = flag
+                        break
+
+        if IMREAD_COLOR_RGB is not None:
+            image, color = cv2.imdecode(buffer, scale_flag | IMREAD_COLOR_RGB), 'rgb'
+        else:
+            image, color = cv2.imdecode(buffer, scale_flag | cv2.IMREAD_COLOR), 'bgr'
+
+        if image is None:
+            raise ValueError("Failed to decode image")
+
+        return image, color
+
+    except Exception as e:
+        logger.error(f"Error decoding frame: {e}")
+        return None, 'bgr'
@@ -0,0 +1,172 @@
+import numpy as np
+import logging
+from typing import List, Dict, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+FINGERS = ('thumb', 'index', 'middle', 'ring', 'pinky')
+
+# Landmark indices of each finger chain, from the knuckle to the tip
+FINGER_JOINTS = np.array([
+    [1, 2, 3, 4],     # Thumb (CMC, MCP, IP, TIP)
+    [5, 6, 7, 8],     # Index (MCP, PIP, DIP, TIP)
+    [9, 10, 11, 12],  # Middle
+    [13, 14, 15, 16], # Ring
+    [17, 18, 19, 20]  # Pinky
+])
+
+WRIST = 0
+INDEX_MCP = 5
+MIDDLE_MCP = 9
+
+# A finger counts as extended when its two lowest joint angles are this straight
+# (cosine between consecutive bone vectors) and its tip is further from the wrist than its middle joint
+EXTENDED_MIN_COS = 0.6
+THUMB_EXTENDED_MIN_COS = 0.75
+# Thumb tip distance from the index knuckle, relative to palm size, above which the thumb is out
+THUMB_SPREAD_MIN = 0.55
+
+# Declarative gesture table, evaluated top to bottom; the first match wins.
+#   fingers: required state per finger (thumb, index, middle, ring, pinky),
+#            1 = extended, 0 = folded, None = either
+#   max_pinch / min_pinch: bounds on the thumb tip to index tip distance,
+#            relative to palm size
+#   spell: frontend spell this gesture casts (see HandTracking.jsx), if any
+GESTURE_DEFINITIONS: List[Dict] = [
+    {'name': 'fist', 'fingers': (0, 0, 0, 0, 0), 'spell': 'shadow'},
+    {'name': 'pinch', 'fingers': (None, None, 0, 0, 0), 'max_pinch': 0.25, 'spell': None},
+    {'name': 'pointing', 'fingers': (None, 1, 0, 0, 0), 'spell': 'fire'},
+    {'name': 'thumbs_up', 'fingers': (1, 0, 0, 0, 0), 'spell': 'nature'},
+    {'name': 'peace', 'fingers': (0, 1, 1, 0, 0), 'spell': 'lightning'},
+    {'name': 'horns', 'fingers': (None, 1, 0, 0, 1), 'spell': None},
+    {'name': 'open_palm', 'fingers': (1, 1, 1, 1, 1), 'spell': 'ice'},
+]
+
+
+class GestureEngine:
+    """
+    Batch gesture classifier over (N, 21, 3) landmark arrays
+
+    Every hand in the batch is reduced to a handful of vectorized features
+    (finger extension from joint angles, pinch distance) which are matched
+    against all gesture definitions at once, so the per-hand cost does not
+    grow with the number of gestures.
+    """
+
+    def __init__(self, definitions: Optional[List[Dict]] = None):
+        """
+        Initialize the GestureEngine
+
+        Args:
+            definitions: Gesture table in the GESTURE_DEFINITIONS format
+        """
+        definitions = GESTURE_DEFINITIONS if definitions is None else definitions
+        self.definitions = definitions
+        self.names = [definition['name'] for definition in definitions]
+        self.spells = [definition.get('spell') for definition in definitions]
+        self.spell_by_name = dict(zip(self.names, self.spells))
+
+        patterns = np.zeros((len(definitions), len(FINGERS)), dtype=bool)
+        constrained = np.zeros((len(definitions), len(FINGERS)), dtype=bool)
+        for row, definition in enumerate(definitions):
+            for column, state in enumerate(definition['fingers']):
+                if state is not None:
+                    constrained[row, column] = True
+                    patterns[row, column] = bool(state)
+        self._patterns = patterns
+        self._constrained = constrained
+        self._max_pinch = np.array([definition.get('max_pinch', np.inf) for definition in definitions])
+        self._min_pinch = np.array([definition.get('min_pinch', -np.inf) for definition in definitions])
+
+    def features(self, landmarks: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Compute per-hand features
+
+        Args:
+            landmarks: Array of shape (N, 21, 3)
+
+        Returns:
+            Dictionary with 'extended' (N, 5) bool and 'pinch' (N,) float arrays
+        """
+        landmarks = np.asarray(landmarks, dtype=np.float32)
+        wrist = landmarks[:, WRIST]
+        palm_size = np.linalg.norm(landmarks[:, MIDDLE_MCP] - wrist, axis=-1)
+        palm_size = np.maximum(palm_size, 1e-6)
+
+        # (N, 5, 4, 3) joint positions for every finger chain
+        chains = landmarks[:, FINGER_JOINTS]
+        bones = np.diff(chains, axis=2)
+        bones /= np.maximum(np.linalg.norm(bones, axis=-1, keepdims=True), 1e-6)
+        # Cosine of the bend at the two lower joints of every finger: (N, 5, 2)
+        joint_cos = np.sum(bones[:, :, :-1] * bones[:, :, 1:], axis=-1)
+
+        tip_to_wrist = np.linalg.norm(chains[:, :, 3] - wrist[:, None], axis=-1)
+        mid_to_wrist = np.linalg.norm(chains[:, :, 1] - wrist[:, None], axis=-1)
+
+        extended = np.all(joint_cos > EXTENDED_MIN_COS, axis=-1) & (tip_to_wrist > mid_to_wrist)
+
+        # The thumb bends sideways, so also require its tip to be away from the palm
+        thumb_spread = np.linalg.norm(landmarks[:, 4] - landmarks[:, INDEX_MCP], axis=-1) / palm_size
+        extended[:, 0] = np.all(joint_cos[:, 0] > THUMB_EXTENDED_MIN_COS, axis=-1) & (thumb_spread > THUMB_SPREAD_MIN)
+
+        pinch = np.linalg.norm(landmarks[:, 4] - landmarks[:, 8], axis=-1) / palm_size
+
+        return {'extended': extended, 'pinch': pinch}
+
+    def classify(self, landmarks: np.ndarray) -> List[Dict]:
+        """
+        Classify every hand in a batch
+
+        Args:
+            landmarks: Array of shape (N, 21, 3)
+
+        Returns:
+            One {'name', 'spell'} dictionary per hand
+        """
+        landmarks = np.asarray(landmarks)
+        if landmarks.ndim != 3 or landmarks.shape[0] == 0:
+            return []
+
+        features = self.features(landmarks)
+        extended = features['extended']
+        pinch = features['pinch']
+
+        # (N, G) match matrix over all definitions at once
+        finger_match = np.all(
+            (extended[:, None, :] == self._patterns[None]) | ~self._constrained[None],
+            axis=-1
+        )
+        pinch_match = (pinch[:, None] <= self._max_pinch[None]) & (pinch[:, None] >= self._min_pinch[None])
+        matches = finger_match & pinch_match
+
+        has_match = matches.any(axis=1)
+        first_match = matches.argmax(axis=1)
+        finger_counts = extended.sum(axis=1)
+
+        gestures = []
+        for hand in range(len(landmarks)):
+            if has_match[hand]:
+                definition = first_match[hand]
+                gestures.append({'name': self.names[definition], 'spell': self.spells[definition]})
+            else:
+                gestures.append({'name': f"{finger_counts[hand]}_fingers", 'spell': None})
+        return gestures
+
+
+# Shared engine with the default gesture table
+default_engine = GestureEngine()
+
+
+def classify_gestures(landmarks: np.ndarray) -> List[Dict]:
+    """
+    Classify every hand in an (N, 21, 3) landmark array with the default gesture table
+    """
+    return default_engine.classify(landmarks)
+
+
+def gesture_spell(name: Optional[str]) -> Optional[str]:
+    """
+    Spell cast by a gesture of the default gesture table, if any
+    """
+    return default_engine.spell_by_name.get(name)
@@ -1,12 +1,80 @@
 import cv2
 import mediapipe as mp
 import numpy as np
+import atexit
 import logging
+import multiprocessing
+import multiprocessing.connection
+import queue
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from multiprocessing import shared_memory
 from typing import List, Dict, Optional, Tuple
+from gestures import classify_gestures, gesture_spell
+from spell_trajectory import HandMotionTracker
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Number of landmarks MediaPipe reports per hand
+NUM_LANDMARKS = 21
+# Seconds between checks of the pool's dispatcher for changed workers or shutdown,
+# and of idle workers for a dead parent
+WORKER_CHECK_INTERVAL = 0.25
+
+
+class HandDetections:
+    """
+    Packed hand tracking result for one frame
+
+    Attributes:
+        landmarks: float32 array of shape (hands, 21, 3) with normalized x, y, z
+        handedness: 'Left'/'Right' label per hand
+        scores: Handedness confidence per hand
+        gestures: {'name', 'spell'} gesture classification per hand
+        events: Spell events recognized from wand strokes ending on this frame
+        cached: True if the frame was unchanged and the previous result was reused
+    """
+
+    def __init__(self,
+                 landmarks: np.ndarray,
+                 handedness: List[str],
+                 scores: List[float],
+                 gestures: Optional[List[Dict]] = None,
+                 events: Optional[List[Dict]] = None,
+                 cached: bool = False):
+        self.landmarks = landmarks
+        self.handedness = handedness
+        self.scores = scores
+        self.gestures = gestures if gestures is not None else []
+        self.events = events if events is not None else []
+        self.cached = cached
+
+    def reused(self) -> "HandDetections":
+        """
+        The same detections, flagged as cached; one-off spell events are not repeated
+        """
+        return HandDetections(self.landmarks, self.handedness, self.scores, self.gestures, [], True)
+
+    @classmethod
+    def empty(cls) -> "HandDetections":
+        return cls(np.zeros((0, NUM_LANDMARKS, 3), dtype=np.float32), [], [])
+
+    def __len__(self) -> int:
+        return len(self.landmarks)
+
+    def to_dicts(self) -> List[List[Dict]]:
+        """
+        Convert to the list-of-dicts landmark format used by the JSON API
+        """
+        return [
+            [{'x': x, 'y': y, 'z': z} for x, y, z in hand]
+            for hand in self.landmarks.tolist()
+        ]
+
+
 class HandTracker:
     """
     Hand tracking class using MediaPipe for detecting and tracking hands
@@ -16,7 +84,15 @@ class HandTracker:
                  static_image_mode: bool = False,
                  max_num_hands: int = 2,
                  min_detection_confidence: float = 0.7,
-                 min_tracking_confidence: float = 0.5):
+                 min_tracking_confidence: float = 0.5,
+                 temporal_smoothing: bool = True,
+                 inference_width: Optional[int] = 640,
+                 roi_tracking: bool = True,
+                 roi_padding: float = 0.35,
+                 full_scan_interval: int = 30,
+                 change_threshold: float = 2.0,
+                 max_skipped_frames: int = 15,
+                 mirror_strokes: bool = False):
         """
         Initialize the HandTracker
         
@@ -25,6 +101,22 @@ class HandTracker:
             max_num_hands: Maximum number of hands to detect
             min_detection_confidence: Minimum confidence for hand detection
             min_tracking_confidence: Minimum confidence for hand tracking
+            temporal_smoothing: Smooth landmarks over time and recognize wand strokes
+                (ignored in static image mode)
+            inference_width: Frames (or crops) wider than this are downscaled before
+                inference; None keeps the full resolution
+            roi_tracking: Crop to the region around the hands of the previous frame
+                (ignored in static image mode)
+            roi_padding: Padding around the hands' bounding box, relative to its size
+            full_scan_interval: Frames after which a full-frame scan is forced even
+                while the hands are being tracked
+            change_threshold: Mean absolute difference (0-255) of a downsampled
+                thumbnail below which a frame counts as unchanged and the previous
+                result is reused; 0 disables frame skipping
+            max_skipped_frames: Consecutive unchanged frames after which a frame is
+                processed anyway
+            mirror_strokes: Flip wand strokes horizontally before recognizing them, for
+                clients that send unmirrored camera frames
         """
         try:
             # Initialize MediaPipe hands solution
@@ -32,6 +124,35 @@ class HandTracker:
             self.mp_drawing = mp.solutions.drawing_utils
             self.mp_drawing_styles = mp.solutions.drawing_styles
             
+            # Reused for every frame; results are filled straight from the landmark protos
+            self._landmark_buffer = np.zeros((max_num_hands, NUM_LANDMARKS, 3), dtype=np.float32)
+            
+            # Landmark smoothing, gesture debouncing and wand stroke recognition
+            self.motion = (HandMotionTracker(mirror_strokes=mirror_strokes)
+                           if temporal_smoothing and not static_image_mode else None)
+            
+            # Adaptive pre-processing: downscale, and crop to the hands once they are found
+            self.inference_width = inference_width
+            self.roi_tracking = roi_tracking and not static_image_mode
+            self.roi_padding = roi_padding
+            self.full_scan_interval = max(1, full_scan_interval)
+            self._roi = None
+            self._roi_frame_size = None
+            self._frames_since_full_scan = 0
+            self._frame_buffers: Dict[str, np.ndarray] = {}
+            
+            # Skip-if-unchanged cache
+            self.change_threshold = change_threshold
+            self.max_skipped_frames = max_skipped_frames
+            self._last_thumbnail = None
+            self._last_detections = None
+            self._last_inference = None
+            self._skipped_in_row = 0
+            self.frames_processed = 0
+            self.frames_skipped = 0
+            self.full_scans = 0
+            self.roi_frames = 0
+            
             # Create hands object with specified parameters
             self.hands = self.mp_hands.Hands(
                 static_image_mode=static_image_mode,
@@ -57,55 +178,266 @@ class HandTracker:
         """
         return self.initialized
     
-    def process_frame(self, image: np.ndarray) -> Optional[List[List[Dict]]]:
+    def detect(self, image: np.ndarray, color: str = 'bgr') -> Optional[HandDetections]:
         """
-        Process a single frame to detect hand landmarks
+        Process a single frame and return packed hand landmarks
         
         Args:
-            image: Input image as numpy array (BGR format)
+            image: Input image as numpy array
+            color: Channel order of image, 'bgr' (OpenCV default) or 'rgb'
             
         Returns:
-            List of hand landmarks or None if no hands detected
-            Each hand is represented as a list of landmark dictionaries with x, y, z coordinates
+            HandDetections (possibly empty) or None if processing failed
         """
         if not self.initialized:
             logger.error("HandTracker not properly initialized")
             return None
         
         try:
-            # Convert BGR to RGB (MediaPipe expects RGB)
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            thumbnail = None
+            if self.change_threshold > 0:
+                thumbnail = self._thumbnail(image)
+                if self._is_unchanged(thumbnail):
+                    self._skipped_in_row += 1
+                    self.frames_skipped += 1
+                    return self._reuse_last(time.monotonic())
             
-            # Process the image
-            results = self.hands.process(rgb_image)
+            landmarks, handedness, scores = self._infer_adaptive(image, color)
+            if self.motion is not None:
+                # Smoothing works in place; unchanged frames replay the raw result
+                self._last_inference = (landmarks.copy(), handedness, scores)
+            detections = self._postprocess(landmarks, handedness, scores, time.monotonic())
             
-            # Extract landmarks if hands are detected
-            if results.multi_hand_landmarks:
-                hand_landmarks_list = []
-                
-                for hand_landmarks in results.multi_hand_landmarks:
-                    # Convert landmarks to list of dictionaries
-                    landmarks = []
-                    for landmark in hand_landmarks.landmark:
-                        landmarks.append({
-                            'x': landmark.x,
-                            'y': landmark.y,
-                            'z': landmark.z
-                        })
-                    
-                    hand_landmarks_list.append(landmarks)
-                    
-                logger.debug(f"Processed frame - detected {len(hand_landmarks_list)} hands")
-                return hand_landmarks_list
+            self.frames_processed += 1
+            self._skipped_in_row = 0
+            self._last_thumbnail = thumbnail
+            self._last_detections = detections
             
-            else:
-                logger.debug("No hands detected in frame")
-                return []
+            logger.debug(f"Processed frame - detected {len(detections)} hands")
+            return detections
                 
         except Exception as e:
             logger.error(f"Error processing frame: {e}")
             return None
     
+    def _reuse_last(self, timestamp: float) -> HandDetections:
+        """
+        Result of an unchanged frame: the last inference result, which still goes through the
+        motion tracker, since holding the wand still is what ends a stroke
+        """
+        if self.motion is None:
+            return self._last_detections.reused()
+        landmarks, handedness, scores = self._last_inference
+        detections = self._postprocess(landmarks.copy(), handedness, scores, timestamp)
+        detections.cached = True
+        return detections
+    
+    def _thumbnail(self, image: np.ndarray) -> np.ndarray:
+        """
+        Tiny grayscale version of the frame used for change detection
+        """
+        thumbnail = cv2.resize(image, (32, 24), interpolation=cv2.INTER_AREA)
+        # Channel order does not matter for an unweighted gray level
+        return thumbnail.mean(axis=2, dtype=np.float32)
+    
+    def _is_unchanged(self, thumbnail: np.ndarray) -> bool:
+        """
+        Whether the frame matches the last processed one closely enough to reuse its result
+        """
+        if self._last_thumbnail is None or self._last_detections is None:
+            return False
+        if self._skipped_in_row >= self.max_skipped_frames:
+            return False
+        difference = float(np.abs(thumbnail - self._last_thumbnail).mean())
+        return difference < self.change_threshold
+    
+    def _infer_adaptive(self, image: np.ndarray, color: str = 'bgr') -> Tuple[np.ndarray, List[str], List[float]]:
+        """
+        Run inference on the tracked region of interest, falling back to a
+        full-frame scan every full_scan_interval frames or when the hands are lost
+        
+        Returns:
+            Same as _infer, in full-frame normalized coordinates
+        """
+        height, width = image.shape[:2]
+        
+        if self._roi_frame_size != (width, height):
+            # The region of interest is in pixels of the previous frame size
+            self._roi = None
+            self._roi_frame_size = (width, height)
+        
+        if self._roi is not None and self._frames_since_full_scan < self.full_scan_interval:
+            self._frames_since_full_scan += 1
+            self.roi_frames += 1
+            landmarks, handedness, scores = self._infer_region(image, self._roi, color)
+            if len(landmarks):
+                self._update_roi(landmarks, width, height)
+                return landmarks, handedness, scores
+            logger.debug("Hands lost in region of interest, scanning full frame")
+        
+        self._frames_since_full_scan = 0
+        self.full_scans += 1
+        landmarks, handedness, scores = self._infer_region(image, (0, 0, width, height), color)
+        self._update_roi(landmarks, width, height)
+        return landmarks, handedness, scores
+    
+    def _reusable_buffer(self, name: str, shape: Tuple[int, ...]) -> np.ndarray:
+        """
+        Return a preallocated uint8 buffer of the given shape, reallocating only
+        when the frame geometry changes
+        """
+        buffer = self._frame_buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._frame_buffers[name] = np.empty(shape, dtype=np.uint8)
+        return buffer
+    
+    def _infer_region(self,
+                      image: np.ndarray,
+                      box: Tuple[int, int, int, int],
+                      color: str = 'bgr') -> Tuple[np.ndarray, List[str], List[float]]:
+        """
+        Crop, downscale and convert a region of a frame, run inference on it
+        and map the landmarks back to full-frame normalized coordinates
+        """
+        height, width = image.shape[:2]
+        x0, y0, x1, y1 = box
+        region = image[y0:y1, x0:x1]
+        region_width = x1 - x0
+        
+        # Resize and convert the (smaller) region only, instead of the whole frame,
+        # writing into this tracker's preallocated buffers
+        if self.inference_width and region_width > self.inference_width:
+            scale = self.inference_width / float(region_width)
+            size = (self.inference_width, max(1, int(round((y1 - y0) * scale))))
+            region = cv2.resize(region, size,
+                                dst=self._reusable_buffer('resized', (size[1], size[0], 3)),
+                                interpolation=cv2.INTER_AREA)
+        
+        if color == 'rgb':
+            # MediaPipe needs a contiguous image; crops are views into the frame
+            rgb_image = np.ascontiguousarray(region)
+        else:
+            # Convert BGR to RGB (MediaPipe expects RGB)
+            rgb_image = cv2.cvtColor(region, cv2.COLOR_BGR2RGB,
+                                     dst=self._reusable_buffer('rgb', region.shape))
+        landmarks, handedness, scores = self._infer(rgb_image)
+        
+        if len(landmarks) and (x0, y0, x1, y1) != (0, 0, width, height):
+            landmarks[..., 0] = (landmarks[..., 0] * region_width + x0) / width
+            landmarks[..., 1] = (landmarks[..., 1] * (y1 - y0) + y0) / height
+            # z uses roughly the same scale as x
+            landmarks[..., 2] *= region_width / float(width)
+        return landmarks, handedness, scores
+    
+    def _update_roi(self, landmarks: np.ndarray, width: int, height: int):
+        """
+        Derive the region of interest for the next frame from the detected hands.
+        The region is only moved when the hands approach its border, so the crop
+        stays stable and MediaPipe's own tracking keeps working inside it.
+        """
+        if not self.roi_tracking or not len(landmarks):
+            self._roi = None
+            return
+        
+        xs = landmarks[..., 0] * width
+        ys = landmarks[..., 1] * height
+        hand_x0, hand_x1 = float(xs.min()), float(xs.max())
+        hand_y0, hand_y1 = float(ys.min()), float(ys.max())
+        hand_size = max(hand_x1 - hand_x0, hand_y1 - hand_y0, 1.0)
+        
+        if self._roi is not None:
+            x0, y0, x1, y1 = self._roi
+            margin = hand_size * self.roi_padding * 0.5
+            inside = (hand_x0 - margin >= x0 and hand_x1 + margin <= x1 and
+                      hand_y0 - margin >= y0 and hand_y1 + margin <= y1)
+            not_too_large = max(x1 - x0, y1 - y0) <= hand_size * (1 + 2 * self.roi_padding) * 1.5
+            if inside and not_too_large:
+                return
+        
+        size = hand_size * (1 + 2 * self.roi_padding)
+        center_x = (hand_x0 + hand_x1) / 2
+        center_y = (hand_y0 + hand_y1) / 2
+        x0 = int(max(0, center_x - size / 2))
+        y0 = int(max(0, center_y - size / 2))
+        x1 = int(min(width, center_x + size / 2))
+        y1 = int(min(height, center_y + size / 2))
+        
+        # Not worth cropping if the region covers most of the frame
+        if (x1 - x0) * (y1 - y0) > 0.6 * width * height or x1 - x0 < 16 or y1 - y0 < 16:
+            self._roi = None
+        else:
+            self._roi = (x0, y0, x1, y1)
+    
+    def _infer(self, rgb_image: np.ndarray) -> Tuple[np.ndarray, List[str], List[float]]:
+        """
+        Run MediaPipe on an RGB image
+        
+        Returns:
+            (landmarks, handedness, scores) with landmarks of shape (hands, 21, 3)
+        """
+        results = self.hands.process(rgb_image)
+        
+        if not results.multi_hand_landmarks:
+            return self._landmark_buffer[:0].copy(), [], []
+        
+        buffer = self._landmark_buffer
+        num_hands = min(len(results.multi_hand_landmarks), len(buffer))
+        for hand_index in range(num_hands):
+            hand_buffer = buffer[hand_index]
+            for landmark_index, landmark in enumerate(results.multi_hand_landmarks[hand_index].landmark):
+                hand_buffer[landmark_index, 0] = landmark.x
+                hand_buffer[landmark_index, 1] = landmark.y
+                hand_buffer[landmark_index, 2] = landmark.z
+        
+        handedness = []
+        scores = []
+        for classification_list in (results.multi_handedness or [])[:num_hands]:
+            classification = classification_list.classification[0]
+            handedness.append(classification.label)
+            scores.append(float(classification.score))
+        
+        # Copy out the used rows so the buffer can be refilled by the next frame
+        return buffer[:num_hands].copy(), handedness, scores
+    
+    def _postprocess(self,
+                     landmarks: np.ndarray,
+                     handedness: List[str],
+                     scores: List[float],
+                     timestamp: float) -> HandDetections:
+        """
+        Apply temporal smoothing, classify gestures and collect spell events
+        """
+        if self.motion is None:
+            return HandDetections(landmarks, handedness, scores, classify_gestures(landmarks))
+        
+        self.motion.smooth(landmarks, handedness, timestamp)
+        gestures = classify_gestures(landmarks)
+        
+        primary_landmarks = landmarks[0] if len(landmarks) else None
+        raw_gesture = gestures[0]['name'] if gestures else None
+        primary_gesture = self.motion.debounce_gesture(raw_gesture)
+        if gestures:
+            gestures[0] = {'name': primary_gesture, 'spell': gesture_spell(primary_gesture)}
+        
+        events = self.motion.update(primary_landmarks, primary_gesture, timestamp, raw_gesture)
+        return HandDetections(landmarks, handedness, scores, gestures, events)
+    
+    def process_frame(self, image: np.ndarray) -> Optional[List[List[Dict]]]:
+        """
+        Process a single frame to detect hand landmarks
+        
+        Args:
+            image: Input image as numpy array (BGR format)
+            
+        Returns:
+            List of hand landmarks or None if no hands detected
+            Each hand is represented as a list of landmark dictionaries with x, y, z coordinates
+        """
+        detections = self.detect(image)
+        if detections is None:
+            return None
+        return detections.to_dicts()
+    
     def draw_landmarks_on_image(self, image: np.ndarray, hand_landmarks_list: List[List[Dict]]) -> np.ndarray:
         """
         Draw hand landmarks on the image
@@ -264,42 +596,649 @@ class HandTracker:
             landmarks: List of hand landmarks
             
         Returns:
-            String describing the recognized gesture
+            String describing the recognized gesture (see gestures.GESTURE_DEFINITIONS)
         """
-        if len(landmarks) < 21:
+        if len(landmarks) < NUM_LANDMARKS:
             return "unknown"
         
-        fingers_up = []
-        for finger in ['thumb', 'index', 'middle', 'ring', 'pinky']:
-            fingers_up.append(self.is_finger_up(landmarks, finger))
-        
-        # Count how many fingers are up
-        fingers_count = sum(fingers_up)
-        
-        # Basic gesture recognition
-        if fingers_count == 0:
-            return "fist"
-        elif fingers_count == 1:
-            if fingers_up[1]:  # Index finger
-                return "pointing"
-            elif fingers_up[0]:  # Thumb
-                return "thumbs_up"
-        elif fingers_count == 2:
-            if fingers_up[1] and fingers_up[2]:  # Index and middle
-                return "peace"
-        elif fingers_count == 5:
-            return "open_palm"
-        
-        return f"{fingers_count}_fingers"
+        landmark_array = np.array(
+            [[[landmark['x'], landmark['y'], landmark['z']] for landmark in landmarks[:NUM_LANDMARKS]]],
+            dtype=np.float32
+        )
+        return classify_gestures(landmark_array)[0]['name']
     
     def cleanup(self):
         """
         Clean up resources
         """
         if hasattr(self, 'hands') and self.hands:
+            self.initialized = False
             self.hands.close()
             logger.info("HandTracker cleaned up")
 
+class _TrackerSession:
+    """
+    A HandTracker owned by a single client session, plus its bookkeeping
+    """
+
+    def __init__(self, tracker: HandTracker):
+        self.tracker = tracker
+        # MediaPipe graphs are not re-entrant; one frame at a time per session
+        self.lock = threading.Lock()
+        self.created_at = time.monotonic()
+        self.last_seen = self.created_at
+        self.frames = 0
+        # Set once the session was evicted and its tracker closed
+        self.closed = False
+
+
+class HandTrackerRegistry:
+    """
+    Session-aware registry of HandTracker instances
+
+    Every client session gets its own HandTracker (and therefore its own
+    MediaPipe graph), so temporal tracking state is never shared between
+    concurrent webcams. Idle sessions are evicted after a TTL and the number
+    of live sessions is capped, evicting the least recently used one first.
+    """
+
+    def __init__(self,
+                 max_sessions: int = 16,
+                 session_ttl: float = 120.0,
+                 **tracker_kwargs):
+        """
+        Initialize the HandTrackerRegistry
+
+        Args:
+            max_sessions: Maximum number of live tracker sessions
+            session_ttl: Seconds of inactivity after which a session is evicted
+            tracker_kwargs: Keyword arguments passed to every HandTracker
+        """
+        self.max_sessions = max(1, int(max_sessions))
+        self.session_ttl = float(session_ttl)
+        self.tracker_kwargs = tracker_kwargs
+        self._sessions: "OrderedDict[str, _TrackerSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.initialized = True
+        self.evicted_sessions = 0
+        # Frame counters of sessions that were already evicted
+        self.frames_processed = 0
+        self.frames_skipped = 0
+
+    def is_initialized(self) -> bool:
+        """
+        Check if the registry is able to create hand trackers
+
+        Returns:
+            bool: False if the last attempt to create a HandTracker failed
+        """
+        return self.initialized
+
+    def _get_session(self, session_id: str) -> _TrackerSession:
+        """
+        Return the session for session_id, creating it if needed
+
+        A new session's MediaPipe graph is built outside the registry lock, so
+        requests of other sessions do not wait for it.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_seen = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            expired = self._pop_expired(time.monotonic())
+        if session is not None:
+            self._close_sessions(expired)
+            return session
+
+        try:
+            tracker = HandTracker(**self.tracker_kwargs)
+        except Exception:
+            self.initialized = False
+            self._close_sessions(expired)
+            raise
+
+        with self._lock:
+            self.initialized = True
+            session = self._sessions.get(session_id)
+            # Another request of this session may have created it in the meantime
+            duplicate = session is not None
+            if duplicate:
+                session.last_seen = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            else:
+                while len(self._sessions) >= self.max_sessions:
+                    _, lru_session = self._sessions.popitem(last=False)
+                    expired.append(lru_session)
+                session = _TrackerSession(tracker)
+                self._sessions[session_id] = session
+            live_sessions = len(self._sessions)
+
+        if duplicate:
+            tracker.cleanup()
+        else:
+            logger.info(f"Created hand tracker session {session_id} "
+                        f"({live_sessions}/{self.max_sessions} live)")
+        self._close_sessions(expired)
+        return session
+
+    def _pop_expired(self, now: float) -> List[_TrackerSession]:
+        """
+        Remove sessions idle for longer than the TTL. Caller must hold the lock.
+        """
+        expired = []
+        # Sessions are kept in LRU order, so the idle ones are at the front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_seen <= self.session_ttl:
+                break
+            self._sessions.popitem(last=False)
+            expired.append(session)
+        return expired
+
+    def _close_sessions(self, sessions: List[_TrackerSession]):
+        """
+        Release the MediaPipe resources of evicted sessions
+        """
+        for session in sessions:
+            # Wait for an in-flight frame to finish before closing the graph
+            with session.lock:
+                session.closed = True
+                session.tracker.cleanup()
+        if sessions:
+            with self._lock:
+                self.evicted_sessions += len(sessions)
+                self.frames_processed += sum(session.tracker.frames_processed for session in sessions)
+                self.frames_skipped += sum(session.tracker.frames_skipped for session in sessions)
+
+    def detect(self, session_id: str, image: np.ndarray, color: str = 'bgr') -> Optional[HandDetections]:
+        """
+        Process a frame with the HandTracker belonging to session_id
+
+        Args:
+            session_id: Identifier of the client session sending the frame
+            image: Input image as numpy array
+            color: Channel order of image, 'bgr' or 'rgb'
+
+        Returns:
+            Same as HandTracker.detect
+        """
+        while True:
+            session = self._get_session(session_id)
+            with session.lock:
+                # Evicted between the lookup and taking its lock: look it up again
+                if session.closed:
+                    continue
+                session.frames += 1
+                return session.tracker.detect(image, color)
+
+    def process_frame(self, session_id: str, image: np.ndarray) -> Optional[List[List[Dict]]]:
+        """
+        Process a frame with the HandTracker belonging to session_id
+
+        Returns:
+            Same as HandTracker.process_frame
+        """
+        detections = self.detect(session_id, image)
+        if detections is None:
+            return None
+        return detections.to_dicts()
+
+    def evict_idle(self) -> int:
+        """
+        Evict sessions that have been idle for longer than the TTL
+
+        Returns:
+            Number of evicted sessions
+        """
+        with self._lock:
+            expired = self._pop_expired(time.monotonic())
+        self._close_sessions(expired)
+        return len(expired)
+
+    def stats(self) -> Dict:
+        """
+        Summary of live sessions for health reporting
+        """
+        with self._lock:
+            return {
+                'mode': 'in_process',
+                'live_sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'session_ttl_seconds': self.session_ttl,
+                'evicted_sessions': self.evicted_sessions,
+                'frames_processed': self.frames_processed + sum(
+                    session.tracker.frames_processed for session in self._sessions.values()),
+                'frames_skipped': self.frames_skipped + sum(
+                    session.tracker.frames_skipped for session in self._sessions.values())
+            }
+
+    def cleanup(self):
+        """
+        Clean up every live session
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        self._close_sessions(sessions)
+
+class HandTrackerBusy(Exception):
+    """
+    Raised when the worker pool has no capacity left for a frame
+    """
+
+
+def _pool_worker_main(worker_id: int,
+                      slot_names: List[str],
+                      task_queue,
+                      result_conn,
+                      registry_kwargs: Dict):
+    """
+    Entry point of a hand tracking worker process
+
+    Frames are read straight out of the worker's shared memory slots, so only
+    a small task descriptor crosses the process boundary. Results go back over
+    a pipe of this worker alone: unlike a shared queue, it has no lock a
+    crashing worker could leave held for the others.
+    """
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    registry = HandTrackerRegistry(**registry_kwargs)
+    parent = multiprocessing.parent_process()
+
+    try:
+        while True:
+            try:
+                task = task_queue.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                # A killed server cannot send the shutdown sentinel; without its parent the
+                # worker would live on and keep the shared memory mapped
+                if parent is not None and not parent.is_alive():
+                    break
+                continue
+            if task is None:
+                break
+
+            task_id, slot_index, shape, color, session_id = task
+            started = time.perf_counter()
+            try:
+                image = np.ndarray(shape, dtype=np.uint8, buffer=slots[slot_index].buf)
+                detections = registry.detect(session_id, image, color)
+                del image
+            except Exception as e:
+                logger.error(f"Hand tracking worker {worker_id} failed to process frame: {e}")
+                detections = None
+            busy_seconds = time.perf_counter() - started
+
+            result_conn.send((task_id, slot_index, detections, busy_seconds))
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    finally:
+        registry.cleanup()
+        result_conn.close()
+        for slot in slots:
+            slot.close()
+
+
+class _PoolWorker:
+    """
+    Parent-side handle of one worker process and its shared memory slots
+    """
+
+    def __init__(self, worker_id: int, slots: List[shared_memory.SharedMemory]):
+        self.worker_id = worker_id
+        self.slots = slots
+        self.free_slots = list(range(len(slots)))
+        self.task_queue = None
+        self.result_conn = None
+        self.process = None
+        # Slot index of every task handed to the current process, by task id
+        self.in_flight: Dict[int, int] = {}
+        self.restarts = 0
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        self.frames_rejected = 0
+        self.busy_seconds = 0.0
+
+
+class HandTrackerPool:
+    """
+    Multi-process hand tracking pool
+
+    Each worker process owns its own MediaPipe graphs (one per session, via a
+    HandTrackerRegistry), so inference runs on several cores instead of being
+    serialized behind the GIL. Frames of a session are always routed to the
+    same worker to keep temporal tracking intact, and are handed over through
+    shared memory instead of being pickled. Every worker has a fixed number of
+    frame slots; when they are all in use the frame is rejected with
+    HandTrackerBusy instead of queueing up latency.
+
+    Workers are started lazily on the first frame, so importing a module that
+    creates a pool (e.g. in a spawned child process) is cheap. A worker process
+    that dies is replaced right away; its in-flight frames fail and their
+    slots are released.
+    """
+
+    def __init__(self,
+                 num_workers: int = 2,
+                 queue_depth: int = 2,
+                 max_frame_size: Tuple[int, int] = (1920, 1080),
+                 result_timeout: float = 5.0,
+                 max_sessions: int = 16,
+                 session_ttl: float = 120.0,
+                 **tracker_kwargs):
+        """
+        Initialize the HandTrackerPool
+
+        Args:
+            num_workers: Number of worker processes
+            queue_depth: Frames that may be queued or in flight per worker
+            max_frame_size: Largest (width, height) frame accepted without downscaling
+            result_timeout: Seconds to wait for a worker result
+            max_sessions: Maximum number of live tracker sessions per worker
+            session_ttl: Seconds of inactivity after which a session is evicted
+            tracker_kwargs: Keyword arguments passed to every HandTracker
+        """
+        self.num_workers = max(1, int(num_workers))
+        self.queue_depth = max(1, int(queue_depth))
+        self.max_frame_size = max_frame_size
+        self.result_timeout = float(result_timeout)
+        self.registry_kwargs = dict(tracker_kwargs,
+                                    max_sessions=max_sessions,
+                                    session_ttl=session_ttl)
+
+        self._workers: List[_PoolWorker] = []
+        self._pending: Dict[int, Tuple[threading.Event, List]] = {}
+        self._next_task_id = 0
+        self._lock = threading.Lock()
+        self._context = None
+        self._dispatcher = None
+        self._stopping = False
+        self._started_at = None
+        self.initialized = True
+
+    def is_initialized(self) -> bool:
+        """
+        Check if the pool is able to process frames
+
+        Returns:
+            bool: False if the worker processes could not be started
+        """
+        return self.initialized
+
+    def start(self):
+        """
+        Start the worker processes (no-op if they are already running)
+        """
+        with self._lock:
+            if self._workers:
+                return
+
+            try:
+                # MediaPipe is not fork-safe, always start clean interpreters
+                self._context = multiprocessing.get_context('spawn')
+                width, height = self.max_frame_size
+                slot_bytes = width * height * 3
+
+                for worker_id in range(self.num_workers):
+                    slots = [shared_memory.SharedMemory(create=True, size=slot_bytes)
+                             for _ in range(self.queue_depth)]
+                    worker = _PoolWorker(worker_id, slots)
+                    self._workers.append(worker)
+                    self._start_worker(worker)
+            except Exception as e:
+                logger.error(f"Failed to start hand tracking worker pool: {e}")
+                self.initialized = False
+                self._shutdown_workers()
+                raise
+
+            self._started_at = time.monotonic()
+            self._stopping = False
+            self._dispatcher = threading.Thread(target=self._dispatch_results,
+                                                daemon=True,
+                                                name="hand-tracker-results")
+            self._dispatcher.start()
+            # Shared memory outlives the process unless unlinked, so a server exiting without
+            # calling cleanup() must not leave the slots behind in /dev/shm
+            atexit.register(self.cleanup)
+            logger.info(f"HandTrackerPool started with {self.num_workers} workers")
+
+    def _start_worker(self, worker: _PoolWorker):
+        """
+        Start a process for worker, with a fresh task queue and result pipe. Caller must hold the lock.
+        """
+        worker.task_queue = self._context.Queue()
+        result_conn, worker_conn = self._context.Pipe(duplex=False)
+        worker.process = self._context.Process(
+            target=_pool_worker_main,
+            args=(worker.worker_id, [slot.name for slot in worker.slots],
+                  worker.task_queue, worker_conn, self.registry_kwargs),
+            daemon=True,
+            name=f"hand-tracker-{worker.worker_id}"
+        )
+        worker.process.start()
+        # Only the worker may hold the sending end, so the pipe reports EOF once it exits
+        worker_conn.close()
+        worker.result_conn = result_conn
+
+    def _replace_worker(self, worker: _PoolWorker):
+        """
+        Replace a worker whose process exited, failing its in-flight frames and releasing their slots
+        """
+        worker.process.join(timeout=1.0)
+        if worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join()
+        logger.error(f"Hand tracking worker {worker.worker_id} died "
+                     f"(exit code {worker.process.exitcode}), starting a replacement")
+
+        with self._lock:
+            if self._stopping:
+                return
+            failed = [self._pending.pop(task_id, None) for task_id in worker.in_flight]
+            worker.in_flight.clear()
+            worker.free_slots = list(range(len(worker.slots)))
+            # Frames still queued for the dead process are dropped with its queue
+            worker.task_queue.cancel_join_thread()
+            worker.task_queue.close()
+            worker.result_conn.close()
+            worker.restarts += 1
+            try:
+                self._start_worker(worker)
+            except Exception as e:
+                logger.error(f"Failed to restart hand tracking worker {worker.worker_id}: {e}")
+                worker.result_conn = None
+                self.initialized = False
+
+        for pending in failed:
+            if pending is not None:
+                pending[0].set()
+
+    def _dispatch_results(self):
+        """
+        Hand worker results back to the waiting request threads and replace workers that died
+        """
+        while True:
+            with self._lock:
+                if self._stopping:
+                    break
+                connections = {worker.result_conn: worker for worker in self._workers
+                               if worker.result_conn is not None}
+
+            for conn in multiprocessing.connection.wait(list(connections), timeout=WORKER_CHECK_INTERVAL):
+                worker = connections[conn]
+                try:
+                    task_id, slot_index, detections, busy_seconds = conn.recv()
+                except (EOFError, OSError):
+                    self._replace_worker(worker)
+                    continue
+
+                with self._lock:
+                    # Results of a task whose worker was already replaced are dropped
+                    if worker.in_flight.pop(task_id, None) is not None:
+                        worker.free_slots.append(slot_index)
+                        if detections is not None and detections.cached:
+                            worker.frames_skipped += 1
+                        else:
+                            worker.frames_processed += 1
+                        worker.busy_seconds += busy_seconds
+                    pending = self._pending.pop(task_id, None)
+
+                if pending is not None:
+                    done, holder = pending
+                    holder.append(detections)
+                    done.set()
+
+    def _route(self, session_id: str) -> int:
+        """
+        Pick the worker that owns session_id (stable across requests)
+        """
+        return zlib.crc32(session_id.encode('utf-8')) % self.num_workers
+
+    def _fit_frame(self, image: np.ndarray) -> np.ndarray:
+        """
+        Downscale frames that do not fit into a shared memory slot.
+        Landmarks are normalized, so this does not change the results' scale.
+        """
+        if image.ndim != 3 or image.shape[2] != 3 or image.dtype != np.uint8:
+            raise ValueError(f"Expected an 8-bit 3-channel image, got {image.shape} {image.dtype}")
+
+        max_width, max_height = self.max_frame_size
+        height, width = image.shape[:2]
+        if width * height <= max_width * max_height:
+            return image
+
+        scale = ((max_width * max_height) / float(width * height)) ** 0.5
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    def detect(self, session_id: str, image: np.ndarray, color: str = 'bgr') -> Optional[HandDetections]:
+        """
+        Process a frame on the worker that owns session_id
+
+        Args:
+            session_id: Identifier of the client session sending the frame
+            image: Input image as numpy array
+            color: Channel order of image, 'bgr' or 'rgb'
+
+        Returns:
+            Same as HandTracker.detect
+
+        Raises:
+            HandTrackerBusy: If the session's worker has no free frame slot
+        """
+        self.start()
+        image = self._fit_frame(image)
+        worker_id = self._route(session_id)
+
+        with self._lock:
+            worker = self._workers[worker_id]
+            if not worker.free_slots:
+                worker.frames_rejected += 1
+                raise HandTrackerBusy(f"Hand tracking worker {worker_id} is busy")
+            slot_index = worker.free_slots.pop()
+            task_id = self._next_task_id
+            self._next_task_id += 1
+            done = threading.Event()
+            holder: List = []
+            self._pending[task_id] = (done, holder)
+            worker.in_flight[task_id] = slot_index
+
+        # The slot is reserved for this task until the worker reports back
+        slot = worker.slots[slot_index]
+        frame = np.ndarray(image.shape, dtype=np.uint8, buffer=slot.buf)
+        frame[...] = image
+        del frame
+        with self._lock:
+            # The worker may have died and been replaced while the frame was copied
+            if task_id not in worker.in_flight:
+                return None
+            worker.task_queue.put((task_id, slot_index, image.shape, color, session_id))
+
+        if not done.wait(self.result_timeout):
+            with self._lock:
+                self._pending.pop(task_id, None)
+            logger.error(f"Hand tracking worker {worker_id} timed out")
+            return None
+        return holder[0] if holder else None
+
+    def process_frame(self, session_id: str, image: np.ndarray) -> Optional[List[List[Dict]]]:
+        """
+        Process a frame on the worker that owns session_id
+
+        Returns:
+            Same as HandTracker.process_frame
+
+        Raises:
+            HandTrackerBusy: If the session's worker has no free frame slot
+        """
+        detections = self.detect(session_id, image)
+        if detections is None:
+            return None
+        return detections.to_dicts()
+
+    def stats(self) -> Dict:
+        """
+        Per-worker utilization for health reporting
+        """
+        with self._lock:
+            uptime = time.monotonic() - self._started_at if self._started_at else 0.0
+            workers = []
+            for worker in self._workers:
+                workers.append({
+                    'worker_id': worker.worker_id,
+                    'alive': worker.process.is_alive() if worker.process else False,
+                    'restarts': worker.restarts,
+                    'frames_processed': worker.frames_processed,
+                    'frames_skipped': worker.frames_skipped,
+                    'frames_rejected': worker.frames_rejected,
+                    'in_flight': self.queue_depth - len(worker.free_slots),
+                    'utilization': round(worker.busy_seconds / uptime, 3) if uptime else 0.0
+                })
+            return {
+                'mode': 'process_pool',
+                'num_workers': self.num_workers,
+                'queue_depth': self.queue_depth,
+                'started': bool(self._workers),
+                'workers': workers
+            }
+
+    def _shutdown_workers(self):
+        """
+        Stop worker processes and release shared memory. Caller must hold the lock.
+        """
+        for worker in self._workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.task_queue.put(None)
+        for worker in self._workers:
+            if worker.process is not None:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+            if worker.result_conn is not None:
+                worker.result_conn.close()
+            for slot in worker.slots:
+                slot.close()
+                slot.unlink()
+        self._workers = []
+
+    def cleanup(self):
+        """
+        Stop the worker processes and release shared memory (also run at interpreter exit)
+        """
+        atexit.unregister(self.cleanup)
+        with self._lock:
+            self._stopping = True
+            dispatcher, self._dispatcher = self._dispatcher, None
+        # The dispatcher stops within WORKER_CHECK_INTERVAL; the pipes stay open until then
+        if dispatcher is not None:
+            dispatcher.join(timeout=5)
+        with self._lock:
+            self._shutdown_workers()
+            for done, _ in self._pending.values():
+                done.set()
+            self._pending.clear()
+        logger.info("HandTrackerPool cleaned up")
+
 # Example usage and testing
 if __name__ == "__main__":
     # Test the HandTracker with webcam
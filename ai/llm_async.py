@@ -0,0 +1,311 @@
+"""
+Non-blocking Gemini client for the ASGI serving mode (see asgi.py)
+
+AsyncGeminiClient makes the same calls as GeminiClient over an httpx
+AsyncClient, so an in-flight Gemini call costs a suspended coroutine instead
+of a blocked OS thread. It is a companion of the shared GeminiClient rather
+than a replacement: it takes its settings from it and goes through the same
+circuit breaker, rate limiter and stats, so /health reports one set of
+numbers whichever serving mode made the call.
+
+Requires httpx (only imported by the ASGI mode).
+"""
+import asyncio
+import json
+import logging
+import os
+import ssl
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from llm_client import (GeminiClient, LLMBusy, LLMEmptyResponse, LLMError, LLMRateLimited, LLMTimeout,
+                        RETRY_STATUSES, _generate_payload, get_client, response_text)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Connections per httpx pool. A pool's bookkeeping grows with the square of its
+# queued requests and connections, so large concurrency is spread over several pools.
+CONNECTIONS_PER_POOL = 32
+
+
+async def _sse_events(response: httpx.Response) -> AsyncIterator[Dict]:
+    """
+    Decoded data payloads of a server-sent event stream, yielded as soon as each event is complete
+    """
+    data_lines = []
+    async for line in response.aiter_lines():
+        if line.startswith('data:'):
+            data_lines.append(line[5:].strip())
+        elif not line and data_lines:
+            yield json.loads('\n'.join(data_lines))
+            data_lines = []
+    if data_lines:
+        yield json.loads('\n'.join(data_lines))
+
+
+class AsyncGeminiClient:
+    """
+    asyncio counterpart of GeminiClient, sharing its settings, admission control and stats
+    """
+
+    def __init__(self, client: GeminiClient, max_concurrency: int = 256):
+        """
+        Initialize the AsyncGeminiClient
+
+        Args:
+            client: Shared GeminiClient providing the API key, model, timeouts, retry policy,
+                circuit breaker, rate limiter and stats
+            max_concurrency: Upstream calls allowed in flight at once (also the connection pool size);
+                higher than the threaded client's, since a waiting call costs no thread here
+        """
+        self.client = client
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._pools: List[httpx.AsyncClient] = []
+        self._next_pool = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        client.async_client = self
+
+    @classmethod
+    def from_env(cls, client: Optional[GeminiClient] = None) -> "AsyncGeminiClient":
+        """
+        Client for the shared GeminiClient, with LLM_ASYNC_MAX_CONCURRENCY in-flight calls
+        """
+        return cls(client or get_client(),
+                   max_concurrency=int(os.getenv("LLM_ASYNC_MAX_CONCURRENCY", "256")))
+
+    @property
+    def configured(self) -> bool:
+        return self.client.configured
+
+    def _ensure_pools(self):
+        # Created on first use, inside the event loop that serves the requests
+        if not self._pools:
+            client = self.client
+            pool_size = min(self.max_concurrency, CONNECTIONS_PER_POOL)
+            # Loading the CA certificates is slow, so the pools share one TLS context
+            ssl_context = ssl.create_default_context()
+            self._pools = [
+                httpx.AsyncClient(
+                    verify=ssl_context,
+                    timeout=httpx.Timeout(client.read_timeout, connect=client.connect_timeout),
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                    headers={'Content-Type': 'application/json'})
+                for _ in range(-(-self.max_concurrency // pool_size))
+            ]
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+
+    def _session(self) -> httpx.AsyncClient:
+        """
+        Next connection pool, round robin
+        """
+        self._ensure_pools()
+        self._next_pool = (self._next_pool + 1) % len(self._pools)
+        return self._pools[self._next_pool]
+
+    @asynccontextmanager
+    async def _slot(self, feature: str):
+        """
+        Admission and accounting of GeminiClient._slot, without blocking the event loop
+
+        Raises:
+            LLMCircuitOpen: The circuit breaker is open
+            LLMRateLimited: The rate limiter rejected the call
+            LLMBusy: No slot became free within the client's acquire_timeout
+        """
+        client = self.client
+        self._ensure_pools()
+        client._admit(feature)
+        try:
+            if client.rate_limiter is not None and not await client.rate_limiter.acquire_async(feature):
+                raise client._refuse('rate_limited', LLMRateLimited(f"Gemini rate budget for {feature} is used up"))
+            try:
+                # Unlike wait_for, timeout() never swallows a cancellation arriving as the slot is acquired
+                async with asyncio.timeout(client.acquire_timeout):
+                    await self._slots.acquire()
+            except asyncio.TimeoutError:
+                raise client._refuse('busy_rejections', LLMBusy(f"{self.max_concurrency} Gemini calls already in flight"))
+        except asyncio.CancelledError:
+            # The caller went away while waiting for admission
+            client._call_abandoned()
+            raise
+
+        started = client._call_started()
+        self._in_flight += 1
+        try:
+            yield
+        except LLMError as e:
+            client._call_failed(e)
+            raise
+        except BaseException:
+            client._call_abandoned()
+            raise
+        else:
+            client._call_succeeded()
+        finally:
+            client._call_finished(feature, started)
+            self._in_flight -= 1
+            self._slots.release()
+
+    async def _send_with_retries(self, url: str, payload: Dict, feature: str) -> httpx.Response:
+        """
+        POST with GeminiClient's retry policy; the response body is left unread (the caller must close it)
+        """
+        client = self.client
+        http = self._session()
+        headers = {'x-goog-api-key': client.api_key} if client.api_key else {}
+        for attempt in range(client.max_retries + 1):
+            client._count('attempts')
+            if attempt:
+                client._count('retries')
+            final_attempt = attempt == client.max_retries
+
+            try:
+                request = http.build_request('POST', url, json=payload, headers=headers)
+                response = await http.send(request, stream=True)
+            except httpx.ReadTimeout as e:
+                raise LLMTimeout(f"Gemini did not answer within {client.read_timeout}s") from e
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                if final_attempt:
+                    raise LLMError(f"Could not connect to Gemini: {e}") from e
+                delay = client._backoff(attempt)
+                logger.warning(f"Gemini connection failed for {feature} ({e}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            except httpx.HTTPError as e:
+                raise LLMError(f"Gemini request failed: {e}") from e
+
+            if response.is_success:
+                return response
+
+            status = response.status_code
+            if status in RETRY_STATUSES and not final_attempt:
+                delay = client._backoff(attempt, response.headers.get('Retry-After'))
+                logger.warning(f"Gemini answered {status} for {feature}, retrying in {delay:.2f}s")
+                await response.aclose()
+                await asyncio.sleep(delay)
+                continue
+
+            try:
+                detail = (await response.aread())[:500].decode('utf-8', 'replace')
+            except httpx.HTTPError:
+                detail = ''
+            await response.aclose()
+            logger.error(f"Gemini error {status} for {feature}: {detail}")
+            raise LLMError(f"Gemini answered {status}", status_code=status)
+
+        # Not reached: the final attempt either returns or raises
+        raise LLMError("Gemini retries exhausted")
+
+    async def generate_content(self, contents, model: Optional[str] = None, feature: str = 'default',
+                               generation_config: Optional[Dict] = None) -> Dict:
+        """
+        Call generateContent and return the decoded response (see GeminiClient.generate_content)
+        """
+        payload = _generate_payload(contents, generation_config)
+        async with self._slot(feature):
+            response = await self._send_with_retries(self.client.model_url(model), payload, feature)
+            try:
+                body = await response.aread()
+            except httpx.ReadTimeout as e:
+                raise LLMTimeout(f"Gemini did not answer within {self.client.read_timeout}s") from e
+            except httpx.HTTPError as e:
+                raise LLMError(f"Gemini answer broke off: {e}") from e
+            finally:
+                await response.aclose()
+            try:
+                return json.loads(body)
+            except ValueError as e:
+                raise LLMError(f"Gemini returned invalid JSON: {e}") from e
+
+    async def generate_text(self, contents, model: Optional[str] = None, feature: str = 'default',
+                            generation_config: Optional[Dict] = None) -> str:
+        """
+        Call generateContent and return the generated text
+
+        Raises:
+            LLMEmptyResponse: The response carries no text
+        """
+        result = await self.generate_content(contents, model, feature, generation_config)
+        text = response_text(result)
+        if text is None:
+            logger.error(f"Unexpected Gemini response structure for {feature}: {result}")
+            raise LLMEmptyResponse("Gemini response contained no text")
+        return text
+
+    async def stream_text(self, contents, model: Optional[str] = None, feature: str = 'default',
+                          generation_config: Optional[Dict] = None) -> AsyncIterator[str]:
+        """
+        Call streamGenerateContent and yield the text of every chunk as it arrives
+        (see GeminiClient.stream_text; closing the generator early aborts the upstream call)
+        """
+        client = self.client
+        payload = _generate_payload(contents, generation_config)
+        url = f"{client.model_url(model, 'streamGenerateContent')}?alt=sse"
+        started = time.perf_counter()
+        async with self._slot(feature):
+            response = await self._send_with_retries(url, payload, feature)
+            client._count('streams')
+            received_text = False
+            completed = False
+            try:
+                async for event in _sse_events(response):
+                    text = response_text(event)
+                    if not text:
+                        continue
+                    if not received_text:
+                        received_text = True
+                        client._record_first_token(time.perf_counter() - started)
+                        client._call_succeeded()
+                    yield text
+                completed = True
+            except ValueError as e:
+                raise LLMError(f"Gemini returned an invalid stream event: {e}") from e
+            except httpx.ReadTimeout as e:
+                raise LLMTimeout(f"Gemini stream stalled for {client.read_timeout}s") from e
+            except httpx.HTTPError as e:
+                raise LLMError(f"Gemini stream broke off: {e}") from e
+            finally:
+                await response.aclose()
+                if not completed:
+                    client._count('streams_aborted')
+
+            if not received_text:
+                raise LLMEmptyResponse("Gemini stream contained no text")
+
+    def stats(self) -> Dict:
+        """
+        Concurrency limit and in-flight calls of this client (the rest is in GeminiClient.stats)
+        """
+        return {
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self._in_flight,
+            'connection_pools': len(self._pools)
+        }
+
+    async def aclose(self):
+        for pool in self._pools:
+            await pool.aclose()
+        self._pools = []
+        self._slots = None
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_async_client() -> AsyncGeminiClient:
+    """
+    Process-wide async client wrapping the shared GeminiClient
+    """
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = AsyncGeminiClient.from_env()
+    return _default_client
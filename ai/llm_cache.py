@@ -0,0 +1,670 @@
+"""
+Response cache in front of the Gemini client
+
+Librarian questions and Daily Prophet categories repeat a lot, and every
+repeat is a paid Gemini round trip of several seconds. ResponseCache answers
+them from memory instead: first by exact match on the normalized question,
+then (optionally) by embedding similarity to a previously answered one.
+Entries expire after a per-feature TTL and are evicted least recently used
+once the memory budget is exceeded. Features with a TTL of 0, like the diary
+whose replies depend on the conversation, bypass the cache entirely.
+
+Concurrent misses for the same feature and normalized prompt are coalesced
+(single-flight): one request calls Gemini and the others wait for and share
+its answer, so a burst of identical requests costs one upstream call even
+when caching is disabled.
+
+Expired entries are kept for a grace period (until evicted) so that, while
+Gemini is unavailable (circuit open or rate budget spent), generate_or_fallback
+and stream can still answer with the last known response, or with the
+feature's canned reply when there is none.
+
+The *_async methods serve the ASGI mode (asgi.py): they take coroutine
+functions, and concurrent async misses are coalesced in the event loop.
+"""
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from llm_client import LLMUnavailable, get_client
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Seconds a response stays valid, per feature; 0 disables caching for the feature
+DEFAULT_TTLS = {
+    'librarian': 24 * 60 * 60,
+    'news': 15 * 60,
+    'diary': 0
+}
+# Features whose identical in-flight prompts share one upstream call
+DEFAULT_COALESCED_FEATURES = ('librarian', 'news')
+# Seconds an expired response is kept as a fallback for when Gemini is unavailable
+DEFAULT_STALE_SECONDS = 24 * 60 * 60
+# Rough per-entry bookkeeping cost on top of the key and value
+ENTRY_OVERHEAD = 256
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    Case-folded text with punctuation removed and whitespace collapsed,
+    so "Who founded Hogwarts?" and "who  founded hogwarts" share an entry
+    """
+    return ' '.join(_NON_WORD.sub(' ', text.casefold()).split())
+
+
+class _Entry:
+    __slots__ = ('feature', 'value', 'expires', 'size', 'embedding')
+
+    def __init__(self, feature: str, value: str, expires: float, size: int, embedding: Optional[np.ndarray]):
+        self.feature = feature
+        self.value = value
+        self.expires = expires
+        self.size = size
+        self.embedding = embedding
+
+
+class _Flight:
+    __slots__ = ('done', 'value', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.waiters = 0
+
+
+class _AsyncFlight:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time; callers arriving meanwhile wait for and share its result
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self._async_flights: Dict[str, _AsyncFlight] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.coalesced_by_label: Dict[str, int] = {}
+        self.max_waiters = 0
+
+    def do(self, key: str, function: Callable[[], str], label: str = 'default') -> str:
+        """
+        Result of function(), or of the identical call already in flight for this key
+
+        Exceptions of the leading call are raised in every waiting caller too.
+
+        Args:
+            key: Identity of the call
+            function: The call itself
+            label: Group the coalesced counter is broken down by (e.g. the feature)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self._count_coalesced(flight, label)
+
+        if not leader:
+            # The leader is bounded by the LLM client's own timeouts, so this wait is too
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = function()
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _count_coalesced(self, flight, label: str):
+        # Caller must hold the lock
+        flight.waiters += 1
+        self.coalesced += 1
+        self.coalesced_by_label[label] = self.coalesced_by_label.get(label, 0) + 1
+        self.max_waiters = max(self.max_waiters, flight.waiters)
+
+    async def do_async(self, key: str, function: Callable[[], Awaitable[str]], label: str = 'default') -> str:
+        """
+        Counterpart of do for coroutine functions (calls coalesce within one event loop)
+
+        The call runs as its own task, so a caller that is cancelled (e.g. its client went away)
+        neither cancels it for the others nor loses the result for the cache.
+        """
+        with self._lock:
+            flight = self._async_flights.get(key)
+            if flight is None:
+                flight = self._async_flights[key] = _AsyncFlight(asyncio.ensure_future(function()))
+                self.calls += 1
+                flight.task.add_done_callback(lambda task: self._finish_async(key, flight))
+            else:
+                self._count_coalesced(flight, label)
+        return await asyncio.shield(flight.task)
+
+    def _finish_async(self, key: str, flight: _AsyncFlight):
+        with self._lock:
+            if self._async_flights.get(key) is flight:
+                del self._async_flights[key]
+        if not flight.task.cancelled():
+            # Marks the exception as retrieved when every caller has gone away
+            flight.task.exception()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'upstream_calls': self.calls,
+                'coalesced_requests': self.coalesced,
+                'coalesced_by_feature': dict(self.coalesced_by_label),
+                'max_waiters': self.max_waiters,
+                'in_flight_keys': len(self._flights) + len(self._async_flights)
+            }
+
+
+def _collecting(chunks: Iterator[str], parts: List[str]) -> Iterator[str]:
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    finally:
+        chunks.close()
+
+
+async def _collecting_async(chunks: AsyncIterator[str], parts: List[str]) -> AsyncIterator[str]:
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    finally:
+        await chunks.aclose()
+
+
+class ResponseCache:
+    """
+    LRU cache of LLM responses keyed by feature and normalized prompt, with optional semantic matching
+    """
+
+    def __init__(self,
+                 memory_budget: int = 16 * 1024 * 1024,
+                 ttls: Optional[Dict[str, float]] = None,
+                 similarity_threshold: float = 0.0,
+                 embedder: Optional[Callable[[str], Sequence[float]]] = None,
+                 coalesced_features: Sequence[str] = DEFAULT_COALESCED_FEATURES,
+                 stale_seconds: float = DEFAULT_STALE_SECONDS):
+        """
+        Initialize the ResponseCache
+
+        Args:
+            memory_budget: Approximate bytes of keys, responses and embeddings kept
+            ttls: Seconds a response stays valid per feature (features not listed are not cached)
+            similarity_threshold: Cosine similarity above which a different question counts as a hit;
+                0 disables semantic matching
+            embedder: Text to embedding vector function, required for semantic matching
+            coalesced_features: Features whose concurrent identical misses share one upstream call
+            stale_seconds: How long after expiry a response may still be served while Gemini is unavailable
+        """
+        self.memory_budget = max(0, int(memory_budget))
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.similarity_threshold = similarity_threshold if embedder is not None else 0.0
+        self.embedder = embedder
+        self.coalesced_features = frozenset(coalesced_features)
+        self.stale_seconds = max(0.0, stale_seconds)
+        self.flights = SingleFlight()
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits: Dict[str, int] = {'exact': 0, 'semantic': 0}
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.embedding_errors = 0
+        self.fallbacks: Dict[str, int] = {'stale': 0, 'canned': 0, 'none': 0}
+
+    @classmethod
+    def from_env(cls, embedder: Optional[Callable[[str], Sequence[float]]] = None) -> "ResponseCache":
+        """
+        Cache configured from LLM_CACHE_MEMORY_MB, LLM_CACHE_SIMILARITY, LLM_CACHE_TTL_<FEATURE>,
+        LLM_CACHE_STALE_SECONDS and LLM_COALESCED_FEATURES (comma separated, empty to disable coalescing)
+        """
+        ttls = {feature: float(os.getenv(f"LLM_CACHE_TTL_{feature.upper()}", str(ttl)))
+                for feature, ttl in DEFAULT_TTLS.items()}
+        similarity_threshold = float(os.getenv("LLM_CACHE_SIMILARITY", "0"))
+        coalesced = os.getenv("LLM_COALESCED_FEATURES", ','.join(DEFAULT_COALESCED_FEATURES))
+        return cls(memory_budget=int(float(os.getenv("LLM_CACHE_MEMORY_MB", "16")) * 1024 * 1024),
+                   ttls=ttls,
+                   similarity_threshold=similarity_threshold,
+                   embedder=embedder if similarity_threshold > 0 else None,
+                   coalesced_features=[feature.strip() for feature in coalesced.split(',') if feature.strip()],
+                   stale_seconds=float(os.getenv("LLM_CACHE_STALE_SECONDS", str(DEFAULT_STALE_SECONDS))))
+
+    def ttl(self, feature: str) -> float:
+        return self.ttls.get(feature, 0)
+
+    def enabled_for(self, feature: str) -> bool:
+        return self.memory_budget > 0 and self.ttl(feature) > 0
+
+    @staticmethod
+    def _key(feature: str, normalized: str) -> str:
+        return f"{feature}\x00{normalized}"
+
+    def _embed(self, normalized: str) -> Optional[np.ndarray]:
+        if not self.similarity_threshold:
+            return None
+        try:
+            vector = np.asarray(self.embedder(normalized), dtype=np.float32)
+        except Exception as e:
+            # Semantic matching is an optimization; fall back to exact matches only
+            logger.warning(f"Could not embed prompt for the response cache: {e}")
+            with self._lock:
+                self.embedding_errors += 1
+            return None
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else None
+
+    def _lookup_exact(self, key: str, now: float, recheck: bool = False) -> Optional[str]:
+        # Caller must hold the lock; a recheck of a lookup that already counted the expiry passes recheck
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= now:
+            if not recheck:
+                self.expirations += 1
+            # Expired entries stay available to _lookup_stale until their grace period ends
+            if entry.expires + self.stale_seconds <= now:
+                self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def _lookup_stale(self, key: str, now: float) -> Optional[str]:
+        # Caller must hold the lock
+        entry = self._entries.get(key)
+        if entry is None or entry.expires + self.stale_seconds <= now:
+            return None
+        return entry.value
+
+    def _lookup_semantic(self, feature: str, embedding: np.ndarray, now: float) -> Optional[str]:
+        # Caller must hold the lock
+        candidates = [(key, entry) for key, entry in self._entries.items()
+                      if entry.feature == feature and entry.embedding is not None and entry.expires > now]
+        if not candidates:
+            return None
+        similarities = np.stack([entry.embedding for _, entry in candidates]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        key, entry = candidates[best]
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def _remove(self, key: str):
+        # Caller must hold the lock
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _store(self, feature: str, normalized: str, value: str, embedding: Optional[np.ndarray]):
+        key = self._key(feature, normalized)
+        size = len(key.encode('utf-8')) + len(value.encode('utf-8')) + ENTRY_OVERHEAD
+        if embedding is not None:
+            size += embedding.nbytes
+        if size > self.memory_budget:
+            return
+        entry = _Entry(feature, value, time.monotonic() + self.ttl(feature), size, embedding)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += size
+            while self._bytes > self.memory_budget:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def get(self, feature: str, text: str) -> Optional[str]:
+        """
+        Cached response for a prompt, None on a miss (or when the feature is not cached)
+        """
+        if not self.enabled_for(feature):
+            return None
+        value, _ = self._get(feature, normalize_prompt(text))
+        return value
+
+    def _get(self, feature: str, normalized: str):
+        """
+        Returns:
+            (cached value or None, embedding of the prompt to store with a fresh response)
+        """
+        with self._lock:
+            value = self._lookup_exact(self._key(feature, normalized), time.monotonic())
+            if value is not None:
+                self.hits['exact'] += 1
+                return value, None
+
+        embedding = self._embed(normalized)
+        with self._lock:
+            if embedding is not None:
+                value = self._lookup_semantic(feature, embedding, time.monotonic())
+                if value is not None:
+                    self.hits['semantic'] += 1
+                    return value, embedding
+            self.misses += 1
+        return None, embedding
+
+    def put(self, feature: str, text: str, value: str):
+        """
+        Store a response for a prompt (ignored for features that are not cached)
+        """
+        if not self.enabled_for(feature):
+            return
+        normalized = normalize_prompt(text)
+        self._store(feature, normalized, value, self._embed(normalized))
+
+    def generate(self, feature: str, text: str, generate: Callable[[], str]) -> str:
+        """
+        Cached response for a prompt, or the result of generate() which is then cached
+
+        Concurrent misses for the same prompt of a coalesced feature run generate() once.
+
+        Args:
+            feature: Calling feature, selects the TTL
+            text: What identifies the answer, e.g. the user's question or the news category
+            generate: Produces the response on a miss; exceptions propagate and nothing is cached
+        """
+        cacheable = self.enabled_for(feature)
+        coalesced = feature in self.coalesced_features
+        if not cacheable:
+            with self._lock:
+                self.bypassed += 1
+            if not coalesced:
+                return generate()
+
+        normalized = normalize_prompt(text)
+        embedding = None
+        if cacheable:
+            value, embedding = self._get(feature, normalized)
+            if value is not None:
+                return value
+
+        def generate_and_store():
+            if cacheable:
+                # A flight that finished between our cache lookup and now has already stored the answer
+                with self._lock:
+                    value = self._lookup_exact(self._key(feature, normalized), time.monotonic(), recheck=True)
+                if value is not None:
+                    return value
+            value = generate()
+            if cacheable:
+                self._store(feature, normalized, value, embedding)
+            return value
+
+        if not coalesced:
+            return generate_and_store()
+
+        return self.flights.do(self._key(feature, normalized), generate_and_store, label=feature)
+
+    def fallback(self, feature: str, text: str, canned: Optional[str] = None) -> Optional[str]:
+        """
+        Answer to serve while Gemini is unavailable: the last response to this exact prompt even if
+        it has expired (within the stale grace period), otherwise the canned reply (may be None)
+        """
+        value = None
+        if self.memory_budget > 0:
+            with self._lock:
+                value = self._lookup_stale(self._key(feature, normalize_prompt(text)), time.monotonic())
+        kind = 'stale' if value is not None else 'canned' if canned is not None else 'none'
+        with self._lock:
+            self.fallbacks[kind] += 1
+        return value if value is not None else canned
+
+    def generate_or_fallback(self, feature: str, text: str, generate: Callable[[], str],
+                             canned: Optional[str] = None) -> Tuple[str, bool]:
+        """
+        generate(), degrading to fallback() when Gemini refuses the call (LLMUnavailable)
+
+        Returns:
+            (response, whether it is a fallback)
+
+        Raises:
+            LLMUnavailable: Gemini is unavailable and there is neither a stale response nor a canned reply
+        """
+        try:
+            return self.generate(feature, text, generate), False
+        except LLMUnavailable as e:
+            value = self.fallback(feature, text, canned)
+            if value is None:
+                raise
+            logger.warning(f"Serving a fallback {feature} response: {e}")
+            return value, True
+
+    def _degradable(self, feature: str, text: str, chunks: Iterator[str], canned: Optional[str]) -> Iterator[str]:
+        """
+        chunks, replaced by the fallback response when Gemini refuses the call before the first chunk
+        """
+        try:
+            try:
+                first = next(chunks)
+            except StopIteration:
+                return
+            except LLMUnavailable as e:
+                value = self.fallback(feature, text, canned)
+                if value is None:
+                    raise
+                logger.warning(f"Serving a fallback {feature} response: {e}")
+                yield value
+                return
+            yield first
+            yield from chunks
+        finally:
+            chunks.close()
+
+    def stream(self, feature: str, text: str, stream: Callable[[], Iterator[str]],
+               canned: Optional[str] = None) -> Iterator[str]:
+        """
+        Streaming counterpart of generate: yields a cached response as one chunk, or the chunks
+        of stream() which are cached once the stream completes
+
+        Streams are not coalesced; a stream that is closed early is not cached. When Gemini refuses
+        the call, the fallback response (see fallback) is yielded as one chunk instead.
+        """
+        if not self.enabled_for(feature):
+            with self._lock:
+                self.bypassed += 1
+            yield from self._degradable(feature, text, stream(), canned)
+            return
+
+        normalized = normalize_prompt(text)
+        value, embedding = self._get(feature, normalized)
+        if value is not None:
+            yield value
+            return
+
+        # yield from passes an early close on, so the upstream stream is closed too
+        parts = []
+        yield from self._degradable(feature, text, _collecting(stream(), parts), canned)
+        # Nothing was collected when the fallback was served instead
+        if parts:
+            self._store(feature, normalized, ''.join(parts), embedding)
+
+    async def _get_async(self, feature: str, normalized: str):
+        if self.similarity_threshold:
+            # Embedding the prompt is a blocking upstream call
+            return await asyncio.to_thread(self._get, feature, normalized)
+        return self._get(feature, normalized)
+
+    async def generate_async(self, feature: str, text: str, generate: Callable[[], Awaitable[str]]) -> str:
+        """
+        Counterpart of generate for a coroutine function
+        """
+        cacheable = self.enabled_for(feature)
+        coalesced = feature in self.coalesced_features
+        if not cacheable:
+            with self._lock:
+                self.bypassed += 1
+            if not coalesced:
+                return await generate()
+
+        normalized = normalize_prompt(text)
+        embedding = None
+        if cacheable:
+            value, embedding = await self._get_async(feature, normalized)
+            if value is not None:
+                return value
+
+        async def generate_and_store():
+            if cacheable:
+                with self._lock:
+                    value = self._lookup_exact(self._key(feature, normalized), time.monotonic(), recheck=True)
+                if value is not None:
+                    return value
+            value = await generate()
+            if cacheable:
+                self._store(feature, normalized, value, embedding)
+            return value
+
+        if not coalesced:
+            return await generate_and_store()
+
+        return await self.flights.do_async(self._key(feature, normalized), generate_and_store, label=feature)
+
+    async def generate_or_fallback_async(self, feature: str, text: str, generate: Callable[[], Awaitable[str]],
+                                         canned: Optional[str] = None) -> Tuple[str, bool]:
+        """
+        Counterpart of generate_or_fallback for a coroutine function
+        """
+        try:
+            return await self.generate_async(feature, text, generate), False
+        except LLMUnavailable as e:
+            value = self.fallback(feature, text, canned)
+            if value is None:
+                raise
+            logger.warning(f"Serving a fallback {feature} response: {e}")
+            return value, True
+
+    async def _degradable_async(self, feature: str, text: str, chunks: AsyncIterator[str],
+                                canned: Optional[str]) -> AsyncIterator[str]:
+        try:
+            try:
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+            except LLMUnavailable as e:
+                value = self.fallback(feature, text, canned)
+                if value is None:
+                    raise
+                logger.warning(f"Serving a fallback {feature} response: {e}")
+                yield value
+                return
+            yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    async def stream_async(self, feature: str, text: str, stream: Callable[[], AsyncIterator[str]],
+                           canned: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Counterpart of stream for an async generator function
+        """
+        if not self.enabled_for(feature):
+            with self._lock:
+                self.bypassed += 1
+            chunks = self._degradable_async(feature, text, stream(), canned)
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                # async for does not pass an early close on like yield from does
+                await chunks.aclose()
+            return
+
+        normalized = normalize_prompt(text)
+        value, embedding = await self._get_async(feature, normalized)
+        if value is not None:
+            yield value
+            return
+
+        parts = []
+        chunks = self._degradable_async(feature, text, _collecting_async(stream(), parts), canned)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+        if parts:
+            self._store(feature, normalized, ''.join(parts), embedding)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        """
+        Hit/miss counters, memory use and single-flight coalescing counters
+        """
+        with self._lock:
+            hits = self.hits['exact'] + self.hits['semantic']
+            lookups = hits + self.misses
+            return {
+                'exact_hits': self.hits['exact'],
+                'semantic_hits': self.hits['semantic'],
+                'misses': self.misses,
+                'bypassed': self.bypassed,
+                'hit_ratio': round(hits / lookups, 3) if lookups else 0.0,
+                'entries': len(self._entries),
+                'memory_bytes': self._bytes,
+                'memory_budget_bytes': self.memory_budget,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'embedding_errors': self.embedding_errors,
+                'fallbacks_served': dict(self.fallbacks),
+                'stale_seconds': self.stale_seconds,
+                'semantic_matching': bool(self.similarity_threshold),
+                'similarity_threshold': self.similarity_threshold,
+                'ttl_seconds': dict(self.ttls),
+                'coalesced_features': sorted(self.coalesced_features),
+                'single_flight': self.flights.stats()
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_cache() -> ResponseCache:
+    """
+    Process-wide response cache, embedding through the shared Gemini client when semantic matching is enabled
+    """
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = ResponseCache.from_env(embedder=get_client().embed)
+    return _default_cache
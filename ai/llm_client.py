@@ -0,0 +1,572 @@
+"""
+Shared HTTP client for the Gemini REST API
+
+Every feature that talks to Gemini (librarian chatbot, Tom Riddle's diary,
+Daily Prophet news) goes through one GeminiClient, so connections to the API
+are pooled and kept alive instead of paying a TCP+TLS handshake per message.
+Calls have connect/read timeouts, the number of concurrent upstream calls is
+bounded, and 429/5xx answers are retried with jittered exponential backoff.
+stream_text relays streamGenerateContent chunks as they arrive.
+
+Before going upstream, a call must pass the circuit breaker and the rate
+limiter (see llm_guard); refusals raise LLMUnavailable without waiting on
+the network, so callers can degrade to a cached or canned answer.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from llm_guard import CircuitBreaker, LatencyHistogram, RateLimiter
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE = "https://generativelanguage.googleapis.com"
+DEFAULT_MODEL = "gemini-2.0-flash"
+DEFAULT_EMBEDDING_MODEL = "text-embedding-004"
+# Upstream answers worth another attempt: rate limited or a transient server failure
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class LLMError(Exception):
+    """
+    A Gemini call failed; status_code is the upstream HTTP status when there was one
+    """
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMTimeout(LLMError):
+    """
+    Gemini did not answer within the read timeout
+    """
+
+
+class LLMEmptyResponse(LLMError):
+    """
+    Gemini answered, but without any text (e.g. the candidate was blocked by safety filters)
+    """
+
+
+class LLMBusy(LLMError):
+    """
+    Too many Gemini calls are already in flight
+    """
+
+
+class LLMUnavailable(LLMBusy):
+    """
+    The call was refused without contacting Gemini; callers may serve a fallback answer
+    """
+
+
+class LLMRateLimited(LLMUnavailable):
+    """
+    The feature's share of the upstream rate budget is used up
+    """
+
+
+class LLMCircuitOpen(LLMUnavailable):
+    """
+    Gemini has been failing and the circuit breaker is rejecting calls until it recovers
+    """
+
+
+def is_upstream_failure(error: LLMError) -> bool:
+    """
+    Whether an error means Gemini itself is unhealthy (counts towards opening the circuit):
+    timeouts, broken connections and 429/5xx answers, but not local refusals, 4xx or empty answers
+    """
+    if isinstance(error, (LLMBusy, LLMEmptyResponse)):
+        return False
+    if isinstance(error, LLMTimeout) or error.status_code is None:
+        return True
+    return error.status_code in RETRY_STATUSES
+
+
+def _generate_payload(contents, generation_config: Optional[Dict]) -> Dict:
+    if isinstance(contents, str):
+        contents = [{'role': 'user', 'parts': [{'text': contents}]}]
+    payload = {'contents': contents}
+    if generation_config:
+        payload['generationConfig'] = generation_config
+    return payload
+
+
+def _sse_events(response: requests.Response) -> Iterator[Dict]:
+    """
+    Decoded data payloads of a server-sent event stream, yielded as soon as each event is complete
+    """
+    pending = b''
+    data_lines = []
+    while True:
+        # read1 returns whatever has arrived instead of waiting for a full buffer
+        chunk = response.raw.read1(8192)
+        if not chunk:
+            break
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            line = line.rstrip(b'\r')
+            if line.startswith(b'data:'):
+                data_lines.append(line[5:].strip())
+            elif not line and data_lines:
+                yield json.loads(b'\n'.join(data_lines))
+                data_lines = []
+    if pending.startswith(b'data:'):
+        data_lines.append(pending[5:].strip())
+    if data_lines:
+        yield json.loads(b'\n'.join(data_lines))
+
+
+def response_text(result: Dict) -> Optional[str]:
+    """
+    Text of the first candidate of a generateContent response, None if it has none
+    """
+    candidates = result.get('candidates') or []
+    if not candidates:
+        return None
+    parts = (candidates[0].get('content') or {}).get('parts') or []
+    texts = [part['text'] for part in parts if part.get('text')]
+    return ''.join(texts) if texts else None
+
+
+class GeminiClient:
+    """
+    Pooled, keep-alive Gemini client with timeouts, bounded concurrency and retries
+    """
+
+    def __init__(self,
+                 api_key: str = "",
+                 api_base: str = DEFAULT_API_BASE,
+                 model: str = DEFAULT_MODEL,
+                 embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+                 connect_timeout: float = 3.05,
+                 read_timeout: float = 30.0,
+                 max_concurrency: int = 8,
+                 acquire_timeout: float = 10.0,
+                 max_retries: int = 3,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 8.0,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        """
+        Initialize the GeminiClient
+
+        Args:
+            api_key: Gemini API key (sent as a header, never in the URL)
+            api_base: Base URL of the REST API (point it at a local stub for benchmarks)
+            model: Model used when a call does not name one
+            embedding_model: Model used by embed
+            connect_timeout: Seconds to establish a connection
+            read_timeout: Seconds to wait for the answer once connected
+            max_concurrency: Upstream calls allowed in flight at once (also the connection pool size)
+            acquire_timeout: Seconds a caller waits for a free slot before LLMBusy is raised
+            max_retries: Extra attempts after a 429/5xx answer or a failed connection
+            backoff_base: First backoff ceiling in seconds, doubled on every retry
+            backoff_max: Upper bound of a single backoff
+            rate_limiter: Admission by per-feature quota and priority (None: unlimited)
+            breaker: Circuit breaker that fails calls fast while Gemini is unhealthy (None: never)
+        """
+        self.api_key = api_key
+        self.api_base = api_base.rstrip('/')
+        self.model = model
+        self.embedding_model = embedding_model
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.acquire_timeout = acquire_timeout
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = rate_limiter
+        self.breaker = breaker
+        # AsyncGeminiClient sharing this client's admission control and stats (ASGI mode only)
+        self.async_client = None
+
+        # Retries are done here (with backoff and Retry-After), not by urllib3
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counters = {'requests': 0, 'attempts': 0, 'retries': 0, 'failures': 0, 'busy_rejections': 0,
+                          'rate_limited': 0, 'circuit_rejections': 0, 'streams': 0, 'streams_aborted': 0}
+        self._feature_requests: Dict[str, int] = {}
+        self._latency_total = 0.0
+        self._first_token_total = 0.0
+        self._first_token_count = 0
+        self._latency_histograms: Dict[str, LatencyHistogram] = {}
+
+    @classmethod
+    def from_env(cls) -> "GeminiClient":
+        """
+        Client configured from GEMINI_API_KEY, GEMINI_API_BASE and the LLM_* variables
+        (see RateLimiter.from_env and CircuitBreaker.from_env for the admission settings)
+        """
+        return cls(api_key=os.getenv("GEMINI_API_KEY", ""),
+                   api_base=os.getenv("GEMINI_API_BASE", DEFAULT_API_BASE),
+                   model=os.getenv("GEMINI_MODEL", DEFAULT_MODEL),
+                   embedding_model=os.getenv("GEMINI_EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL),
+                   connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", "3.05")),
+                   read_timeout=float(os.getenv("LLM_READ_TIMEOUT", "30")),
+                   max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+                   acquire_timeout=float(os.getenv("LLM_ACQUIRE_TIMEOUT", "10")),
+                   max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+                   rate_limiter=RateLimiter.from_env(),
+                   breaker=CircuitBreaker.from_env())
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    def model_url(self, model: Optional[str] = None, method: str = 'generateContent') -> str:
+        return f"{self.api_base}/v1beta/models/{model or self.model}:{method}"
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        Full-jitter exponential backoff; a Retry-After header sets the floor
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), self.backoff_max))
+            except ValueError:
+                pass
+        return delay
+
+    def post(self, url: str, payload: Dict, feature: str = 'default', stream: bool = False) -> requests.Response:
+        """
+        POST a payload to the API, retrying 429/5xx answers and failed connections
+
+        Args:
+            url: Full method URL (see model_url)
+            payload: JSON request body
+            feature: Name of the calling feature, for stats
+            stream: Leave the body unread; the caller must close the response. The concurrency
+                slot is released on return, so use stream_text for long-running streams.
+
+        Returns:
+            The successful response
+
+        Raises:
+            LLMCircuitOpen: Gemini has been failing; the call was not attempted
+            LLMRateLimited: The feature's rate budget is used up; the call was not attempted
+            LLMBusy: No concurrency slot became free within acquire_timeout
+            LLMTimeout: The read timeout expired (not retried, the model is already working on it)
+            LLMError: Any other failure, after retries where they apply
+        """
+        with self._slot(feature):
+            return self._post_with_retries(url, payload, feature, stream)
+
+    @contextmanager
+    def _slot(self, feature: str):
+        """
+        Admit a call through the circuit breaker and rate limiter, then hold one of the
+        concurrency slots for its duration, counting it in the stats and the breaker
+
+        Raises:
+            LLMCircuitOpen: The circuit breaker is open
+            LLMRateLimited: The rate limiter rejected the call
+            LLMBusy: No slot became free within acquire_timeout
+        """
+        self._admit(feature)
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(feature):
+            raise self._refuse('rate_limited', LLMRateLimited(f"Gemini rate budget for {feature} is used up"))
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise self._refuse('busy_rejections', LLMBusy(f"{self.max_concurrency} Gemini calls already in flight"))
+
+        started = self._call_started()
+        try:
+            yield
+        except LLMError as e:
+            self._call_failed(e)
+            raise
+        except BaseException:
+            self._call_abandoned()
+            raise
+        else:
+            self._call_succeeded()
+        finally:
+            self._call_finished(feature, started)
+            self._slots.release()
+
+    # Accounting shared with AsyncGeminiClient (llm_async), so both report in one set of stats
+
+    def _admit(self, feature: str):
+        """
+        Count a call and check the circuit breaker (checked first, so that calls failing fast
+        do not spend rate budget)
+
+        Raises:
+            LLMCircuitOpen: The circuit breaker is open
+        """
+        with self._lock:
+            self._counters['requests'] += 1
+            self._feature_requests[feature] = self._feature_requests.get(feature, 0) + 1
+        if self.breaker is not None and not self.breaker.allow():
+            self._reject('circuit_rejections')
+            raise LLMCircuitOpen(f"Gemini is unavailable, retrying in {self.breaker.retry_in():.0f}s")
+
+    def _refuse(self, counter: str, error: LLMError) -> LLMError:
+        """
+        Count an admitted call that is not going upstream after all; returns the error to raise
+        """
+        if self.breaker is not None:
+            # Lets the next caller probe instead, if this one was the half-open probe
+            self.breaker.cancel()
+        self._reject(counter)
+        return error
+
+    def _reject(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+            self._counters['failures'] += 1
+
+    def _call_started(self) -> float:
+        with self._lock:
+            self._in_flight += 1
+        return time.perf_counter()
+
+    def _call_failed(self, error: LLMError):
+        with self._lock:
+            self._counters['failures'] += 1
+        if self.breaker is not None:
+            if is_upstream_failure(error):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+    def _call_succeeded(self):
+        if self.breaker is not None:
+            self.breaker.record_success()
+
+    def _call_abandoned(self):
+        """
+        The call ended without an outcome (e.g. a stream closed by its client, or a cancelled
+        task): it says nothing about Gemini's health, but must not leave a half-open probe pending
+        """
+        if self.breaker is not None:
+            self.breaker.cancel()
+
+    def _call_finished(self, feature: str, started: float):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._in_flight -= 1
+            self._latency_total += elapsed
+            histogram = self._latency_histograms.get(feature)
+            if histogram is None:
+                histogram = self._latency_histograms[feature] = LatencyHistogram()
+            histogram.observe(elapsed * 1000)
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _record_first_token(self, seconds: float):
+        with self._lock:
+            self._first_token_total += seconds
+            self._first_token_count += 1
+
+    def _post_with_retries(self, url: str, payload: Dict, feature: str, stream: bool) -> requests.Response:
+        headers = {'x-goog-api-key': self.api_key} if self.api_key else {}
+        for attempt in range(self.max_retries + 1):
+            self._count('attempts')
+            if attempt:
+                self._count('retries')
+            final_attempt = attempt == self.max_retries
+
+            try:
+                response = self.session.post(url, json=payload, headers=headers, stream=stream,
+                                             timeout=(self.connect_timeout, self.read_timeout))
+            except requests.exceptions.ReadTimeout as e:
+                raise LLMTimeout(f"Gemini did not answer within {self.read_timeout}s") from e
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout) as e:
+                if final_attempt:
+                    raise LLMError(f"Could not connect to Gemini: {e}") from e
+                delay = self._backoff(attempt)
+                logger.warning(f"Gemini connection failed for {feature} ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            except requests.exceptions.RequestException as e:
+                raise LLMError(f"Gemini request failed: {e}") from e
+
+            if response.ok:
+                return response
+
+            status = response.status_code
+            if status in RETRY_STATUSES and not final_attempt:
+                delay = self._backoff(attempt, response.headers.get('Retry-After'))
+                logger.warning(f"Gemini answered {status} for {feature}, retrying in {delay:.2f}s")
+                response.close()
+                time.sleep(delay)
+                continue
+
+            detail = response.text[:500]
+            response.close()
+            logger.error(f"Gemini error {status} for {feature}: {detail}")
+            raise LLMError(f"Gemini answered {status}", status_code=status)
+
+        # Not reached: the final attempt either returns or raises
+        raise LLMError("Gemini retries exhausted")
+
+    def generate_content(self, contents, model: Optional[str] = None, feature: str = 'default',
+                         generation_config: Optional[Dict] = None) -> Dict:
+        """
+        Call generateContent and return the decoded response
+
+        Args:
+            contents: A prompt string or a list of Gemini content dicts
+            model: Model to use instead of the client default
+            feature: Name of the calling feature, for stats
+            generation_config: Optional generationConfig (temperature, maxOutputTokens, ...)
+        """
+        payload = _generate_payload(contents, generation_config)
+        response = self.post(self.model_url(model), payload, feature=feature)
+        try:
+            return response.json()
+        except ValueError as e:
+            raise LLMError(f"Gemini returned invalid JSON: {e}") from e
+
+    def generate_text(self, contents, model: Optional[str] = None, feature: str = 'default',
+                      generation_config: Optional[Dict] = None) -> str:
+        """
+        Call generateContent and return the generated text
+
+        Raises:
+            LLMEmptyResponse: The response carries no text
+        """
+        result = self.generate_content(contents, model, feature, generation_config)
+        text = response_text(result)
+        if text is None:
+            logger.error(f"Unexpected Gemini response structure for {feature}: {result}")
+            raise LLMEmptyResponse("Gemini response contained no text")
+        return text
+
+    def stream_text(self, contents, model: Optional[str] = None, feature: str = 'default',
+                    generation_config: Optional[Dict] = None) -> Iterator[str]:
+        """
+        Call streamGenerateContent and yield the text of every chunk as it arrives
+
+        The concurrency slot is held until the stream ends. Closing the generator early (e.g. when
+        the browser disconnects) closes the upstream connection, which aborts the generation.
+
+        Raises:
+            LLMEmptyResponse: The stream ended without any text
+            LLMTimeout: No data arrived within the read timeout
+            LLMError: Any other failure; retries only happen before the first chunk
+        """
+        payload = _generate_payload(contents, generation_config)
+        url = f"{self.model_url(model, 'streamGenerateContent')}?alt=sse"
+        started = time.perf_counter()
+        with self._slot(feature):
+            response = self._post_with_retries(url, payload, feature, stream=True)
+            self._count('streams')
+            received_text = False
+            completed = False
+            try:
+                for event in _sse_events(response):
+                    text = response_text(event)
+                    if not text:
+                        continue
+                    if not received_text:
+                        received_text = True
+                        self._record_first_token(time.perf_counter() - started)
+                        # Gemini is answering, even if the client goes away before the end
+                        self._call_succeeded()
+                    yield text
+                completed = True
+            except ValueError as e:
+                raise LLMError(f"Gemini returned an invalid stream event: {e}") from e
+            except urllib3.exceptions.ReadTimeoutError as e:
+                raise LLMTimeout(f"Gemini stream stalled for {self.read_timeout}s") from e
+            except (urllib3.exceptions.HTTPError, OSError) as e:
+                raise LLMError(f"Gemini stream broke off: {e}") from e
+            finally:
+                # Closing mid-stream drops the connection instead of returning it to the pool
+                response.close()
+                if not completed:
+                    self._count('streams_aborted')
+
+            if not received_text:
+                raise LLMEmptyResponse("Gemini stream contained no text")
+
+    def embed(self, text: str, feature: str = 'embedding') -> List[float]:
+        """
+        Embedding vector of a text (embedContent with the embedding model)
+
+        Raises:
+            LLMEmptyResponse: The response carries no embedding
+        """
+        payload = {'content': {'parts': [{'text': text}]}}
+        response = self.post(self.model_url(self.embedding_model, 'embedContent'), payload, feature=feature)
+        try:
+            values = (response.json().get('embedding') or {}).get('values')
+        except ValueError as e:
+            raise LLMError(f"Gemini returned invalid JSON: {e}") from e
+        if not values:
+            raise LLMEmptyResponse("Gemini response contained no embedding")
+        return values
+
+    def stats(self) -> Dict:
+        """
+        Call counters, in-flight calls, latency (mean and per-feature histograms), mean stream
+        time-to-first-token, and the state of the rate limiter and circuit breaker
+
+        in_flight counts the calls of both serving modes; max_concurrency is this client's own
+        limit, the async client's limit and its share of in_flight are under async_client
+        """
+        async_stats = self.async_client.stats() if self.async_client is not None else None
+        with self._lock:
+            rejected = (self._counters['busy_rejections'] + self._counters['rate_limited']
+                        + self._counters['circuit_rejections'])
+            completed = self._counters['requests'] - rejected - self._in_flight
+            return {
+                **self._counters,
+                'in_flight': self._in_flight,
+                'max_concurrency': self.max_concurrency,
+                'mean_latency_ms': round(self._latency_total / completed * 1000, 1) if completed > 0 else 0.0,
+                'mean_time_to_first_token_ms': (round(self._first_token_total / self._first_token_count * 1000, 1)
+                                                if self._first_token_count else 0.0),
+                'requests_by_feature': dict(self._feature_requests),
+                'latency_histograms_ms': {feature: histogram.snapshot()
+                                          for feature, histogram in self._latency_histograms.items()},
+                'rate_limiter': self.rate_limiter.stats() if self.rate_limiter is not None else None,
+                'circuit_breaker': self.breaker.stats() if self.breaker is not None else None,
+                'async_client': async_stats,
+                'api_key_configured': self.configured
+            }
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_client() -> GeminiClient:
+    """
+    Process-wide client, created on first use so it sees the environment loaded from .env
+    """
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = GeminiClient.from_env()
+    return _default_client
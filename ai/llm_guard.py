@@ -0,0 +1,354 @@
+"""
+Admission control for upstream Gemini calls
+
+GeminiClient consults these before every call:
+
+- RateLimiter: a global token bucket shared by all features, plus a quota
+  bucket per feature. Features have a priority: interactive ones (librarian,
+  diary) may drain the global bucket completely and wait briefly for a token,
+  while lower priorities must leave a reserve untouched and are rejected
+  right away, so background news generation never crowds out a user.
+- CircuitBreaker: opens after repeated upstream failures (429/5xx, timeouts,
+  broken connections) and then rejects calls immediately instead of letting
+  each one tie up a request thread until it times out. After a cool-down a
+  single probe call is let through; its success closes the circuit again.
+- LatencyHistogram: cumulative upstream latency buckets per feature.
+
+Nothing here knows about HTTP or Gemini; the client turns a refusal into
+LLMRateLimited / LLMCircuitOpen.
+"""
+import asyncio
+import bisect
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Sequence
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Lower number = served first; features not listed get DEFAULT_PRIORITY
+FEATURE_PRIORITIES = {
+    'librarian': 0,
+    'diary': 0,
+    'embedding': 1,
+    'news': 1,
+    'news_pregen': 2
+}
+DEFAULT_PRIORITY = 1
+# Seconds a caller of each priority may wait for a token before it is rejected
+PRIORITY_MAX_WAIT = {0: 2.0, 1: 0.5, 2: 0.0}
+# Requests per minute per feature; features not listed only share the global budget
+DEFAULT_QUOTAS = {
+    'librarian': 60,
+    'diary': 60,
+    'embedding': 120,
+    'news': 30,
+    'news_pregen': 12
+}
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is unbounded
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class TokenBucket:
+    """
+    Continuously refilled token bucket (not thread-safe; RateLimiter holds its lock around it)
+    """
+
+    def __init__(self, rate_per_minute: float, burst: float):
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, level: float) -> float:
+        """Seconds until the bucket holds `level` tokens (inf if it never will)"""
+        if self.tokens >= level:
+            return 0.0
+        if self.rate <= 0 or level > self.burst:
+            return float('inf')
+        return (level - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Global token bucket with per-feature quotas and priority reserves
+    """
+
+    def __init__(self,
+                 rate_per_minute: float = 300,
+                 burst: float = 30,
+                 quotas: Optional[Dict[str, float]] = None,
+                 priorities: Optional[Dict[str, int]] = None,
+                 reserve_fraction: float = 0.25,
+                 max_wait: Optional[Dict[int, float]] = None):
+        """
+        Initialize the RateLimiter
+
+        Args:
+            rate_per_minute: Global budget of upstream calls per minute; 0 disables rate limiting
+            burst: Calls the global bucket allows back to back
+            quotas: Calls per minute per feature (each bucket holds a quarter minute of burst)
+            priorities: Priority per feature, 0 being the most important
+            reserve_fraction: Share of the global burst that each priority level below 0 must leave
+                untouched (priority 2 leaves twice as much as priority 1)
+            max_wait: Seconds a caller of each priority may wait for a token
+        """
+        self.enabled = rate_per_minute > 0
+        self.priorities = dict(FEATURE_PRIORITIES if priorities is None else priorities)
+        self.reserve_fraction = reserve_fraction
+        self.max_wait = dict(PRIORITY_MAX_WAIT if max_wait is None else max_wait)
+        self._global = TokenBucket(rate_per_minute, burst)
+        self._quotas = {feature: TokenBucket(quota, max(1.0, quota / 4.0))
+                        for feature, quota in (DEFAULT_QUOTAS if quotas is None else quotas).items() if quota > 0}
+        self._lock = threading.Lock()
+        self.admitted: Dict[str, int] = {}
+        self.rejected: Dict[str, int] = {}
+        self.waited_seconds = 0.0
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        """
+        Limiter configured from LLM_RATE_PER_MINUTE, LLM_RATE_BURST, LLM_RATE_RESERVE,
+        LLM_RATE_MAX_WAIT (interactive callers) and LLM_QUOTA_<FEATURE> (0 removes the quota)
+        """
+        quotas = {feature: float(os.getenv(f"LLM_QUOTA_{feature.upper()}", str(quota)))
+                  for feature, quota in DEFAULT_QUOTAS.items()}
+        max_wait = dict(PRIORITY_MAX_WAIT)
+        max_wait[0] = float(os.getenv("LLM_RATE_MAX_WAIT", str(max_wait[0])))
+        return cls(rate_per_minute=float(os.getenv("LLM_RATE_PER_MINUTE", "300")),
+                   burst=float(os.getenv("LLM_RATE_BURST", "30")),
+                   quotas=quotas,
+                   reserve_fraction=float(os.getenv("LLM_RATE_RESERVE", "0.25")),
+                   max_wait=max_wait)
+
+    def priority(self, feature: str) -> int:
+        return self.priorities.get(feature, DEFAULT_PRIORITY)
+
+    def _deadline(self, feature: str) -> float:
+        return time.monotonic() + self.max_wait.get(self.priority(feature), 0.0)
+
+    def _take(self, feature: str, deadline: float) -> Optional[float]:
+        """
+        One attempt to take a token
+
+        Returns:
+            0 if a token was taken, the seconds to wait before trying again, or None if the
+            token would not be available before the deadline
+        """
+        # Lower priorities must leave this many global tokens for the ones above them
+        reserve = min(self.priority(feature) * self.reserve_fraction * self._global.burst, self._global.burst - 1)
+        quota = self._quotas.get(feature)
+        with self._lock:
+            now = time.monotonic()
+            self._global.refill(now)
+            if quota is not None:
+                quota.refill(now)
+            wait = self._global.seconds_until(1 + reserve)
+            if quota is not None:
+                wait = max(wait, quota.seconds_until(1))
+            if wait == 0:
+                self._global.tokens -= 1
+                if quota is not None:
+                    quota.tokens -= 1
+                self.admitted[feature] = self.admitted.get(feature, 0) + 1
+                return 0.0
+            if now + wait > deadline:
+                self.rejected[feature] = self.rejected.get(feature, 0) + 1
+                return None
+            self.waited_seconds += wait
+            return wait
+
+    def acquire(self, feature: str) -> bool:
+        """
+        Take a token for one upstream call, waiting up to the feature's priority allowance
+
+        Returns:
+            False if the call must be rejected
+        """
+        if not self.enabled:
+            return True
+        deadline = self._deadline(feature)
+        while True:
+            wait = self._take(feature, deadline)
+            if wait is None:
+                return False
+            if wait == 0:
+                return True
+            time.sleep(wait)
+
+    async def acquire_async(self, feature: str) -> bool:
+        """
+        acquire for asyncio callers: waits without blocking the event loop
+        """
+        if not self.enabled:
+            return True
+        deadline = self._deadline(feature)
+        while True:
+            wait = self._take(feature, deadline)
+            if wait is None:
+                return False
+            if wait == 0:
+                return True
+            await asyncio.sleep(wait)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._global.refill(time.monotonic())
+            return {
+                'enabled': self.enabled,
+                'rate_per_minute': round(self._global.rate * 60, 1),
+                'burst': self._global.burst,
+                'tokens_available': round(self._global.tokens, 1),
+                'quotas_per_minute': {feature: round(bucket.rate * 60, 1) for feature, bucket in self._quotas.items()},
+                'admitted': dict(self.admitted),
+                'rejected': dict(self.rejected),
+                'waited_seconds': round(self.waited_seconds, 2)
+            }
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures -> half-open after
+    `recovery_timeout` seconds, where one probe call decides between closed and open again
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold: Consecutive upstream failures that open the circuit
+            recovery_timeout: Seconds the circuit stays open before a probe call is allowed
+                (also the time after which an unanswered probe is replaced by a new one)
+        """
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self.times_opened = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker":
+        """
+        Breaker configured from LLM_BREAKER_FAILURES and LLM_BREAKER_RECOVERY_SECONDS
+        """
+        return cls(failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+                   recovery_timeout=float(os.getenv("LLM_BREAKER_RECOVERY_SECONDS", "30")))
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go upstream now (in half-open state, only the probe may)
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and now - self._opened_at >= self.recovery_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_started = None
+                logger.info("Gemini circuit half-open, letting a probe call through")
+            if self.state == self.HALF_OPEN and (self._probe_started is None
+                                                 or now - self._probe_started >= self.recovery_timeout):
+                self._probe_started = now
+                return True
+            self.rejected += 1
+            return False
+
+    def cancel(self):
+        """
+        The allowed call was not made after all; lets the next caller probe instead
+        """
+        with self._lock:
+            self._probe_started = None
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Gemini answered the probe call, circuit closed")
+            self.state = self.CLOSED
+            self._consecutive_failures = 0
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED
+                                                and self._consecutive_failures >= self.failure_threshold):
+                logger.warning(f"Gemini circuit opened after {self._consecutive_failures} consecutive failures; "
+                               f"failing fast for {self.recovery_timeout}s")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+                self.times_opened += 1
+
+    def retry_in(self) -> float:
+        """Seconds until the next probe may go upstream (0 when closed)"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            started = self._opened_at if self.state == self.OPEN else (self._probe_started or 0.0)
+            return max(0.0, started + self.recovery_timeout - time.monotonic())
+
+    def stats(self) -> Dict:
+        retry_in = self.retry_in()
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self._consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'recovery_timeout_seconds': self.recovery_timeout,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+                'retry_in_seconds': round(retry_in, 1)
+            }
+
+
+class LatencyHistogram:
+    """
+    Cumulative latency histogram with fixed millisecond buckets (not thread-safe; the client holds its lock)
+    """
+
+    def __init__(self, buckets_ms: Sequence[float] = LATENCY_BUCKETS_MS):
+        self.bounds = list(buckets_ms)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total_ms = 0.0
+
+    def observe(self, elapsed_ms: float):
+        self.counts[bisect.bisect_left(self.bounds, elapsed_ms)] += 1
+        self.total_ms += elapsed_ms
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (None if empty or in the unbounded bucket)"""
+        count = sum(self.counts)
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for bound, bucket_count in zip(self.bounds, self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self) -> Dict:
+        count = sum(self.counts)
+        labels = [f"le_{bound:g}" for bound in self.bounds] + ['inf']
+        return {
+            'count': count,
+            'mean_ms': round(self.total_ms / count, 1) if count else 0.0,
+            'p50_le_ms': self.quantile(0.5),
+            'p95_le_ms': self.quantile(0.95),
+            'buckets': dict(zip(labels, self.counts))
+        }
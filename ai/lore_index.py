@@ -0,0 +1,353 @@
+"""
+Local lore retrieval for the Librarian
+
+A corpus of short lore passages (lore/passages.jsonl) is indexed two ways at
+startup:
+
+- BM25 over word tokens, kept in memory as flat postings arrays
+- a compact vector index of hashed character trigrams (robust to misspelt
+  spell names), saved to disk once and memory-mapped on every later start
+
+A query is scored by both, the two rankings are fused (reciprocal rank
+fusion) and the top passages become the "Library Archives Information" of
+the Librarian prompt. Everything is local, so a lookup takes well under a
+millisecond for a corpus of this size and needs no external search service.
+
+Usage:
+    python lore_index.py "what does expelliarmus do" [-k 3]
+    python lore_index.py --rebuild
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+LORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lore')
+DEFAULT_CORPUS_PATH = os.path.join(LORE_DIR, 'passages.jsonl')
+DEFAULT_INDEX_DIR = os.path.join(LORE_DIR, 'index')
+# Bump when the vector features change, so stale index files are rebuilt
+INDEX_VERSION = 1
+
+VECTOR_DIMENSIONS = 512
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Reciprocal rank fusion constant; larger values flatten the rank weights
+RRF_K = 60
+# Cosine similarity below which a vector match is not considered relevant
+MIN_VECTOR_SIMILARITY = 0.3
+# Matches scoring below this fraction of the best match of their ranking are dropped,
+# so a single common word does not pad the prompt with unrelated passages
+RELATIVE_BM25_CUTOFF = 0.4
+RELATIVE_VECTOR_CUTOFF = 0.8
+
+NO_MATCH_TEXT = "No specific information found in the immediate library archives for that query."
+
+STOPWORDS = frozenset("""
+a about an and are as at be been by can could did do does for from had has have he her him his how i if in
+into is it its me my of on or she should so tell that the their them there they this to was we were what
+when where which who whom why will with would you your know please
+""".split())
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _stem(word: str) -> str:
+    # Just enough to match plurals ("spells", "founders", "horcruxes") to their singular
+    if len(word) > 4 and word.endswith(('xes', 'ches', 'shes', 'sses')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokens without stopwords, plurals folded to the singular
+    """
+    return [_stem(word) for word in _WORD.findall(text.lower().replace("'s", "")) if word not in STOPWORDS]
+
+
+def _feature_vector(text: str) -> np.ndarray:
+    """
+    L2-normalized hashed bag of character trigrams (with word boundaries) and whole words
+    """
+    vector = np.zeros(VECTOR_DIMENSIONS, dtype=np.float32)
+    for word in tokenize(text):
+        padded = f"#{word}#"
+        features = [padded[i:i + 3] for i in range(len(padded) - 2)] + [padded]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            # The top bit picks a sign so hash collisions tend to cancel out
+            vector[value % VECTOR_DIMENSIONS] += 1.0 if value >> 63 else -1.0
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm > 0 else vector
+
+
+def load_passages(path: str) -> List[Dict]:
+    """
+    Lore passages of a JSON Lines file, each with an 'id', a 'title' and a 'text'
+    """
+    passages = []
+    with open(path, 'r', encoding='utf-8') as corpus_file:
+        for line_number, line in enumerate(corpus_file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                passage = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON: {e}")
+            if not passage.get('text'):
+                raise ValueError(f"{path}:{line_number}: passage without text")
+            passage.setdefault('id', str(line_number))
+            passage.setdefault('title', '')
+            passages.append(passage)
+    return passages
+
+
+class BM25:
+    """
+    Okapi BM25 over a fixed set of documents, with postings stored as flat NumPy arrays
+    """
+
+    def __init__(self, documents: List[List[str]], k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.num_documents = len(documents)
+        self.document_lengths = np.array([len(tokens) for tokens in documents], dtype=np.float32)
+        average_length = float(self.document_lengths.mean()) if self.num_documents else 1.0
+        # Per-document part of the BM25 denominator, precomputed once
+        self._length_norm = k1 * (1 - b + b * self.document_lengths / max(average_length, 1e-6))
+
+        postings: Dict[str, Dict[int, int]] = {}
+        for document_id, tokens in enumerate(documents):
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[document_id] = counts.get(document_id, 0) + 1
+
+        # Term -> (offset and count into the flat document id / term frequency arrays, idf)
+        self.vocabulary: Dict[str, Tuple[int, int, float]] = {}
+        document_ids, frequencies = [], []
+        for term, counts in postings.items():
+            df = len(counts)
+            idf = float(np.log(1 + (self.num_documents - df + 0.5) / (df + 0.5)))
+            self.vocabulary[term] = (len(document_ids), df, idf)
+            document_ids.extend(counts.keys())
+            frequencies.extend(counts.values())
+        self._document_ids = np.array(document_ids, dtype=np.int32)
+        self._frequencies = np.array(frequencies, dtype=np.float32)
+
+    def scores(self, query_tokens: List[str]) -> np.ndarray:
+        """
+        BM25 score of every document for a tokenized query
+        """
+        scores = np.zeros(self.num_documents, dtype=np.float32)
+        for term in set(query_tokens):
+            location = self.vocabulary.get(term)
+            if location is None:
+                continue
+            offset, count, idf = location
+            documents = self._document_ids[offset:offset + count]
+            frequencies = self._frequencies[offset:offset + count]
+            scores[documents] += idf * frequencies * (self.k1 + 1) / (frequencies + self._length_norm[documents])
+        return scores
+
+
+class LoreIndex:
+    """
+    Hybrid BM25 + vector retrieval over the lore corpus
+    """
+
+    def __init__(self, corpus_path: str = DEFAULT_CORPUS_PATH, index_dir: Optional[str] = DEFAULT_INDEX_DIR):
+        """
+        Load the corpus, build the BM25 index and load (or build and save) the vector index
+
+        Args:
+            corpus_path: JSON Lines file of passages
+            index_dir: Directory of the memory-mapped vector index, None to keep it in memory only
+        """
+        self.corpus_path = corpus_path
+        self.index_dir = index_dir
+        self.passages = load_passages(corpus_path)
+        self._lock = threading.Lock()
+        self.queries = 0
+        self._query_seconds = 0.0
+
+        with open(corpus_path, 'rb') as corpus_file:
+            self.corpus_digest = hashlib.sha256(corpus_file.read()).hexdigest()
+
+        documents = [tokenize(f"{passage['title']} {passage['text']}") for passage in self.passages]
+        self.bm25 = BM25(documents)
+        self.vectors = self._load_vectors()
+        logger.info(f"Lore index ready: {len(self.passages)} passages, {len(self.bm25.vocabulary)} terms")
+
+    @classmethod
+    def from_env(cls) -> "LoreIndex":
+        """
+        Index configured from LORE_CORPUS_PATH and LORE_INDEX_DIR (empty to keep vectors in memory)
+        """
+        index_dir = os.getenv("LORE_INDEX_DIR", DEFAULT_INDEX_DIR)
+        return cls(corpus_path=os.getenv("LORE_CORPUS_PATH", DEFAULT_CORPUS_PATH), index_dir=index_dir or None)
+
+    def _build_vectors(self) -> np.ndarray:
+        return np.stack([_feature_vector(f"{passage['title']} {passage['text']}") for passage in self.passages]) \
+            if self.passages else np.zeros((0, VECTOR_DIMENSIONS), dtype=np.float32)
+
+    def _load_vectors(self, rebuild: bool = False) -> np.ndarray:
+        """
+        Memory-map the saved vector index, rebuilding it first if it is missing or stale
+        """
+        if not self.index_dir:
+            return self._build_vectors()
+
+        manifest = {'version': INDEX_VERSION, 'corpus_sha256': self.corpus_digest,
+                    'passages': len(self.passages), 'dimensions': VECTOR_DIMENSIONS}
+        manifest_path = os.path.join(self.index_dir, 'manifest.json')
+        vectors_path = os.path.join(self.index_dir, 'vectors.npy')
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+                current = json.load(manifest_file) == manifest
+        except (OSError, ValueError):
+            current = False
+
+        if rebuild or not current or not os.path.exists(vectors_path):
+            logger.info(f"Building lore vector index in {self.index_dir}")
+            vectors = self._build_vectors()
+            try:
+                os.makedirs(self.index_dir, exist_ok=True)
+                # Write to temporary files first so a concurrent start never maps a partial index
+                handle, temporary_path = tempfile.mkstemp(dir=self.index_dir, suffix='.npy')
+                with os.fdopen(handle, 'wb') as vectors_file:
+                    np.save(vectors_file, vectors)
+                os.replace(temporary_path, vectors_path)
+                handle, temporary_path = tempfile.mkstemp(dir=self.index_dir, suffix='.json')
+                with os.fdopen(handle, 'w', encoding='utf-8') as manifest_file:
+                    json.dump(manifest, manifest_file)
+                os.replace(temporary_path, manifest_path)
+            except OSError as e:
+                logger.error(f"Could not save the lore vector index, keeping it in memory: {e}")
+                return vectors
+
+        return np.load(vectors_path, mmap_mode='r')
+
+    def rebuild(self):
+        """
+        Rewrite the on-disk vector index
+        """
+        self.vectors = self._load_vectors(rebuild=True)
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[Dict, float]]:
+        """
+        Most relevant passages for a query
+
+        Args:
+            query: The user's question
+            k: Maximum number of passages
+
+        Returns:
+            Up to k (passage, fused score) pairs, best first; empty when nothing is relevant
+        """
+        started = time.perf_counter()
+        tokens = tokenize(query)
+        results = []
+        if tokens and self.passages:
+            bm25_scores = self.bm25.scores(tokens)
+            similarities = np.asarray(self.vectors @ _feature_vector(query))
+
+            fused = np.zeros(len(self.passages), dtype=np.float32)
+            best_bm25 = float(bm25_scores.max())
+            best_similarity = float(similarities.max())
+            rankings = (
+                (bm25_scores, (bm25_scores > 0) & (bm25_scores >= RELATIVE_BM25_CUTOFF * best_bm25)),
+                (similarities, similarities >= max(MIN_VECTOR_SIMILARITY, RELATIVE_VECTOR_CUTOFF * best_similarity))
+            )
+            for scores, relevant in rankings:
+                candidates = np.flatnonzero(relevant)
+                ranked = candidates[np.argsort(-scores[candidates], kind='stable')]
+                fused[ranked] += 1.0 / (RRF_K + 1 + np.arange(len(ranked)))
+
+            count = min(k, int(np.count_nonzero(fused)))
+            if count:
+                best = np.argpartition(-fused, count - 1)[:count]
+                best = best[np.argsort(-fused[best], kind='stable')]
+                results = [(self.passages[index], float(fused[index])) for index in best]
+
+        with self._lock:
+            self.queries += 1
+            self._query_seconds += time.perf_counter() - started
+        return results
+
+    def context_for(self, query: str, k: int = 3, max_chars: int = 1200) -> str:
+        """
+        Archive text for the Librarian prompt: the top passages, within a character budget
+        """
+        lines = []
+        used = 0
+        for passage, _ in self.search(query, k):
+            line = f"- {passage['title']}: {passage['text']}" if passage['title'] else f"- {passage['text']}"
+            if lines and used + len(line) > max_chars:
+                break
+            lines.append(line[:max_chars])
+            used += len(line) + 1
+        return '\n'.join(lines) if lines else NO_MATCH_TEXT
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'passages': len(self.passages),
+                'vocabulary_terms': len(self.bm25.vocabulary),
+                'vector_dimensions': VECTOR_DIMENSIONS,
+                'vectors_memory_mapped': isinstance(self.vectors, np.memmap),
+                'queries': self.queries,
+                'mean_query_ms': round(self._query_seconds / self.queries * 1000, 3) if self.queries else 0.0
+            }
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_lore_index() -> LoreIndex:
+    """
+    Process-wide lore index, loaded on first use
+    """
+    global _default_index
+    if _default_index is None:
+        with _default_index_lock:
+            if _default_index is None:
+                _default_index = LoreIndex.from_env()
+    return _default_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('query', nargs='?', help='Question to look up')
+    parser.add_argument('-k', type=int, default=3, help='Passages to return')
+    parser.add_argument('--rebuild', action='store_true', help='Rewrite the on-disk vector index')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    index = LoreIndex.from_env()
+    if args.rebuild:
+        index.rebuild()
+        print(f"Rebuilt the vector index of {len(index.passages)} passages in {index.index_dir}")
+    if args.query:
+        for passage, score in index.search(args.query, args.k):
+            print(f"{score:.4f}  [{passage['id']}] {passage['title']}: {passage['text']}")
+        print(f"({index.stats()['mean_query_ms']} ms)")
+
+
+if __name__ == '__main__':
+    main()
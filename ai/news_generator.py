@@ -1,51 +1,319 @@
 # backend-python/news_generator.py
 from flask import Blueprint, request, jsonify
-import os
-import google.generativeai as genai
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
 import logging
+import os
+import threading
+import time
+
+from llm_cache import get_cache
+from llm_client import LLMBusy, LLMTimeout, get_client
+from sse import stream_llm_response
 
 logger = logging.getLogger(__name__)
 
 # Create a Blueprint for news generation routes
 news_bp = Blueprint('news_generator', __name__)
 
+# Categories offered by the Daily Prophet page; these get pre-generated articles
+DEFAULT_NEWS_CATEGORIES = ['Ministry Affairs', 'Dark Arts', 'Quidditch', 'Creatures', 'General']
+
+
+class ArticleBuffer:
+    """
+    Bounded per-category buffers of ready-made Daily Prophet articles
+
+    A background producer thread keeps every known category stocked: once a buffer drops below
+    the low-water mark it is refilled up to `depth`, one generation at a time and never faster
+    than the global rate budget allows. Articles older than `max_age` seconds are discarded
+    instead of served, and serving takes the oldest fresh article so few of them go stale.
+    """
+
+    def __init__(self, generate: Callable[[str], str], categories: List[str], depth: int = 2,
+                 low_water: int = 1, max_age: float = 3600, rate_per_minute: float = 6,
+                 burst: Optional[int] = None, error_backoff_max: float = 60):
+        """
+        Args:
+            generate: Produces one article for a category (runs on the producer thread)
+            categories: Categories to keep stocked (matched case-insensitively)
+            depth: Articles kept ready per category
+            low_water: A refill starts when fewer than this many articles are ready
+            max_age: Seconds an article may wait in the buffer before it is discarded
+            rate_per_minute: Global budget of background generations per minute
+            burst: Generations allowed back to back before the rate applies (default: one per category)
+            error_backoff_max: Upper bound of the wait after consecutive failed generations
+        """
+        self.generate = generate
+        self.depth = max(1, depth)
+        self.low_water = min(max(1, low_water), self.depth)
+        self.max_age = max_age
+        self.rate_per_minute = rate_per_minute
+        self.burst = max(1, burst if burst is not None else len(categories))
+        self.error_backoff_max = error_backoff_max
+
+        self._names: Dict[str, str] = {self._key(name): name for name in categories}
+        self._articles: Dict[str, deque] = {key: deque() for key in self._names}
+        # Categories being refilled, mapped to the time their refill started
+        self._refilling: Dict[str, float] = {}
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # Global rate budget as a token bucket, refilled continuously
+        self._tokens = float(self.burst)
+        self._tokens_updated = time.monotonic()
+
+        self._served = {key: 0 for key in self._names}
+        self._misses = {key: 0 for key in self._names}
+        self._generated = 0
+        self._expired = 0
+        self._errors = 0
+        self._consecutive_errors = 0
+        self._rate_limited_seconds = 0.0
+        self._generation_ms: List[float] = []
+        self._refill_ms: List[float] = []
+
+    @classmethod
+    def from_env(cls, generate: Callable[[str], str]) -> 'ArticleBuffer':
+        """
+        Build a buffer configured from environment variables
+        """
+        categories = [name.strip() for name in os.getenv('NEWS_CATEGORIES', ','.join(DEFAULT_NEWS_CATEGORIES)).split(',')
+                      if name.strip()]
+        burst = os.getenv('NEWS_BUFFER_BURST')
+        return cls(
+            generate,
+            categories,
+            depth=int(os.getenv('NEWS_BUFFER_DEPTH', '2')),
+            low_water=int(os.getenv('NEWS_BUFFER_LOW_WATER', '1')),
+            max_age=float(os.getenv('NEWS_ARTICLE_TTL', '3600')),
+            rate_per_minute=float(os.getenv('NEWS_PREGEN_RATE_PER_MINUTE', '6')),
+            burst=int(burst) if burst else None
+        )
+
+    @staticmethod
+    def _key(category: str) -> str:
+        return ' '.join(category.split()).casefold()
+
+    def knows(self, category: str) -> bool:
+        return self._key(category) in self._names
+
+    def start(self):
+        """
+        Start the producer thread (no-op if it is already running)
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='news-article-producer', daemon=True)
+        self._thread.start()
+        logger.info(f"News article producer started for {len(self._names)} categories "
+                    f"(depth {self.depth}, low water {self.low_water}, {self.rate_per_minute}/min)")
+
+    def stop(self, timeout: float = 5):
+        """
+        Stop the producer thread; an in-progress generation is allowed to finish
+        """
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def take(self, category: str) -> Optional[Tuple[str, float]]:
+        """
+        Take a ready article for a known category
+
+        Returns:
+            (article, age in seconds), or None when the category is unknown or its buffer is empty
+        """
+        key = self._key(category)
+        if key not in self._articles:
+            return None
+        with self._condition:
+            self._discard_expired(key)
+            articles = self._articles[key]
+            if not articles:
+                self._misses[key] += 1
+                self._condition.notify_all()
+                return None
+            article, created_at = articles.popleft()
+            self._served[key] += 1
+            # Wake the producer in case this dropped the buffer below the low-water mark
+            self._condition.notify_all()
+        return article, time.time() - created_at
+
+    def _discard_expired(self, key: str):
+        """Drop articles older than max_age (caller holds the lock)"""
+        articles = self._articles[key]
+        cutoff = time.time() - self.max_age
+        while articles and articles[0][1] < cutoff:
+            articles.popleft()
+            self._expired += 1
+
+    def _next_category(self) -> Optional[str]:
+        """
+        Category to generate for next, or None when every buffer is stocked (caller holds the lock)
+        """
+        now = time.monotonic()
+        for key, articles in self._articles.items():
+            self._discard_expired(key)
+            if key not in self._refilling and len(articles) < self.low_water:
+                self._refilling[key] = now
+        if not self._refilling:
+            return None
+        # The emptiest buffer first; ties go to the longest-waiting refill
+        return min(self._refilling, key=lambda key: (len(self._articles[key]), self._refilling[key]))
+
+    def _idle_timeout(self) -> float:
+        """Seconds until the oldest buffered article expires (caller holds the lock)"""
+        created = [articles[0][1] for articles in self._articles.values() if articles]
+        if not created:
+            return self.max_age
+        return max(0.1, min(created) + self.max_age - time.time())
+
+    def _acquire_budget(self) -> bool:
+        """
+        Wait for a token of the global rate budget
+
+        Returns:
+            False if the buffer was stopped while waiting
+        """
+        if self.rate_per_minute <= 0:
+            return not self._stopped.is_set()
+        rate = self.rate_per_minute / 60
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._tokens_updated) * rate)
+            self._tokens_updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            wait = (1 - self._tokens) / rate
+            self._rate_limited_seconds += wait
+            if self._stopped.wait(wait):
+                return False
+
+    def _run(self):
+        while not self._stopped.is_set():
+            with self._condition:
+                key = self._next_category()
+                if key is None:
+                    # Woken by take(); otherwise in time to replace the next expiring article
+                    self._condition.wait(self._idle_timeout())
+                    continue
+
+            if not self._acquire_budget():
+                break
+
+            name = self._names[key]
+            started = time.perf_counter()
+            try:
+                article = self.generate(name)
+            except Exception as e:
+                self._errors += 1
+                self._consecutive_errors += 1
+                backoff = min(self.error_backoff_max, 2 ** self._consecutive_errors)
+                logger.warning(f"Pre-generating a '{name}' article failed ({e}); retrying in {backoff}s")
+                self._stopped.wait(backoff)
+                continue
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            with self._condition:
+                self._consecutive_errors = 0
+                self._generated += 1
+                self._generation_ms = (self._generation_ms + [elapsed_ms])[-100:]
+                articles = self._articles[key]
+                articles.append((article, time.time()))
+                if len(articles) >= self.depth:
+                    refill_started = self._refilling.pop(key)
+                    self._refill_ms = (self._refill_ms + [(time.monotonic() - refill_started) * 1000])[-100:]
+            logger.debug(f"Pre-generated a '{name}' article in {elapsed_ms:.0f} ms")
+
+    def stats(self) -> Dict:
+        """
+        Buffer depth per category, refill latency and serving counters
+        """
+        def mean(values):
+            return round(sum(values) / len(values), 1) if values else None
+
+        now = time.time()
+        with self._condition:
+            categories = {}
+            for key, name in self._names.items():
+                articles = self._articles[key]
+                categories[name] = {
+                    'ready': len(articles),
+                    'oldest_age_seconds': round(now - articles[0][1], 1) if articles else None,
+                    'refilling': key in self._refilling,
+                    'served': self._served[key],
+                    'empty_fallbacks': self._misses[key]
+                }
+            return {
+                'running': self._thread is not None and self._thread.is_alive(),
+                'depth': self.depth,
+                'low_water': self.low_water,
+                'article_ttl_seconds': self.max_age,
+                'rate_per_minute': self.rate_per_minute,
+                'categories': categories,
+                'generated': self._generated,
+                'expired': self._expired,
+                'errors': self._errors,
+                'rate_limited_seconds': round(self._rate_limited_seconds, 1),
+                'mean_generation_ms': mean(self._generation_ms),
+                'last_generation_ms': round(self._generation_ms[-1], 1) if self._generation_ms else None,
+                'mean_refill_ms': mean(self._refill_ms),
+                'last_refill_ms': round(self._refill_ms[-1], 1) if self._refill_ms else None
+            }
+
+
 # --- Gemini Model Initialization ---
-_news_model = None # Private variable to hold the Gemini model instance
+_news_model = None # Shared Gemini client, set once an API key is configured
+_article_buffer: Optional[ArticleBuffer] = None # Pre-generated articles, set by init_news_model
 
-def init_news_model():
+def init_news_model(start_buffer: bool = True):
     """
-    Initializes the Gemini model for news generation.
+    Initializes the Gemini client for news generation.
     This function should be called once when the main Flask app starts.
+
+    Args:
+        start_buffer: Start pre-generating articles in the background (disable with NEWS_PREGENERATE=0)
     """
-    global _news_model
+    global _news_model, _article_buffer
     if _news_model is None:
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
+        client = get_client()
+        if not client.configured:
             logger.error("GEMINI_API_KEY environment variable not set for news_generator.")
             print("\nWARNING: GEMINI_API_KEY not set in environment variables. News generation will not work.\n")
-            return 
-        
-        genai.configure(api_key=api_key)
-        try:
-            _news_model = genai.GenerativeModel('gemini-2.0-flash')
-            logger.info("Gemini 'gemini-pro' model initialized successfully for news generation.")
-        except Exception as e:
-            logger.error(f"Error initializing Gemini 'gemini-pro' model for news generation: {e}")
-            _news_model = None # Ensure it's None on failure
+            return
+
+        _news_model = client
+        logger.info(f"Gemini '{client.model}' model initialized successfully for news generation.")
+
+    if start_buffer and _article_buffer is None and os.getenv('NEWS_PREGENERATE', '1') == '1':
+        _article_buffer = ArticleBuffer.from_env(
+            lambda category: _news_model.generate_text(build_news_prompt(category), feature='news_pregen'))
+        _article_buffer.start()
+
+
+def take_buffered_article(category: str) -> Optional[Tuple[str, float]]:
+    """
+    A pre-generated article for the category, or None if there is none ready
+    """
+    if _article_buffer is None:
+        return None
+    return _article_buffer.take(category)
 
 # --- News Generation Endpoint ---
-@news_bp.route('/generate-news', methods=['POST'])
-def generate_news():
-    global _news_model # Access the globally initialized model
-    if _news_model is None:
-        logger.error("Gemini news model not initialized. Cannot generate news.")
-        return jsonify({"error": "AI news service not ready. Please check server configuration and API key."}), 503
+# Answer (with status 503) while no API key is configured
+NOT_READY_REPLY = {"error": "AI news service not ready. Please check server configuration and API key."}
 
-    data = request.json
-    category = data.get('category', 'general wizarding news')
-    
-    # Prompt engineering for Gemini to ensure structured output
-    prompt_text = f"""Generate a detailed and engaging news article for The Daily Prophet about a recent event in the wizarding world, focusing on the category: {category}.
+def build_news_prompt(category):
+    """
+    Prompt engineering for Gemini to ensure structured output
+    """
+    return f"""Generate a detailed and engaging news article for The Daily Prophet about a recent event in the wizarding world, focusing on the category: {category}.
 
     Ensure the article has the following structure:
 
@@ -60,19 +328,87 @@ def generate_news():
     Make the tone authentic to the Harry Potter universe.
     """
 
+
+@news_bp.route('/generate-news', methods=['POST'])
+def generate_news():
+    global _news_model # Access the globally initialized model
+    if _news_model is None:
+        logger.error("Gemini news model not initialized. Cannot generate news.")
+        return jsonify(NOT_READY_REPLY), 503
+
+    data = request.json
+    category = data.get('category', 'general wizarding news')
+
+    buffered = take_buffered_article(category)
+    if buffered is not None:
+        news_content, age = buffered
+        logger.debug(f"Served a pre-generated '{category}' article ({age:.0f}s old)")
+        return jsonify({"news_content": news_content, "category": category, "age_seconds": round(age, 1)})
+
+    prompt_text = build_news_prompt(category)
+
     try:
-        response = _news_model.generate_content(prompt_text)
-        news_content = response.text
+        # Articles for the same category are reused until the news cache TTL expires. There is no
+        # canned article: the backend stores every article it gets, so only a stale one is reused
+        # while Gemini is unavailable.
+        news_content, degraded = get_cache().generate_or_fallback(
+            'news', category, lambda: _news_model.generate_text(prompt_text, feature='news'))
         
         logger.debug(f"Generated news for category '{category}':\n{news_content[:200]}...")
         
+        if degraded:
+            return jsonify({"news_content": news_content, "category": category, "degraded": True})
         return jsonify({"news_content": news_content, "category": category})
 
     except Exception as e:
-        logger.error(f"Error calling Gemini API for news generation for category {category}: {e}", exc_info=True)
-        return jsonify({"error": str(e), "message": "Failed to generate news article from AI."}), 500
+        body, status = news_error_reply(e, category)
+        return jsonify(body), status
+
+
+def news_error_reply(error, category):
+    """
+    JSON body and status code answering a news article that failed with `error`
+    (shared with the ASGI mode)
+    """
+    if isinstance(error, LLMBusy):
+        logger.warning(f"Gemini busy, rejecting news generation for category {category}: {error}")
+        return {"error": str(error), "message": "The owls are all out delivering. Please try again shortly."}, 503
+    if isinstance(error, LLMTimeout):
+        logger.error(f"Gemini timed out generating news for category {category}: {error}")
+        return {"error": str(error), "message": "AI news service timed out."}, 504
+    logger.error(f"Error calling Gemini API for news generation for category {category}: {error}", exc_info=error)
+    return {"error": str(error), "message": "Failed to generate news article from AI."}, 500
+
+@news_bp.route('/generate-news/stream', methods=['POST'])
+def generate_news_stream():
+    """
+    Streaming variant of /generate-news: the article as server-sent events
+    ('token' events as it is written, then a 'done' event with 'news_content' and 'category')
+    """
+    if _news_model is None:
+        logger.error("Gemini news model not initialized. Cannot generate news.")
+        return jsonify(NOT_READY_REPLY), 503
+
+    data = request.get_json(silent=True) or {}
+    category = data.get('category', 'general wizarding news')
+
+    buffered = take_buffered_article(category)
+    if buffered is not None:
+        # A ready article is sent whole, as a single token event
+        news_content, age = buffered
+        chunks = (text for text in [news_content])
+        return stream_llm_response(chunks, 'news_content', extra={'category': category, 'age_seconds': round(age, 1)})
+
+    prompt_text = build_news_prompt(category)
+    chunks = get_cache().stream('news', category, lambda: _news_model.stream_text(prompt_text, feature='news'))
+    return stream_llm_response(chunks, 'news_content', extra={'category': category})
 
 # --- Health Check Endpoint for News Generator ---
 @news_bp.route('/health', methods=['GET'])
 def health_check_news():
-    return jsonify({"status": "healthy", "service": "News Generator", "model_initialized": _news_model is not None})
\ No newline at end of file
+    return jsonify({
+        "status": "healthy",
+        "service": "News Generator",
+        "model_initialized": _news_model is not None,
+        "article_buffer": _article_buffer.stats() if _article_buffer is not None else None
+    })
\ No newline at end of file
@@ -0,0 +1,409 @@
+import numpy as np
+import logging
+import math
+from typing import List, Dict, Optional, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Landmark used as the wand tip (index finger tip)
+WAND_TIP = 8
+# Gestures during which the wand tip draws a stroke
+DRAWING_GESTURES = ('pointing',)
+
+# Number of points strokes and templates are resampled to before matching
+RESAMPLE_POINTS = 32
+# Largest possible mean point distance between two normalized strokes
+_HALF_DIAGONAL = 0.5 * math.sqrt(2.0)
+
+
+class OneEuroFilter:
+    """
+    One Euro filter over arrays of any shape
+
+    Smooths heavily while the signal is slow (removing jitter) and follows
+    quickly when it moves fast (avoiding lag). See Casiez et al., CHI 2012.
+    """
+
+    def __init__(self, min_cutoff: float = 1.0, beta: float = 3.0, d_cutoff: float = 1.0):
+        """
+        Initialize the OneEuroFilter
+
+        Args:
+            min_cutoff: Cutoff frequency (Hz) at zero speed; lower means smoother
+            beta: Speed coefficient; higher means less lag on fast motion
+            d_cutoff: Cutoff frequency (Hz) used for the derivative
+        """
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self._value = None
+        self._derivative = None
+        self._timestamp = None
+
+    @staticmethod
+    def _alpha(dt: float, cutoff):
+        tau = 1.0 / (2.0 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, value: np.ndarray, timestamp: float) -> np.ndarray:
+        """
+        Filter one sample
+
+        Args:
+            value: Sample array (same shape on every call)
+            timestamp: Sample time in seconds
+
+        Returns:
+            Filtered array
+        """
+        if self._value is None or self._value.shape != value.shape:
+            self._value = value.astype(np.float32, copy=True)
+            self._derivative = np.zeros_like(self._value)
+            self._timestamp = timestamp
+            return self._value.copy()
+
+        dt = max(timestamp - self._timestamp, 1e-3)
+        self._timestamp = timestamp
+
+        derivative = (value - self._value) / dt
+        alpha_d = self._alpha(dt, self.d_cutoff)
+        self._derivative = alpha_d * derivative + (1.0 - alpha_d) * self._derivative
+
+        cutoff = self.min_cutoff + self.beta * np.abs(self._derivative)
+        alpha = self._alpha(dt, cutoff)
+        self._value = alpha * value + (1.0 - alpha) * self._value
+        return self._value.copy()
+
+
+class LandmarkHistory:
+    """
+    Fixed-size ring buffer of recent landmarks of one hand
+
+    Storage is allocated once; pushing a frame overwrites the oldest slot
+    instead of growing a list.
+    """
+
+    def __init__(self, capacity: int = 90, num_landmarks: int = 21):
+        """
+        Initialize the LandmarkHistory
+
+        Args:
+            capacity: Number of frames kept
+            num_landmarks: Landmarks per frame
+        """
+        self.capacity = capacity
+        self.landmarks = np.zeros((capacity, num_landmarks, 3), dtype=np.float32)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self._next = 0
+        self.count = 0
+
+    def push(self, landmarks: np.ndarray, timestamp: float):
+        self.landmarks[self._next] = landmarks
+        self.timestamps[self._next] = timestamp
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def recent(self, frames: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the last frames entries in chronological order
+
+        Returns:
+            (landmarks, timestamps) arrays
+        """
+        frames = min(frames, self.count)
+        indices = (self._next - frames + np.arange(frames)) % self.capacity
+        return self.landmarks[indices], self.timestamps[indices]
+
+    def clear(self):
+        self._next = 0
+        self.count = 0
+
+
+def resample_stroke(points: np.ndarray, num_points: int = RESAMPLE_POINTS) -> np.ndarray:
+    """
+    Resample a 2D polyline to num_points points spaced evenly along its length
+    """
+    segment_lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    cumulative = np.concatenate([[0.0], np.cumsum(segment_lengths)])
+    if cumulative[-1] <= 0:
+        return np.repeat(points[:1], num_points, axis=0)
+    targets = np.linspace(0.0, cumulative[-1], num_points)
+    return np.stack([
+        np.interp(targets, cumulative, points[:, 0]),
+        np.interp(targets, cumulative, points[:, 1])
+    ], axis=1)
+
+
+def normalize_stroke(points: np.ndarray) -> np.ndarray:
+    """
+    Resample, center on the centroid and scale the larger side to 1.
+    Scaling uniformly keeps straight strokes from degenerating, and direction
+    is kept on purpose: an upward and a downward flick are different spells.
+    """
+    points = resample_stroke(np.asarray(points, dtype=np.float64))
+    points = points - points.mean(axis=0)
+    size = np.ptp(points, axis=0).max()
+    if size > 0:
+        points = points / size
+    return points
+
+
+def _circle(clockwise: bool) -> np.ndarray:
+    # Image coordinates (y grows downwards), starting at the top of the circle
+    angles = np.linspace(0, 2 * math.pi, 64) * (1 if clockwise else -1)
+    return np.stack([np.sin(angles), -np.cos(angles)], axis=1)
+
+
+# Wand stroke templates as seen by the player (mirrored webcam view, y down).
+# The frontend mirrors frames before sending them, so landmarks already arrive
+# in this orientation. Several templates may cast the same spell.
+SPELL_TEMPLATES: List[Dict] = [
+    {'name': 'circle_cw', 'spell': 'ice', 'points': _circle(True)},
+    {'name': 'circle_ccw', 'spell': 'ice', 'points': _circle(False)},
+    {'name': 'bolt', 'spell': 'lightning',
+     'points': np.array([[0.6, 0.0], [0.2, 0.5], [0.7, 0.5], [0.3, 1.0]])},
+    {'name': 'flick_up', 'spell': 'fire', 'points': np.array([[0.0, 1.0], [0.0, 0.0]])},
+    {'name': 'swipe_down', 'spell': 'shadow', 'points': np.array([[0.0, 0.0], [0.0, 1.0]])},
+    {'name': 'check', 'spell': 'nature', 'points': np.array([[0.0, 0.5], [0.35, 1.0], [1.0, 0.0]])},
+]
+
+
+class TrajectoryRecognizer:
+    """
+    Template matcher for wand strokes in the style of the $1 recognizer
+
+    Strokes and templates are resampled and normalized once; a stroke is then
+    compared to every template with a single vectorized distance computation.
+    """
+
+    def __init__(self, templates: Optional[List[Dict]] = None, min_score: float = 0.8):
+        """
+        Initialize the TrajectoryRecognizer
+
+        Args:
+            templates: Templates in the SPELL_TEMPLATES format
+            min_score: Minimum similarity (0-1) for a stroke to be recognized
+        """
+        templates = SPELL_TEMPLATES if templates is None else templates
+        self.templates = templates
+        self.min_score = min_score
+        self._normalized = np.stack([normalize_stroke(template['points']) for template in templates])
+
+    def match(self, points: np.ndarray) -> Optional[Dict]:
+        """
+        Match a stroke against all templates
+
+        Args:
+            points: (N, 2) stroke in player view coordinates
+
+        Returns:
+            {'template', 'spell', 'score'} of the best match, or None below min_score
+        """
+        stroke = normalize_stroke(points)
+        distances = np.linalg.norm(self._normalized - stroke[None], axis=2).mean(axis=1)
+        best = int(np.argmin(distances))
+        score = float(1.0 - distances[best] / _HALF_DIAGONAL)
+        if score < self.min_score:
+            return None
+        return {
+            'template': self.templates[best]['name'],
+            'spell': self.templates[best]['spell'],
+            'score': round(score, 3)
+        }
+
+
+# Shared recognizer with the default templates (stateless, safe to share)
+default_recognizer = TrajectoryRecognizer()
+
+
+class HandMotionTracker:
+    """
+    Per-session temporal state for hand tracking
+
+    Smooths landmarks with a One Euro filter per hand, debounces gesture
+    changes, records the smoothed primary hand in a LandmarkHistory and turns
+    wand strokes (drawn while pointing) into spell events.
+    """
+
+    def __init__(self,
+                 history_size: int = 90,
+                 gesture_hold_frames: int = 2,
+                 min_stroke_length: float = 0.15,
+                 min_stroke_points: int = 8,
+                 pause_seconds: float = 0.3,
+                 pause_distance: float = 0.01,
+                 lost_seconds: float = 0.5,
+                 mirror_strokes: bool = False,
+                 recognizer: Optional[TrajectoryRecognizer] = None,
+                 **filter_kwargs):
+        """
+        Initialize the HandMotionTracker
+
+        Args:
+            history_size: Frames kept in the landmark ring buffer
+            gesture_hold_frames: Frames a new gesture must persist before it is reported
+            min_stroke_length: Minimum wand tip path length (normalized units) of a stroke
+            min_stroke_points: Minimum number of frames in a stroke
+            pause_seconds: A wand tip at rest this long ends the current stroke
+            pause_distance: Movement below which the wand tip counts as resting
+            lost_seconds: Gap after which filters and strokes are reset
+            mirror_strokes: Flip strokes horizontally before matching, for clients that
+                send unmirrored camera frames (the frontend already mirrors them)
+            recognizer: Stroke recognizer (defaults to the shared one)
+            filter_kwargs: Keyword arguments for each OneEuroFilter
+        """
+        self.history = LandmarkHistory(history_size)
+        self.gesture_hold_frames = gesture_hold_frames
+        self.min_stroke_length = min_stroke_length
+        self.min_stroke_points = min_stroke_points
+        self.pause_seconds = pause_seconds
+        self.pause_distance = pause_distance
+        self.lost_seconds = lost_seconds
+        self.mirror_strokes = mirror_strokes
+        self.recognizer = recognizer or default_recognizer
+        self.filter_kwargs = filter_kwargs
+
+        self._filters: Dict[str, OneEuroFilter] = {}
+        self._last_seen = None
+        self._stroke_frames = 0
+        self._gesture = None
+        self._candidate_gesture = None
+        self._candidate_frames = 0
+
+    def smooth(self, landmarks: np.ndarray, handedness: List[str], timestamp: float) -> np.ndarray:
+        """
+        Smooth every hand in place with the filter of its handedness
+
+        Args:
+            landmarks: (hands, 21, 3) array, modified in place
+            handedness: 'Left'/'Right' label per hand
+            timestamp: Frame time in seconds
+
+        Returns:
+            The smoothed landmarks array
+        """
+        if self._last_seen is not None and timestamp - self._last_seen > self.lost_seconds:
+            self.reset()
+        if len(landmarks):
+            self._last_seen = timestamp
+
+        for hand_index in range(len(landmarks)):
+            label = handedness[hand_index] if hand_index < len(handedness) else str(hand_index)
+            hand_filter = self._filters.get(label)
+            if hand_filter is None:
+                hand_filter = self._filters[label] = OneEuroFilter(**self.filter_kwargs)
+            landmarks[hand_index] = hand_filter(landmarks[hand_index], timestamp)
+        return landmarks
+
+    def debounce_gesture(self, gesture: Optional[str]) -> Optional[str]:
+        """
+        Report a new gesture only once it persisted for gesture_hold_frames frames
+        """
+        if gesture == self._gesture:
+            self._candidate_gesture = None
+            self._candidate_frames = 0
+            return self._gesture
+
+        if gesture == self._candidate_gesture:
+            self._candidate_frames += 1
+        else:
+            self._candidate_gesture = gesture
+            self._candidate_frames = 1
+
+        if self._gesture is None or self._candidate_frames >= self.gesture_hold_frames:
+            self._gesture = gesture
+            self._candidate_gesture = None
+            self._candidate_frames = 0
+        return self._gesture
+
+    def update(self,
+               landmarks: np.ndarray,
+               gesture: Optional[str],
+               timestamp: float,
+               raw_gesture: Optional[str] = None) -> List[Dict]:
+        """
+        Record the primary hand and return spell events for finished strokes
+
+        Args:
+            landmarks: (21, 3) smoothed landmarks of the primary hand, or None if no hand
+            gesture: Debounced gesture of the primary hand
+            timestamp: Frame time in seconds
+            raw_gesture: Gesture of this frame before debouncing
+
+        Returns:
+            List of spell event dictionaries (usually empty)
+        """
+        drawing = landmarks is not None and gesture in DRAWING_GESTURES
+
+        if not drawing:
+            events = self._finish_stroke()
+            if landmarks is not None:
+                self.history.push(landmarks, timestamp)
+            return events
+
+        if raw_gesture is not None and raw_gesture not in DRAWING_GESTURES:
+            # Debouncing still reports a stroke, but this frame is not part of it
+            return []
+
+        self.history.push(landmarks, timestamp)
+        self._stroke_frames = min(self._stroke_frames + 1, self.history.capacity)
+
+        if self._is_paused(timestamp):
+            return self._finish_stroke()
+        return []
+
+    def _stroke(self) -> Tuple[np.ndarray, np.ndarray]:
+        recent, timestamps = self.history.recent(self._stroke_frames)
+        return recent[:, WAND_TIP, :2], timestamps
+
+    def _is_paused(self, timestamp: float) -> bool:
+        points, timestamps = self._stroke()
+        resting = timestamps >= timestamp - self.pause_seconds
+        if timestamps[0] > timestamp - self.pause_seconds or resting.sum() < 2:
+            return False
+        window = points[resting]
+        return float(np.ptp(window, axis=0).max()) < self.pause_distance
+
+    def _finish_stroke(self) -> List[Dict]:
+        frames, self._stroke_frames = self._stroke_frames, 0
+        if frames < self.min_stroke_points:
+            return []
+
+        recent, timestamps = self.history.recent(frames)
+        points = recent[:, WAND_TIP, :2].astype(np.float64)
+        path_length = float(np.linalg.norm(np.diff(points, axis=0), axis=1).sum())
+        if path_length < self.min_stroke_length:
+            return []
+
+        if self.mirror_strokes:
+            # Unmirrored camera frames; players draw in the mirrored view
+            points[:, 0] = -points[:, 0]
+        match = self.recognizer.match(points)
+        if match is None:
+            return []
+
+        logger.debug(f"Recognized wand stroke {match['template']} -> {match['spell']} ({match['score']})")
+        return [{
+            'type': 'spell',
+            'spell': match['spell'],
+            'template': match['template'],
+            'score': match['score'],
+            'duration': round(float(timestamps[-1] - timestamps[0]), 3)
+        }]
+
+    def reset(self):
+        """
+        Forget all temporal state (e.g. after the hand was lost)
+        """
+        for hand_filter in self._filters.values():
+            hand_filter.reset()
+        self._filters.clear()
+        self.history.clear()
+        self._stroke_frames = 0
+        self._gesture = None
+        self._candidate_gesture = None
+        self._candidate_frames = 0
@@ -0,0 +1,92 @@
+"""
+Server-sent events responses for streamed LLM output
+
+The streaming endpoints of the librarian, the diary and the Daily Prophet
+relay Gemini's chunks to the browser as they arrive:
+
+    event: token
+    data: {"text": "<chunk>"}
+
+    event: done
+    data: {"<result key>": "<full text>", ...}
+
+A failure mid-stream ends it with an `error` event. When the browser goes
+away, the server's next write fails, the response generator is closed and
+that close travels down to the upstream Gemini connection, aborting it.
+"""
+import json
+import logging
+from typing import Dict, Iterator, Optional
+
+from flask import Response, jsonify
+
+from llm_client import LLMBusy, LLMEmptyResponse, LLMError, LLMTimeout
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    # Stop reverse proxies (nginx) from buffering the stream
+    'X-Accel-Buffering': 'no'
+}
+
+
+def sse_event(event: str, data: Dict) -> str:
+    """
+    One server-sent event with a JSON payload
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def llm_error_status(error: LLMError) -> int:
+    """
+    HTTP status reported for a failed LLM call
+    """
+    if isinstance(error, LLMBusy):
+        return 503
+    if isinstance(error, LLMTimeout):
+        return 504
+    if isinstance(error, LLMEmptyResponse):
+        return 502
+    return 502 if error.status_code else 500
+
+
+def stream_llm_response(chunks: Iterator[str], result_key: str, extra: Optional[Dict] = None):
+    """
+    Relay streamed LLM text to the browser as server-sent events
+
+    The first chunk is awaited before the response starts, so failures that happen before any
+    text (busy, timeout, upstream error) still get a proper HTTP status and a JSON body.
+
+    Args:
+        chunks: Text chunks, e.g. from GeminiClient.stream_text or ResponseCache.stream
+        result_key: Key of the full text in the final 'done' event (matches the non-streaming endpoint)
+        extra: Additional fields of the 'done' event
+    """
+    try:
+        first = next(chunks)
+    except StopIteration:
+        first = None
+    except LLMError as e:
+        logger.error(f"LLM stream failed before the first chunk: {e}")
+        return jsonify({'error': str(e)}), llm_error_status(e)
+
+    def events():
+        parts = []
+        try:
+            if first is not None:
+                parts.append(first)
+                yield sse_event('token', {'text': first})
+            for chunk in chunks:
+                parts.append(chunk)
+                yield sse_event('token', {'text': chunk})
+            yield sse_event('done', {result_key: ''.join(parts), **(extra or {})})
+        except LLMError as e:
+            logger.error(f"LLM stream failed after {len(parts)} chunks: {e}")
+            yield sse_event('error', {'error': str(e), 'status': llm_error_status(e)})
+        finally:
+            # Runs on normal completion and when the client disconnected mid-stream
+            chunks.close()
+
+    return Response(events(), mimetype='text/event-stream', headers=SSE_HEADERS)
@@ -0,0 +1,161 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+from news_generator import ArticleBuffer
+
+CATEGORIES = ['Quidditch', 'Dark Arts']
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not reached'
+        time.sleep(0.005)
+
+
+class Writer:
+    """
+    Numbers the articles it writes, per category
+    """
+
+    def __init__(self):
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+        self.written = []
+
+    def __call__(self, category):
+        with self.lock:
+            article = f"{category} {next(self.counter)}"
+            self.written.append(article)
+        return article
+
+
+@pytest.fixture
+def buffers():
+    started = []
+
+    def make(generate=None, **kwargs):
+        kwargs.setdefault('rate_per_minute', 0)
+        buffer = ArticleBuffer(generate or Writer(), CATEGORIES, **kwargs)
+        buffer.start()
+        started.append(buffer)
+        return buffer
+
+    yield make
+    for buffer in started:
+        buffer.stop()
+
+
+def ready(buffer, category):
+    return buffer.stats()['categories'][category]['ready']
+
+
+def stocked(buffer, count):
+    return lambda: all(ready(buffer, category) == count for category in CATEGORIES)
+
+
+def test_every_category_is_filled_to_depth(buffers):
+    writer = Writer()
+    buffer = buffers(writer, depth=3)
+
+    wait_for(stocked(buffer, 3))
+    time.sleep(0.05)
+
+    assert len(writer.written) == 6
+    assert buffer.stats()['generated'] == 6
+
+
+def test_take_serves_the_oldest_article_and_refills(buffers):
+    buffer = buffers(depth=2)
+    wait_for(stocked(buffer, 2))
+    first_two = [buffer.take('Quidditch'), buffer.take('Quidditch')]
+
+    assert first_two[0][0] < first_two[1][0]
+    assert all(age >= 0 for _, age in first_two)
+    wait_for(lambda: ready(buffer, 'Quidditch') == 2)
+    assert buffer.stats()['categories']['Quidditch']['served'] == 2
+
+
+def test_refill_waits_for_the_low_water_mark(buffers):
+    writer = Writer()
+    buffer = buffers(writer, depth=3, low_water=2)
+    wait_for(stocked(buffer, 3))
+
+    buffer.take('quidditch')
+    time.sleep(0.05)
+    assert ready(buffer, 'Quidditch') == 2
+    assert len(writer.written) == 6
+
+    buffer.take('QUIDDITCH')
+    wait_for(lambda: ready(buffer, 'Quidditch') == 3)
+    assert len(writer.written) == 8
+
+
+def test_unknown_and_empty_categories(buffers):
+    release = threading.Event()
+
+    def blocked(category):
+        release.wait(5)
+        return category
+
+    buffer = buffers(blocked)
+    try:
+        assert buffer.take('Gossip') is None
+        assert not buffer.knows('Gossip')
+        assert buffer.take('Quidditch') is None
+        assert buffer.stats()['categories']['Quidditch']['empty_fallbacks'] == 1
+    finally:
+        release.set()
+
+
+def test_expired_articles_are_discarded_and_replaced(buffers):
+    writer = Writer()
+    buffer = buffers(writer, depth=1, max_age=0.2)
+    wait_for(stocked(buffer, 1))
+    initial = set(writer.written)
+
+    time.sleep(0.3)
+    wait_for(lambda: buffer.stats()['expired'] >= 2 and ready(buffer, 'Quidditch') == 1)
+
+    article, age = buffer.take('Quidditch')
+    assert article not in initial
+    assert age < 0.2
+
+
+def test_generations_stay_within_the_rate_budget(buffers):
+    writer = Writer()
+    buffer = buffers(writer, depth=2, rate_per_minute=60, burst=2)
+
+    time.sleep(0.5)
+
+    # Two back to back from the burst, the next one only after a second
+    assert len(writer.written) == 2
+    assert buffer.stats()['rate_limited_seconds'] > 0
+
+
+def test_failed_generations_are_retried(buffers):
+    writer = Writer()
+    failures = iter([RuntimeError('Gemini unavailable')])
+
+    def flaky(category):
+        error = next(failures, None)
+        if error is not None:
+            raise error
+        return writer(category)
+
+    buffer = buffers(flaky, depth=1, error_backoff_max=0.05)
+
+    wait_for(stocked(buffer, 1))
+    assert buffer.stats()['errors'] == 1
+
+
+def test_stop_ends_the_producer(buffers):
+    buffer = buffers()
+    wait_for(stocked(buffer, 2))
+
+    buffer.stop()
+
+    assert not buffer.stats()['running']
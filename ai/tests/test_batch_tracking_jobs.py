@@ -0,0 +1,87 @@
+import io
+import os
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+import batch_tracking_jobs
+from batch_tracking_jobs import BatchTrackingJobQueue, BatchTrackingQueueFull
+
+
+def image_upload(tmp_path, frames=3):
+    """
+    Upload directory with a few blank JPEG frames, as the route saves them
+    """
+    workdir = tmp_path / 'upload'
+    workdir.mkdir(parents=True)
+    for index in range(frames):
+        cv2.imwrite(str(workdir / f"{index:06d}.jpg"), np.zeros((48, 64, 3), dtype=np.uint8))
+    return str(workdir)
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_jobs_extract_landmarks_and_delete_the_upload(tmp_path, num_workers):
+    queue = BatchTrackingJobQueue(num_workers=num_workers)
+    try:
+        workdir = image_upload(tmp_path)
+        job = queue.submit(workdir, workdir)
+
+        assert queue.wait(job.id, 60).status == 'done', job.error
+        with np.load(io.BytesIO(job.result)) as columns:
+            assert len(columns['frame_index']) == 3
+        assert job.to_dict()['stats']['frames_processed'] == 3
+        assert not os.path.exists(workdir)
+        assert queue.stats()['completed'] == 1
+    finally:
+        queue.cleanup()
+
+
+def test_jobs_share_one_worker_pool(tmp_path):
+    queue = BatchTrackingJobQueue(num_workers=2)
+    try:
+        pools = []
+        for name in ('first', 'second'):
+            workdir = image_upload(tmp_path / name)
+            assert queue.wait(queue.submit(workdir, workdir).id, 60).status == 'done'
+            pools.append(queue._process_pool)
+
+        assert pools[0] is not None and pools[0] is pools[1]
+    finally:
+        queue.cleanup()
+
+
+def test_submissions_beyond_max_pending_are_rejected(tmp_path, monkeypatch):
+    release = threading.Event()
+
+    def blocking_extract(source, **kwargs):
+        assert release.wait(5)
+        return {}, {'frames_processed': 0}
+
+    monkeypatch.setattr(batch_tracking_jobs, 'extract_landmarks', blocking_extract)
+    monkeypatch.setattr(batch_tracking_jobs, 'landmarks_npz_bytes', lambda columns: b'')
+    queue = BatchTrackingJobQueue(num_workers=0, max_pending=1)
+    try:
+        job = queue.submit(str(tmp_path), str(tmp_path))
+        with pytest.raises(BatchTrackingQueueFull):
+            queue.submit(str(tmp_path), str(tmp_path))
+
+        release.set()
+        assert queue.wait(job.id, 5).status == 'done'
+        assert queue.stats()['rejected'] == 1
+    finally:
+        release.set()
+        queue.cleanup()
+
+
+def test_failed_jobs_report_the_error(tmp_path):
+    queue = BatchTrackingJobQueue(num_workers=0)
+    try:
+        job = queue.submit(str(tmp_path), str(tmp_path / 'missing.mp4'))
+
+        assert queue.wait(job.id, 10).status == 'error'
+        assert job.error
+        assert queue.stats()['failed'] == 1
+    finally:
+        queue.cleanup()
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from gestures import GESTURE_DEFINITIONS, GestureEngine, classify_gestures, gesture_spell
+
+WRIST = (0.5, 0.9)
+# Knuckles of index, middle, ring and pinky; the hand points up (y grows downwards)
+KNUCKLES = [(0.45, 0.7), (0.5, 0.68), (0.55, 0.7), (0.6, 0.72)]
+
+
+def hand(thumb=0, index=0, middle=0, ring=0, pinky=0, thumb_tip=None):
+    """
+    (21, 3) landmarks of a right hand with the given fingers extended (1) or folded (0)
+    """
+    landmarks = np.zeros((21, 3), dtype=np.float32)
+    landmarks[0, :2] = WRIST
+    if thumb:
+        # Straight out to the side, or towards thumb_tip for a pinch
+        tip = np.array(thumb_tip if thumb_tip is not None else (0.24, 0.70))
+        base = np.array((0.42, 0.85))
+        landmarks[1:5, :2] = [base + (tip - base) * step for step in (0.0, 1 / 3, 2 / 3, 1.0)]
+    else:
+        # Tucked across the palm
+        landmarks[1:5, :2] = [(0.42, 0.85), (0.40, 0.78), (0.44, 0.74), (0.48, 0.76)]
+    for finger, (extended, (x, y)) in enumerate(zip((index, middle, ring, pinky), KNUCKLES)):
+        first = 5 + 4 * finger
+        if extended:
+            landmarks[first:first + 4, :2] = [(x, y), (x, y - 0.05), (x, y - 0.10), (x, y - 0.15)]
+        else:
+            # Up to the middle joint, then curled back into the palm
+            landmarks[first:first + 4, :2] = [(x, y), (x, y - 0.04), (x, y - 0.01), (x, y + 0.01)]
+    return landmarks
+
+
+POSES = {
+    'fist': hand(),
+    'pointing': hand(index=1),
+    'thumbs_up': hand(thumb=1),
+    'peace': hand(index=1, middle=1),
+    'horns': hand(index=1, pinky=1),
+    'open_palm': hand(1, 1, 1, 1, 1),
+    'pinch': hand(thumb=1, index=1, thumb_tip=(0.46, 0.56)),
+}
+
+
+@pytest.mark.parametrize('name', POSES)
+def test_poses_are_classified(name):
+    [gesture] = classify_gestures(POSES[name][None])
+
+    assert gesture['name'] == name
+    assert gesture['spell'] == gesture_spell(name)
+
+
+def test_extended_fingers_are_detected():
+    features = GestureEngine().features(POSES['peace'][None])
+
+    assert features['extended'][0].tolist() == [False, True, True, False, False]
+
+
+def test_unknown_poses_report_the_finger_count():
+    [gesture] = classify_gestures(hand(index=1, middle=1, ring=1)[None])
+
+    assert gesture == {'name': '3_fingers', 'spell': None}
+
+
+def test_batches_keep_hand_order():
+    names = list(POSES)
+    batch = np.stack([POSES[name] for name in names])
+
+    assert [gesture['name'] for gesture in classify_gestures(batch)] == names
+
+
+def test_empty_batches():
+    assert classify_gestures(np.zeros((0, 21, 3), dtype=np.float32)) == []
+
+
+def test_first_matching_definition_wins():
+    # Without the pinch row a pinch is just pointing
+    engine = GestureEngine([definition for definition in GESTURE_DEFINITIONS if definition['name'] != 'pinch'])
+
+    assert engine.classify(POSES['pinch'][None])[0]['name'] == 'pointing'
+
+
+def test_gesture_spells_follow_the_table():
+    assert gesture_spell('fist') == 'shadow'
+    assert gesture_spell('pinch') is None
+    assert gesture_spell('unknown') is None
@@ -0,0 +1,202 @@
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import handtracking
+from handtracking import HandTrackerPool, HandTrackerRegistry
+from spell_trajectory import SPELL_TEMPLATES, WAND_TIP, resample_stroke
+
+FRAME = np.zeros((8, 8, 3), dtype=np.uint8)
+# The autouse fixture swaps in FakeTracker; keep the real one for frame skipping tests
+RealHandTracker = handtracking.HandTracker
+
+
+class FakeTracker:
+    """
+    Stands in for the MediaPipe-backed HandTracker; detect returns None once closed, like the real one
+    """
+    built = threading.Event()
+    release = threading.Event()
+    block = False
+
+    def __init__(self, **kwargs):
+        self.closed = False
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        if FakeTracker.block:
+            FakeTracker.built.set()
+            assert FakeTracker.release.wait(5)
+
+    def detect(self, image, color='bgr'):
+        if self.closed:
+            return None
+        self.frames_processed += 1
+        return 'detections'
+
+    def cleanup(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def fake_tracker(monkeypatch):
+    FakeTracker.built.clear()
+    FakeTracker.release.clear()
+    FakeTracker.block = False
+    monkeypatch.setattr(handtracking, 'HandTracker', FakeTracker)
+
+
+def test_new_session_setup_does_not_block_other_sessions():
+    registry = HandTrackerRegistry()
+    registry.detect('a', FRAME)
+
+    FakeTracker.block = True
+    creating = threading.Thread(target=registry.detect, args=('b', FRAME))
+    creating.start()
+    assert FakeTracker.built.wait(5)
+    try:
+        # Session b is still building its graph; session a is served meanwhile
+        assert registry.detect('a', FRAME) == 'detections'
+    finally:
+        FakeTracker.release.set()
+        creating.join(5)
+    assert registry.stats()['live_sessions'] == 2
+
+
+def test_session_evicted_before_its_frame_runs_is_recreated():
+    registry = HandTrackerRegistry(max_sessions=1)
+    lookup = registry._get_session
+    raced = []
+
+    def racing_lookup(session_id):
+        session = lookup(session_id)
+        if not raced:
+            raced.append(session)
+            # Another client arrives at the session cap and evicts this session
+            registry.detect('other', FRAME)
+        return session
+
+    registry._get_session = racing_lookup
+
+    assert registry.detect('a', FRAME) == 'detections'
+    assert raced[0].closed
+    assert registry.stats()['evicted_sessions'] == 2
+
+
+def test_idle_sessions_expire():
+    registry = HandTrackerRegistry(session_ttl=0)
+    registry.detect('a', FRAME)
+
+    assert registry.evict_idle() == 1
+    assert registry.stats()['live_sessions'] == 0
+    assert registry.stats()['frames_processed'] == 1
+
+
+def test_pool_replaces_dead_workers():
+    # Worker processes are spawned and run the real HandTracker
+    pool = HandTrackerPool(num_workers=1, queue_depth=2, result_timeout=30)
+    try:
+        assert pool.detect('a', FRAME) is not None
+
+        os.kill(pool._workers[0].process.pid, signal.SIGKILL)
+        # The frame sent to the dead process fails instead of holding its slot forever
+        pool.detect('a', FRAME)
+
+        assert pool.detect('a', FRAME) is not None
+        worker = pool.stats()['workers'][0]
+        assert worker['alive'] and worker['restarts'] == 1 and worker['in_flight'] == 0
+    finally:
+        pool.cleanup()
+
+
+
+def run_server(script):
+    """
+    Run script in a fresh interpreter, as the server process owning a pool
+    """
+    ai_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, '-c', script], cwd=ai_dir, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return result
+
+
+def test_pool_releases_shared_memory_at_exit():
+    # The server process exits without calling cleanup()
+    result = run_server(
+        "from handtracking import HandTrackerPool\n"
+        "pool = HandTrackerPool(num_workers=1, queue_depth=2)\n"
+        "pool.start()\n"
+        "print(' '.join(slot.name for worker in pool._workers for slot in worker.slots))\n"
+    )
+
+    slot_names = result.stdout.split()
+    assert len(slot_names) == 2
+    assert not [name for name in slot_names if os.path.exists(os.path.join('/dev/shm', name.lstrip('/')))]
+    assert 'leaked shared_memory' not in result.stderr
+
+
+def test_pool_workers_exit_when_the_server_is_killed():
+    # os._exit skips atexit, like a SIGKILL
+    result = run_server(
+        "import os\n"
+        "from handtracking import HandTrackerPool\n"
+        "pool = HandTrackerPool(num_workers=1, queue_depth=2)\n"
+        "pool.start()\n"
+        "print(pool._workers[0].process.pid, flush=True)\n"
+        "os._exit(0)\n"
+    )
+    status_path = f"/proc/{int(result.stdout)}/status"
+
+    deadline = time.monotonic() + 10
+    while os.path.exists(status_path) and time.monotonic() < deadline:
+        with open(status_path) as status:
+            # An orphan nobody reaps stays a zombie, which is gone as far as the pool is concerned
+            if 'State:\tZ' in status.read():
+                break
+        time.sleep(0.1)
+    else:
+        assert not os.path.exists(status_path), 'the worker outlived the server'
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_holding_the_wand_still_ends_a_stroke_with_frame_skipping(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(handtracking, 'time', clock)
+    monkeypatch.setattr(handtracking, 'classify_gestures',
+                        lambda landmarks: [{'name': 'pointing', 'spell': None}] * len(landmarks))
+    tracker = RealHandTracker(change_threshold=2.0)
+    hand = np.zeros((1, 21, 3), dtype=np.float32)
+    # Stands in for MediaPipe: the wand tip is wherever the test last put it
+    monkeypatch.setattr(tracker, '_infer_adaptive', lambda image, color='bgr': (hand.copy(), ['Right'], [0.9]))
+
+    flick_up = next(template for template in SPELL_TEMPLATES if template['name'] == 'flick_up')
+    points = np.asarray(flick_up['points'], dtype=np.float64)
+    stroke = 0.35 + 0.3 * (points - points.min(axis=0)) / np.ptp(points, axis=0).max()
+    events = []
+    try:
+        for index, point in enumerate(resample_stroke(stroke, 30)):
+            hand[0, WAND_TIP, :2] = point
+            clock.now += 1 / 30
+            # Every frame of the stroke looks different
+            events += tracker.detect(np.full((48, 64, 3), index * 8, dtype=np.uint8)).events
+        # Then the wand is held still for 2 s: identical frames, mostly skipped
+        for _ in range(60):
+            clock.now += 1 / 30
+            events += tracker.detect(np.full((48, 64, 3), 255, dtype=np.uint8)).events
+    finally:
+        tracker.cleanup()
+
+    assert tracker.frames_skipped > 50
+    assert [event['template'] for event in events] == ['flick_up']
@@ -0,0 +1,223 @@
+import numpy as np
+import pytest
+
+import llm_cache
+from llm_cache import ENTRY_OVERHEAD, ResponseCache, normalize_prompt
+from llm_client import LLMCircuitOpen
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_cache, 'time', clock)
+    return clock
+
+
+class Upstream:
+    """
+    Stands in for a Gemini call and counts how often it runs
+    """
+
+    def __init__(self, reply='answer'):
+        self.reply = reply
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return f"{self.reply} {self.calls}"
+
+
+def bag_of_words(text):
+    vocabulary = ['founded', 'hogwarts', 'who', 'built', 'castle', 'quidditch', 'rules']
+    words = text.split()
+    return [float(word in words) for word in vocabulary]
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("  Who FOUNDED\tHogwarts?! ") == 'who founded hogwarts'
+
+
+def test_exact_hits_use_the_normalized_prompt(clock):
+    cache = ResponseCache()
+    upstream = Upstream()
+
+    first = cache.generate('librarian', 'Who founded Hogwarts?', upstream)
+    second = cache.generate('librarian', 'who founded   hogwarts', upstream)
+
+    assert first == second == 'answer 1'
+    assert upstream.calls == 1
+    assert cache.stats()['exact_hits'] == 1
+
+
+def test_features_do_not_share_entries(clock):
+    cache = ResponseCache()
+    upstream = Upstream()
+
+    cache.generate('librarian', 'sports', upstream)
+    cache.generate('news', 'sports', upstream)
+
+    assert upstream.calls == 2
+
+
+def test_semantic_hits_above_the_threshold(clock):
+    cache = ResponseCache(similarity_threshold=0.8, embedder=bag_of_words)
+    upstream = Upstream()
+
+    cache.generate('librarian', 'Who founded Hogwarts?', upstream)
+    similar = cache.generate('librarian', 'Hogwarts: who founded it?', upstream)
+    unrelated = cache.generate('librarian', 'Quidditch rules', upstream)
+
+    assert similar == 'answer 1'
+    assert unrelated == 'answer 2'
+    assert cache.stats()['semantic_hits'] == 1
+
+
+def test_embedding_errors_fall_back_to_exact_matches(clock):
+    def broken_embedder(text):
+        raise RuntimeError('embedding service down')
+
+    cache = ResponseCache(similarity_threshold=0.8, embedder=broken_embedder)
+    upstream = Upstream()
+
+    cache.generate('librarian', 'Who founded Hogwarts?', upstream)
+
+    assert cache.generate('librarian', 'who founded hogwarts', upstream) == 'answer 1'
+    assert cache.stats()['embedding_errors'] >= 1
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = ResponseCache(ttls={'news': 60})
+    upstream = Upstream()
+
+    cache.generate('news', 'sports', upstream)
+    clock.now += 59
+    assert cache.generate('news', 'sports', upstream) == 'answer 1'
+
+    clock.now += 2
+    assert cache.generate('news', 'sports', upstream) == 'answer 2'
+    assert cache.stats()['expirations'] == 1
+
+
+def test_features_without_ttl_bypass_the_cache(clock):
+    cache = ResponseCache()
+    upstream = Upstream()
+
+    cache.generate('diary', 'Dear diary', upstream)
+    cache.generate('diary', 'Dear diary', upstream)
+
+    assert upstream.calls == 2
+    assert cache.stats()['bypassed'] == 2
+    assert cache.get('diary', 'Dear diary') is None
+
+
+def test_failed_calls_are_not_cached(clock):
+    cache = ResponseCache()
+    upstream = Upstream()
+
+    def failing():
+        raise RuntimeError('upstream error')
+
+    with pytest.raises(RuntimeError):
+        cache.generate('librarian', 'question', failing)
+
+    assert cache.generate('librarian', 'question', upstream) == 'answer 1'
+
+
+def test_least_recently_used_entries_are_evicted_over_budget(clock):
+    value = 'x' * 100
+    entry_size = len('librarian\x00q0'.encode()) + len(value) + ENTRY_OVERHEAD
+    cache = ResponseCache(memory_budget=3 * entry_size)
+    for index in range(3):
+        cache.put('librarian', f"q{index}", value)
+
+    # q0 becomes the most recently used, so q1 is evicted for q3
+    assert cache.get('librarian', 'q0') == value
+    cache.put('librarian', 'q3', value)
+
+    assert cache.get('librarian', 'q1') is None
+    assert [cache.get('librarian', f"q{index}") for index in (0, 2, 3)] == [value] * 3
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['memory_bytes'] <= stats['memory_budget_bytes']
+
+
+def test_responses_larger_than_the_budget_are_not_stored(clock):
+    cache = ResponseCache(memory_budget=1024)
+
+    cache.put('librarian', 'question', 'x' * 2048)
+
+    assert cache.get('librarian', 'question') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_streams_are_cached_once_complete(clock):
+    cache = ResponseCache()
+    calls = []
+
+    def stream():
+        calls.append(1)
+        yield 'Hello, '
+        yield 'wizard'
+
+    assert list(cache.stream('librarian', 'greeting', stream)) == ['Hello, ', 'wizard']
+    assert list(cache.stream('librarian', 'greeting', stream)) == ['Hello, wizard']
+    assert len(calls) == 1
+
+
+def test_streams_closed_early_are_not_cached(clock):
+    cache = ResponseCache()
+
+    def stream():
+        yield 'Hello, '
+        yield 'wizard'
+
+    chunks = cache.stream('librarian', 'greeting', stream)
+    assert next(chunks) == 'Hello, '
+    chunks.close()
+
+    assert cache.get('librarian', 'greeting') is None
+
+
+def circuit_open():
+    raise LLMCircuitOpen('Gemini is unavailable, retrying in 30s')
+
+
+def test_expired_responses_are_served_stale_while_gemini_is_unavailable(clock):
+    cache = ResponseCache(ttls={'news': 60}, stale_seconds=600)
+    cache.generate('news', 'sports', Upstream())
+
+    clock.now += 120
+    assert cache.generate_or_fallback('news', 'sports', circuit_open, canned='No news') == ('answer 1', True)
+
+    # Past the stale grace period only the canned reply is left
+    clock.now += 600
+    assert cache.generate_or_fallback('news', 'sports', circuit_open, canned='No news') == ('No news', True)
+    assert cache.stats()['fallbacks_served'] == {'stale': 1, 'canned': 1, 'none': 0}
+
+
+def test_unavailable_without_a_fallback_raises(clock):
+    cache = ResponseCache(ttls={'news': 60})
+
+    with pytest.raises(LLMCircuitOpen):
+        cache.generate_or_fallback('news', 'sports', circuit_open)
+    assert cache.generate_or_fallback('news', 'sports', Upstream()) == ('answer 1', False)
+
+
+def test_streams_fall_back_when_gemini_refuses_the_call(clock):
+    cache = ResponseCache(ttls={'librarian': 60})
+
+    def stream():
+        circuit_open()
+        yield 'never'
+
+    assert list(cache.stream('librarian', 'greeting', stream, canned='The library is closed')) == \
+        ['The library is closed']
+    assert cache.get('librarian', 'greeting') is None
@@ -0,0 +1,279 @@
+import asyncio
+import time
+
+import pytest
+
+import llm_guard
+from benchmarks.gemini_stub import GeminiStubServer
+from llm_async import AsyncGeminiClient
+from llm_client import GeminiClient
+from llm_guard import CircuitBreaker, LatencyHistogram, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_guard, 'time', clock)
+    return clock
+
+
+def limiter(**kwargs):
+    kwargs.setdefault('quotas', {})
+    return RateLimiter(**kwargs)
+
+
+def test_disabled_limiter_admits_everything(clock):
+    rate_limiter = limiter(rate_per_minute=0, burst=1)
+
+    assert all(rate_limiter.acquire('news_pregen') for _ in range(100))
+
+
+def test_interactive_callers_wait_for_a_token(clock):
+    rate_limiter = limiter(rate_per_minute=60, burst=4)
+
+    assert all(rate_limiter.acquire('librarian') for _ in range(4))
+    started = clock.now
+    assert rate_limiter.acquire('librarian')
+    assert clock.now - started == pytest.approx(1.0)
+
+
+def test_callers_are_rejected_past_their_max_wait(clock):
+    rate_limiter = limiter(rate_per_minute=6, burst=1)
+
+    assert rate_limiter.acquire('librarian')
+    # The next token is ten seconds away, beyond every priority's allowance
+    assert not rate_limiter.acquire('librarian')
+    assert rate_limiter.stats()['rejected'] == {'librarian': 1}
+
+
+def test_lower_priorities_leave_a_reserve(clock):
+    rate_limiter = limiter(rate_per_minute=60, burst=8, reserve_fraction=0.25)
+
+    # Priority 2 leaves 4 of 8 tokens, priority 1 leaves 2
+    assert [rate_limiter.acquire('news_pregen') for _ in range(5)] == [True] * 4 + [False]
+    assert [rate_limiter.acquire('news') for _ in range(2)] == [True, True]
+    assert all(rate_limiter.acquire('librarian') for _ in range(2))
+    assert rate_limiter.stats()['tokens_available'] == 0
+
+
+def test_feature_quotas(clock):
+    rate_limiter = limiter(rate_per_minute=600, burst=30, quotas={'news': 4})
+
+    assert rate_limiter.acquire('news')
+    assert not rate_limiter.acquire('news')
+    assert rate_limiter.acquire('librarian')
+
+
+def test_async_acquire_waits_in_the_event_loop():
+    # Real time: a token every 0.1 s
+    rate_limiter = limiter(rate_per_minute=600, burst=1)
+
+    async def acquire_twice():
+        started = time.monotonic()
+        admitted = [await rate_limiter.acquire_async('librarian'), await rate_limiter.acquire_async('librarian')]
+        return admitted, time.monotonic() - started
+
+    admitted, elapsed = asyncio.run(acquire_twice())
+
+    assert admitted == [True, True]
+    assert 0.05 < elapsed < 1.0
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats()['rejected'] == 1
+    assert breaker.retry_in() == pytest.approx(30)
+
+
+def open_breaker(clock, recovery_timeout=30):
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=recovery_timeout)
+    breaker.record_failure()
+    clock.now += recovery_timeout
+    return breaker
+
+
+def test_half_open_breaker_lets_one_probe_through(clock):
+    breaker = open_breaker(clock)
+
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = open_breaker(clock)
+    assert breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()['times_opened'] == 2
+    assert not breaker.allow()
+
+
+def test_cancelled_probe_lets_the_next_caller_probe(clock):
+    breaker = open_breaker(clock)
+    assert breaker.allow()
+
+    breaker.cancel()
+
+    assert breaker.allow()
+
+
+def test_unanswered_probe_is_replaced_after_the_recovery_timeout(clock):
+    breaker = open_breaker(clock)
+    assert breaker.allow()
+
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram(buckets_ms=(10, 100))
+    for elapsed_ms in (5, 50, 60, 500):
+        histogram.observe(elapsed_ms)
+
+    snapshot = histogram.snapshot()
+
+    assert snapshot['count'] == 4
+    assert snapshot['p50_le_ms'] == 100
+    assert snapshot['p95_le_ms'] is None
+
+
+@pytest.fixture
+def stub():
+    with GeminiStubServer(latency=0.05, chunk_delay=0.01) as server:
+        yield server
+
+
+def half_open_client(stub):
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+    client = GeminiClient(api_key='test', api_base=stub.base_url, max_retries=0, breaker=breaker)
+    breaker.record_failure()
+    # Backdate the failure so the next call is the half-open probe
+    breaker._opened_at -= breaker.recovery_timeout
+    return client, breaker
+
+
+def test_stream_closed_by_its_client_still_closes_the_breaker(stub):
+    client, breaker = half_open_client(stub)
+
+    stream = client.stream_text('Who founded Hogwarts?', feature='librarian')
+    assert next(stream)
+    stream.close()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_call_abandoned_without_an_outcome_releases_the_probe(stub):
+    client, breaker = half_open_client(stub)
+
+    with pytest.raises(KeyError):
+        with client._slot('librarian'):
+            raise KeyError('caller bug')
+
+    # The next caller probes right away instead of waiting out recovery_timeout
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+async def until_received(stub, requests=1, timeout=5.0):
+    """
+    Wait until the stub has read the call's request, so the call is known to be upstream
+    """
+    deadline = time.monotonic() + timeout
+    while stub.requests_served < requests:
+        assert time.monotonic() < deadline, 'the stub never received the call'
+        await asyncio.sleep(0.005)
+
+
+def test_cancelled_async_call_releases_the_probe(stub):
+    client, breaker = half_open_client(stub)
+    stub.httpd.latency = 2.0
+    async_client = AsyncGeminiClient(client)
+
+    async def cancel_call():
+        call = asyncio.ensure_future(async_client.generate_text('Who founded Hogwarts?', feature='librarian'))
+        await until_received(stub)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await async_client.aclose()
+
+    asyncio.run(cancel_call())
+
+    assert breaker.allow()
+    assert client.stats()['in_flight'] == 0
+
+
+def test_call_cancelled_while_waiting_for_a_slot_releases_the_probe(stub):
+    client, breaker = half_open_client(stub)
+    async_client = AsyncGeminiClient(client, max_concurrency=1)
+
+    async def cancel_waiting_call():
+        async_client._ensure_pools()
+        # Another call holds the only slot
+        await async_client._slots.acquire()
+        call = asyncio.ensure_future(async_client.generate_text('Who founded Hogwarts?', feature='librarian'))
+        while breaker._probe_started is None:
+            await asyncio.sleep(0)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await async_client.aclose()
+
+    asyncio.run(cancel_waiting_call())
+
+    assert stub.requests_served == 0
+    assert breaker.allow()
+
+
+def test_stats_report_the_async_client_alongside_the_threaded_one(stub):
+    client = GeminiClient(api_key='test', api_base=stub.base_url, max_concurrency=8, max_retries=0)
+    assert client.stats()['async_client'] is None
+
+    stub.httpd.latency = 0.3
+    async_client = AsyncGeminiClient(client, max_concurrency=256)
+
+    async def stats_during_call():
+        call = asyncio.ensure_future(async_client.generate_text('Who founded Hogwarts?', feature='librarian'))
+        await until_received(stub)
+        during = client.stats()
+        await call
+        await async_client.aclose()
+        return during
+
+    during = asyncio.run(stats_during_call())
+
+    assert during['max_concurrency'] == 8
+    assert during['in_flight'] == 1
+    assert during['async_client'] == {'max_concurrency': 256, 'in_flight': 1, 'connection_pools': 8}
+    assert client.stats()['async_client']['in_flight'] == 0
@@ -0,0 +1,102 @@
+import json
+
+import numpy as np
+import pytest
+
+from lore_index import NO_MATCH_TEXT, BM25, LoreIndex, tokenize
+
+PASSAGES = [
+    {'id': 'expelliarmus', 'title': 'Expelliarmus', 'text': 'The Disarming Charm knocks the wand out of an opponent\'s hand.'},
+    {'id': 'lumos', 'title': 'Lumos', 'text': 'A charm that lights the tip of the wand.'},
+    {'id': 'quidditch', 'title': 'Quidditch', 'text': 'A sport played on broomsticks with four balls and seven players.'},
+    {'id': 'snitch', 'title': 'The Golden Snitch', 'text': 'A tiny winged ball; catching it ends the Quidditch match.'},
+    {'id': 'hogwarts', 'title': 'Hogwarts', 'text': 'The British school of magic, housed in a castle in Scotland.'},
+]
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    path = tmp_path / 'passages.jsonl'
+    path.write_text('\n'.join(json.dumps(passage) for passage in PASSAGES) + '\n', encoding='utf-8')
+    return path
+
+
+@pytest.fixture
+def index(corpus, tmp_path):
+    return LoreIndex(corpus_path=str(corpus), index_dir=str(tmp_path / 'index'))
+
+
+def ids(results):
+    return [passage['id'] for passage, _ in results]
+
+
+def test_tokenize_drops_stopwords_and_folds_plurals():
+    assert tokenize("What are the Founders' spells?") == ['founder', 'spell']
+    assert tokenize("Horcruxes and matches") == ['horcrux', 'match']
+
+
+def test_bm25_prefers_rarer_terms():
+    bm25 = BM25([['wand', 'charm'], ['wand', 'broom'], ['wand', 'snitch']])
+
+    scores = bm25.scores(['wand', 'snitch'])
+
+    assert int(np.argmax(scores)) == 2
+    assert bm25.scores(['unknown']).tolist() == [0.0, 0.0, 0.0]
+
+
+def test_best_passage_ranks_first(index):
+    assert ids(index.search('how do I disarm an opponent with expelliarmus', k=3))[0] == 'expelliarmus'
+    assert ids(index.search('what ends a quidditch match', k=3))[0] == 'snitch'
+
+
+def test_scores_are_descending_and_limited_to_k(index):
+    results = index.search('quidditch ball', k=2)
+
+    assert len(results) <= 2
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_misspelt_terms_match_through_trigrams(index):
+    assert ids(index.search('expeliarmus', k=1)) == ['expelliarmus']
+
+
+def test_irrelevant_queries_return_nothing(index):
+    assert index.search('zzxq qqvv', k=3) == []
+    assert index.search('what is the', k=3) == []
+    assert index.context_for('zzxq qqvv') == NO_MATCH_TEXT
+
+
+def test_context_respects_the_character_budget(index):
+    context = index.context_for('wand charm', k=3, max_chars=80)
+
+    assert context.startswith('- ')
+    assert len(context) <= 80
+
+
+def test_vector_index_is_saved_and_memory_mapped(corpus, tmp_path, index):
+    reopened = LoreIndex(corpus_path=str(corpus), index_dir=str(tmp_path / 'index'))
+
+    assert reopened.stats()['vectors_memory_mapped']
+    np.testing.assert_array_equal(np.asarray(reopened.vectors), np.asarray(index.vectors))
+
+
+def test_changed_corpus_rebuilds_the_vector_index(corpus, tmp_path, index):
+    with open(corpus, 'a', encoding='utf-8') as corpus_file:
+        corpus_file.write(json.dumps({'id': 'owls', 'title': 'Owls', 'text': 'Owls deliver the post.'}) + '\n')
+
+    reopened = LoreIndex(corpus_path=str(corpus), index_dir=str(tmp_path / 'index'))
+
+    assert reopened.vectors.shape[0] == len(PASSAGES) + 1
+    assert ids(reopened.search('who delivers the post', k=1)) == ['owls']
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('what does expelliarmus do', 'spell-expelliarmus'),
+    ('who founded hogwarts', 'hogwarts-founders'),
+    ('tell me about horcruxes', 'horcrux'),
+])
+def test_shipped_corpus_answers_common_questions(query, expected):
+    index = LoreIndex(index_dir=None)
+
+    assert ids(index.search(query, k=3))[0] == expected
@@ -0,0 +1,197 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llm_cache import ResponseCache, SingleFlight
+
+CALLERS = 8
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not reached'
+        time.sleep(0.001)
+
+
+class BlockingCall:
+    """
+    Upstream call that blocks until released, counting how often it runs
+    """
+
+    def __init__(self, result='answer', error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def run_callers(target, count=CALLERS):
+    results = [None] * count
+
+    def caller(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=caller, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    flights = SingleFlight()
+    call = BlockingCall()
+
+    threads, results = run_callers(lambda: flights.do('key', call, label='news'))
+    wait_for(lambda: flights.stats()['coalesced_requests'] == CALLERS - 1)
+    call.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['answer'] * CALLERS
+    assert call.calls == 1
+    stats = flights.stats()
+    assert stats['coalesced_by_feature'] == {'news': CALLERS - 1}
+    assert stats['max_waiters'] == CALLERS - 1
+    assert stats['in_flight_keys'] == 0
+
+
+def test_errors_reach_every_waiting_caller():
+    flights = SingleFlight()
+    call = BlockingCall(error=RuntimeError('upstream error'))
+
+    threads, results = run_callers(lambda: flights.do('key', call))
+    wait_for(lambda: flights.stats()['coalesced_requests'] == CALLERS - 1)
+    call.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert call.calls == 1
+
+
+def test_finished_calls_are_not_reused():
+    flights = SingleFlight()
+    calls = []
+
+    flights.do('key', lambda: calls.append(1))
+    flights.do('key', lambda: calls.append(1))
+
+    assert len(calls) == 2
+    assert flights.stats()['coalesced_requests'] == 0
+
+
+def test_cache_misses_for_the_same_prompt_are_coalesced():
+    cache = ResponseCache()
+    call = BlockingCall()
+
+    threads, results = run_callers(lambda: cache.generate('librarian', 'Who founded Hogwarts?', call))
+    wait_for(lambda: cache.flights.stats()['coalesced_requests'] == CALLERS - 1)
+    call.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['answer'] * CALLERS
+    assert call.calls == 1
+    assert cache.get('librarian', 'who founded hogwarts') == 'answer'
+
+
+def test_uncached_features_are_still_coalesced():
+    cache = ResponseCache(ttls={'news': 0})
+    call = BlockingCall()
+
+    threads, results = run_callers(lambda: cache.generate('news', 'sports', call))
+    wait_for(lambda: cache.flights.stats()['coalesced_requests'] == CALLERS - 1)
+    call.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == ['answer'] * CALLERS
+    assert call.calls == 1
+
+
+def test_async_calls_share_one_upstream_call():
+    flights = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'answer'
+
+    async def main():
+        return await asyncio.gather(*(flights.do_async('key', call, label='librarian') for _ in range(CALLERS)))
+
+    assert asyncio.run(main()) == ['answer'] * CALLERS
+    assert len(calls) == 1
+    assert flights.stats()['coalesced_by_feature'] == {'librarian': CALLERS - 1}
+    assert flights.stats()['in_flight_keys'] == 0
+
+
+def test_async_errors_reach_every_caller():
+    flights = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise RuntimeError('upstream error')
+
+    async def main():
+        return await asyncio.gather(*(flights.do_async('key', call) for _ in range(CALLERS)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(main())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flights.stats()['upstream_calls'] == 1
+
+
+def test_cancelled_async_caller_does_not_cancel_the_call():
+    flights = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.05)
+        return 'answer'
+
+    async def main():
+        leaving = asyncio.ensure_future(flights.do_async('key', call))
+        staying = asyncio.ensure_future(flights.do_async('key', call))
+        await asyncio.sleep(0.01)
+        leaving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        return await staying
+
+    assert asyncio.run(main()) == 'answer'
+    assert flights.stats()['upstream_calls'] == 1
+
+
+def test_async_cache_misses_are_coalesced_and_cached():
+    cache = ResponseCache()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'answer'
+
+    async def main():
+        first = await asyncio.gather(*(cache.generate_async('news', 'sports', call) for _ in range(CALLERS)))
+        return first, await cache.generate_async('news', 'sports', call)
+
+    first, cached = asyncio.run(main())
+
+    assert first == ['answer'] * CALLERS
+    assert cached == 'answer'
+    assert len(calls) == 1
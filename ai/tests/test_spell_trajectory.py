@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from spell_trajectory import (SPELL_TEMPLATES, WAND_TIP, HandMotionTracker, LandmarkHistory,
+                              TrajectoryRecognizer, resample_stroke)
+
+FPS = 30.0
+
+
+def on_screen(points, size=0.3, offset=0.35):
+    """
+    Template scaled into normalized frame coordinates, as the wand tip would draw it
+    """
+    points = np.asarray(points, dtype=np.float64)
+    points = points - points.min(axis=0)
+    return offset + size * points / np.ptp(points, axis=0).max()
+
+
+def draw(tracker, stroke, start=0.0):
+    """
+    Feed a stroke to the tracker frame by frame, then lower the wand; returns the spell events
+    """
+    landmarks = np.zeros((21, 3), dtype=np.float32)
+    timestamp = start
+    for point in resample_stroke(stroke, 30):
+        landmarks[WAND_TIP, :2] = point
+        timestamp += 1.0 / FPS
+        assert tracker.update(landmarks.copy(), 'pointing', timestamp) == []
+    return tracker.update(landmarks.copy(), 'fist', timestamp + 1.0 / FPS)
+
+
+@pytest.mark.parametrize('template', SPELL_TEMPLATES, ids=lambda template: template['name'])
+def test_recognizer_matches_every_template(template):
+    match = TrajectoryRecognizer().match(on_screen(template['points']))
+
+    assert match['template'] == template['name']
+    assert match['spell'] == template['spell']
+    assert match['score'] > 0.95
+
+
+@pytest.mark.parametrize('template', SPELL_TEMPLATES, ids=lambda template: template['name'])
+def test_tracker_casts_strokes_drawn_on_screen(template):
+    # The frontend mirrors frames before sending them, so landmarks are in the player's view
+    events = draw(HandMotionTracker(), on_screen(template['points']))
+
+    assert [(event['template'], event['spell']) for event in events] == [(template['name'], template['spell'])]
+
+
+def test_tracker_mirrors_strokes_of_unmirrored_clients():
+    bolt = next(template for template in SPELL_TEMPLATES if template['name'] == 'bolt')
+    camera_view = on_screen(bolt['points'])
+    camera_view[:, 0] = 1.0 - camera_view[:, 0]
+
+    events = draw(HandMotionTracker(mirror_strokes=True), camera_view)
+
+    assert [event['spell'] for event in events] == ['lightning']
+
+
+def test_recognizer_rejects_scribbles():
+    rng = np.random.default_rng(0)
+
+    assert TrajectoryRecognizer().match(rng.random((40, 2))) is None
+
+
+def test_short_strokes_are_ignored():
+    tracker = HandMotionTracker(min_stroke_length=0.15)
+
+    assert draw(tracker, on_screen([[0.0, 0.0], [0.0, 1.0]], size=0.05)) == []
+
+
+def test_gesture_debounce_needs_consecutive_frames():
+    tracker = HandMotionTracker(gesture_hold_frames=2)
+
+    assert tracker.debounce_gesture('fist') == 'fist'
+    assert tracker.debounce_gesture('pointing') == 'fist'
+    assert tracker.debounce_gesture('fist') == 'fist'
+    assert tracker.debounce_gesture('pointing') == 'fist'
+    assert tracker.debounce_gesture('pointing') == 'pointing'
+
+
+def test_landmark_history_returns_recent_frames_in_order():
+    history = LandmarkHistory(capacity=3, num_landmarks=1)
+    for frame in range(5):
+        history.push(np.full((1, 3), frame), float(frame))
+
+    landmarks, timestamps = history.recent(10)
+
+    assert timestamps.tolist() == [2.0, 3.0, 4.0]
+    assert landmarks[:, 0, 0].tolist() == [2.0, 3.0, 4.0]
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from transform import SPELL_REGISTRY, parse_pipeline, run_pipeline, run_tiled
+
+
+@pytest.fixture
+def image():
+    rng = np.random.default_rng(7)
+    # Smooth structure plus noise, so blurs and edges have something to work on
+    gradient = np.linspace(0, 200, 320, dtype=np.float32)[None, :, None]
+    return (gradient + rng.integers(0, 55, (240, 320, 3))).astype(np.uint8)
+
+
+@pytest.mark.parametrize('spells', [['lumos'], ['pictorifica'], ['serpensortia'],
+                                    ['pictorifica', 'lumos', 'serpensortia']])
+@pytest.mark.parametrize('band_rows', [1, 17, 64, 239])
+def test_tiled_run_matches_full_image(image, spells, band_rows):
+    stages = [SPELL_REGISTRY[name] for name in spells]
+    expected = image.copy()
+    for stage in stages:
+        expected = stage.stage(expected)
+
+    tiled = run_tiled([stage.stage for stage in stages], image.copy(),
+                      overlap=sum(stage.tile_overlap for stage in stages), band_rows=band_rows)
+
+    np.testing.assert_array_equal(tiled, expected)
+
+
+def test_pipeline_tiles_large_images_bit_exactly(image):
+    spells = parse_pipeline('serpensortia+lumos+pictorifica')
+
+    full, _ = run_pipeline(spells, image.copy(), tile_pixels=None)
+    tiled, alpha = run_pipeline(spells, image.copy(), tile_pixels=320 * 50)
+
+    assert alpha is None
+    np.testing.assert_array_equal(tiled, full)
+
+
+def test_parse_pipeline():
+    assert parse_pipeline(' Lumos + serpensortia ') == ['lumos', 'serpensortia']
+    assert parse_pipeline(['lumos', 'pictorifica+lumos']) == ['lumos', 'pictorifica', 'lumos']
+    for spec in ['', 'lumos+unknown', '+'.join(['lumos'] * 6)]:
+        with pytest.raises(ValueError):
+            parse_pipeline(spec)
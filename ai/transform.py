@@ -1,44 +1,465 @@
-from PIL import Image
-from io import BytesIO
+from PIL import Image, features
 import numpy as np
 import cv2
+import logging
+import os
+import math
+import threading
+import time
+from io import BytesIO
+from typing import Callable, Dict, List, Optional, Tuple
+import onnxruntime as ort
 import rembg
+from rembg.sessions import sessions_class
+from rembg.sessions.u2net import U2netSession
+from transform_cache import TransformCache, content_digest, default_cache, make_key
+
+logger = logging.getLogger(__name__)
+
+# Uploads are decoded and processed at no more than this many pixels; larger
+# inputs are rejected outright
+MAX_WORKING_PIXELS = int(float(os.getenv("TRANSFORM_MAX_MEGAPIXELS", "4")) * 1_000_000)
+MAX_INPUT_PIXELS = int(float(os.getenv("TRANSFORM_MAX_INPUT_MEGAPIXELS", "100")) * 1_000_000)
+# Images above this many pixels run tileable spells band by band
+TILE_PIXELS = int(float(os.getenv("TRANSFORM_TILE_MEGAPIXELS", "1")) * 1_000_000)
+
+# Background removal model and ONNX Runtime thread count (0 = runtime default)
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")
+REMBG_NUM_THREADS = int(os.getenv("REMBG_NUM_THREADS", "0"))
+
+
+class BackgroundRemover:
+    """
+    Shared rembg session for Evanesco
+
+    Without an explicit session rembg builds a new ONNX Runtime session for
+    every call; this one is created once (optionally pre-warmed at startup)
+    and reused by all requests. Alpha masks are cached by image content, so
+    applying another effect to the same cut-out does not run the model again.
+    """
+
+    def __init__(self,
+                 model_name: str = REMBG_MODEL,
+                 num_threads: int = REMBG_NUM_THREADS,
+                 cache: Optional[TransformCache] = default_cache):
+        self.model_name = model_name
+        self.num_threads = num_threads
+        self.cache = cache
+        self.load_seconds = None
+        self.mask_cache_hits = 0
+        self.mask_cache_misses = 0
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._session is not None
+
+    def session_options(self) -> ort.SessionOptions:
+        """
+        ONNX Runtime options of the session, sized to num_threads
+        """
+        options = ort.SessionOptions()
+        if self.num_threads > 0:
+            options.intra_op_num_threads = self.num_threads
+            options.inter_op_num_threads = self.num_threads
+        return options
+
+    def load(self):
+        with self._lock:
+            if self._session is None:
+                started = time.perf_counter()
+                # Built like rembg.new_session, which can only size the session
+                # through the process-wide OMP_NUM_THREADS
+                session_class = next((cls for cls in sessions_class if cls.name() == self.model_name),
+                                     U2netSession)
+                self._session = session_class(self.model_name, self.session_options())
+                self.load_seconds = time.perf_counter() - started
+                logger.info(f"Loaded rembg model {self.model_name} in {self.load_seconds:.2f}s")
+        return self._session
+
+    def warm_up(self):
+        """
+        Load the model and run one small inference so the first request does not pay for either
+        """
+        try:
+            self.remove(np.zeros((64, 64, 3), dtype=np.uint8))
+        except Exception as e:
+            logger.error(f"rembg warm-up failed: {e}")
+
+    def warm_up_async(self) -> threading.Thread:
+        thread = threading.Thread(target=self.warm_up, daemon=True, name="rembg-warmup")
+        thread.start()
+        return thread
+
+    def mask(self, rgb: np.ndarray) -> np.ndarray:
+        """
+        Foreground alpha mask (H, W) of an RGB array
+        """
+        key = None
+        if self.cache is not None:
+            key = make_key('mask', content_digest(np.ascontiguousarray(rgb)),
+                           model=self.model_name, shape=rgb.shape)
+            cached = self.cache.get(key)
+            if cached is not None:
+                mask = cv2.imdecode(np.frombuffer(cached, np.uint8), cv2.IMREAD_GRAYSCALE)
+                if mask is not None:
+                    self.mask_cache_hits += 1
+                    return mask
+            self.mask_cache_misses += 1
+
+        mask = np.asarray(rembg.remove(rgb, session=self.load(), only_mask=True))
+        if key is not None:
+            # PNG keeps the mask lossless and small
+            ok, encoded = cv2.imencode('.png', mask)
+            if ok:
+                self.cache.put(key, encoded.tobytes())
+        return mask
+
+    @staticmethod
+    def _apply_mask(rgb: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        return cv2.multiply(rgb, cv2.merge([mask, mask, mask]), scale=1.0 / 255)
+
+    def remove(self, rgb: np.ndarray) -> np.ndarray:
+        """
+        Cut out the foreground of an RGB array; returns an RGBA array with a transparent background
+        """
+        mask = self.mask(rgb)
+        return np.dstack((self._apply_mask(rgb, mask), mask))
+
+    def stats(self) -> dict:
+        return {
+            'model': self.model_name,
+            'loaded': self.loaded,
+            'load_seconds': round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            'num_threads': self.num_threads or None,
+            'mask_cache_hits': self.mask_cache_hits,
+            'mask_cache_misses': self.mask_cache_misses
+        }
+
+
+background_remover = BackgroundRemover()
+
+# Separator of chained spells, e.g. "evanesco+lumos"
+PIPELINE_SEPARATOR = '+'
+MAX_PIPELINE_LENGTH = 5
+
+
+class Spell:
+    """
+    A registered transfiguration spell
+
+    Stages work on NumPy arrays so a pipeline of spells runs on one buffer,
+    with PIL decode/encode only at the edges. A plain stage takes an RGB
+    (H, W, 3) uint8 array and returns one; it may modify its input in place.
+    Stages with uses_alpha take and return (rgb, alpha), where alpha is an
+    (H, W) uint8 mask or None while the image is still opaque.
+
+    Local filters declare tile_overlap, the radius in pixels of the
+    neighbourhood an output pixel depends on. Large images then run through
+    them in horizontal bands extended by that overlap, which gives the same
+    result as a full-image run while bounding the filter's temporary buffers.
+    """
+
+    def __init__(self, name: str, stage: Callable, cost: float = 1.0, uses_alpha: bool = False,
+                 in_process: bool = False, tile_overlap: Optional[int] = None, description: str = ''):
+        """
+        Args:
+            name: Spell name used by the API
+            stage: Array-in/array-out implementation
+            cost: Rough relative cost per megapixel, for clients and scheduling
+            uses_alpha: Whether the stage reads or produces the alpha channel
+            in_process: Whether the stage needs state of the server process (e.g. a loaded model)
+                and should not be shipped to a worker process
+            tile_overlap: Neighbourhood radius for tiled processing, None if the spell needs the whole image
+            description: Human readable effect
+        """
+        self.name = name
+        self.stage = stage
+        self.cost = cost
+        self.uses_alpha = uses_alpha
+        self.in_process = in_process
+        self.tile_overlap = tile_overlap
+        self.description = description
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'cost': self.cost,
+            'uses_alpha': self.uses_alpha,
+            'in_process': self.in_process,
+            'tileable': self.tile_overlap is not None,
+            'description': self.description
+        }
+
+
+SPELL_REGISTRY: Dict[str, Spell] = {}
+
+def register_spell(name: str, **metadata) -> Callable:
+    """
+    Decorator registering an array stage as a spell, see Spell for the metadata
+    """
+    def decorator(stage: Callable) -> Callable:
+        SPELL_REGISTRY[name] = Spell(name, stage, **metadata)
+        return stage
+    return decorator
 
-def apply_evanesco(image: Image.Image) -> Image.Image:
-    buf = BytesIO()
-    image.save(buf, format='PNG')
-    img_data = buf.getvalue()
-    output_data = rembg.remove(img_data)
-    return Image.open(BytesIO(output_data)).convert("RGB")
+@register_spell('evanesco', cost=20.0, uses_alpha=True, in_process=True,
+                description='Removes the background')
+def evanesco(rgb: np.ndarray, alpha: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    mask = background_remover.mask(rgb)
+    if alpha is not None:
+        mask = cv2.min(mask, alpha)
+    # The removed background stays black, as with rembg's cut-out without alpha
+    cv2.multiply(rgb, cv2.merge([mask, mask, mask]), dst=rgb, scale=1.0 / 255)
+    return rgb, mask
 
-def apply_pictorifica(image: Image.Image) -> Image.Image:
-    img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+@register_spell('pictorifica', cost=1.0, tile_overlap=16, description='Turns the image into a pencil sketch')
+def pictorifica(rgb: np.ndarray) -> np.ndarray:
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
     inv = 255 - gray
     blur = cv2.GaussianBlur(inv, (21, 21), 0)
     sketch = cv2.divide(gray, 255 - blur, scale=256)
-    sketch_rgb = cv2.cvtColor(sketch, cv2.COLOR_GRAY2RGB)
-    return Image.fromarray(sketch_rgb)
-
-def apply_lumos(image: Image.Image) -> Image.Image:
-    img = np.array(image)
-    glow = cv2.GaussianBlur(img, (0, 0), sigmaX=15, sigmaY=15)
-    result = cv2.addWeighted(img, 1.0, glow, 0.6, 0)
-    return Image.fromarray(result)
-
-def apply_serpensortia(image: Image.Image) -> Image.Image:
-    green_overlay = Image.new('RGB', image.size, (0, 100, 0))
-    return Image.blend(image, green_overlay, alpha=0.3)
-
-def apply_spell(spell: str, image: Image.Image) -> Image.Image:
-    spell = spell.lower()
-    if spell == 'evanesco':
-        return apply_evanesco(image)
-    elif spell == 'pictorifica':
-        return apply_pictorifica(image)
-    elif spell == 'lumos':
-        return apply_lumos(image)
-    elif spell == 'serpensortia':
-        return apply_serpensortia(image)
+    return cv2.cvtColor(sketch, cv2.COLOR_GRAY2RGB, dst=rgb)
+
+# sigma 15 -> OpenCV uses a 91 px kernel for 8-bit images, i.e. a radius of 45
+@register_spell('lumos', cost=3.0, tile_overlap=48, description='Adds a soft magical glow')
+def lumos(rgb: np.ndarray) -> np.ndarray:
+    glow = cv2.GaussianBlur(rgb, (0, 0), sigmaX=15, sigmaY=15)
+    return cv2.addWeighted(rgb, 1.0, glow, 0.6, 0, dst=rgb)
+
+# Serpensortia blends this much of its green into the image
+SERPENSORTIA_COLOR = (0, 100, 0)
+SERPENSORTIA_ALPHA = 0.3
+
+@register_spell('serpensortia', cost=0.5, tile_overlap=0, description='Tints the image snake green')
+def serpensortia(rgb: np.ndarray) -> np.ndarray:
+    cv2.convertScaleAbs(rgb, dst=rgb, alpha=1.0 - SERPENSORTIA_ALPHA)
+    tint = tuple(channel * SERPENSORTIA_ALPHA for channel in SERPENSORTIA_COLOR) + (0,)
+    return cv2.add(rgb, tint, dst=rgb)
+
+SPELLS = tuple(SPELL_REGISTRY)
+
+def parse_pipeline(spells) -> List[str]:
+    """
+    Normalize a spell or pipeline spec ("evanesco+lumos" or a list of names) to a list of spell names
+
+    Raises:
+        ValueError: On unknown spells or an empty or too long pipeline
+    """
+    if isinstance(spells, str):
+        spells = [spells]
+    names = [name.strip().lower() for spec in spells for name in spec.split(PIPELINE_SEPARATOR) if name.strip()]
+    if not names:
+        raise ValueError("No spell given")
+    if len(names) > MAX_PIPELINE_LENGTH:
+        raise ValueError(f"At most {MAX_PIPELINE_LENGTH} spells can be chained")
+    for name in names:
+        if name not in SPELL_REGISTRY:
+            raise ValueError(f"Unknown spell: {name}")
+    return names
+
+def pipeline_in_process(spells: List[str]) -> bool:
+    """
+    Whether any spell of a pipeline has to run in the server process
+    """
+    return any(SPELL_REGISTRY[name].in_process for name in spells)
+
+def run_tiled(stages: List[Callable], rgb: np.ndarray, overlap: int, band_rows: int) -> np.ndarray:
+    """
+    Run local filter stages over an RGB array in place, one horizontal band at a time
+
+    Every band is extended by overlap rows of original pixels on both sides,
+    so the result matches running the stages on the whole image as long as
+    overlap covers their combined neighbourhood.
+    """
+    height = rgb.shape[0]
+    band_rows = max(band_rows, overlap, 1)
+    # Original pixels of the rows just above the current band, which the
+    # previous band has already overwritten
+    above = rgb[:0].copy()
+    for top in range(0, height, band_rows):
+        bottom = min(height, top + band_rows)
+        band = np.concatenate((above, rgb[top:min(height, bottom + overlap)]))
+        above = rgb[max(top, bottom - overlap):bottom].copy()
+        offset = len(band) - (min(height, bottom + overlap) - top)
+        for stage in stages:
+            band = stage(band)
+        rgb[top:bottom] = band[offset:offset + bottom - top]
+    return rgb
+
+def run_pipeline(spells: List[str], rgb: np.ndarray,
+                 tile_pixels: Optional[int] = TILE_PIXELS) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Apply spells in order to a writable RGB array
+
+    Consecutive tileable spells run together band by band when the image is
+    larger than tile_pixels.
+
+    Returns:
+        (rgb, alpha) where alpha is None unless a spell produced one
+    """
+    alpha = None
+    tiled = tile_pixels is not None and rgb.shape[0] * rgb.shape[1] > tile_pixels
+    index = 0
+    while index < len(spells):
+        spell = SPELL_REGISTRY[spells[index]]
+        if tiled and spell.tile_overlap is not None and not spell.uses_alpha:
+            # Fuse the run of tileable spells starting here
+            run = [spell]
+            while (index + len(run) < len(spells)
+                   and SPELL_REGISTRY[spells[index + len(run)]].tile_overlap is not None
+                   and not SPELL_REGISTRY[spells[index + len(run)]].uses_alpha):
+                run.append(SPELL_REGISTRY[spells[index + len(run)]])
+            overlap = sum(stage.tile_overlap for stage in run)
+            band_rows = max(1, tile_pixels // rgb.shape[1])
+            rgb = run_tiled([stage.stage for stage in run], rgb, overlap, band_rows)
+            index += len(run)
+            continue
+        if spell.uses_alpha:
+            rgb, alpha = spell.stage(rgb, alpha)
+        else:
+            rgb = spell.stage(rgb)
+        index += 1
+    return rgb, alpha
+
+def check_image_size(image_bytes: bytes) -> Tuple[int, int]:
+    """
+    Read the dimensions of an upload from its header, without decoding it
+
+    Raises:
+        ValueError: If the image cannot be read or has more than MAX_INPUT_PIXELS
+    """
+    try:
+        width, height = Image.open(BytesIO(image_bytes)).size
+    except Exception as e:
+        raise ValueError(f"Unreadable image: {e}")
+    if width * height > MAX_INPUT_PIXELS:
+        raise ValueError(f"Image of {width}x{height} exceeds {MAX_INPUT_PIXELS / 1e6:.0f} megapixels")
+    return width, height
+
+def load_working_image(image_bytes: bytes, max_pixels: int = MAX_WORKING_PIXELS) -> Tuple[Image.Image, Tuple[int, int]]:
+    """
+    Decode an upload as RGB at no more than max_pixels
+
+    JPEGs are decoded directly at a reduced scale (Image.draft), so a large
+    photo is never materialized at full resolution.
+
+    Returns:
+        (image, original (width, height))
+    """
+    original_size = check_image_size(image_bytes)
+    image = Image.open(BytesIO(image_bytes))
+    width, height = original_size
+    if width * height > max_pixels:
+        scale = math.sqrt(max_pixels / float(width * height))
+        target = (max(1, int(width * scale)), max(1, int(height * scale)))
+        # Picks the smallest DCT scale that is still at least the target size
+        image.draft('RGB', target)
+        image = image.convert('RGB')
+        image.thumbnail(target, Image.LANCZOS)
     else:
-        raise ValueError(f"Unknown spell: {spell}")
+        image = image.convert('RGB')
+    return image, original_size
+
+def apply_spells(spells, image: Image.Image, keep_alpha: bool = False) -> Image.Image:
+    """
+    Apply a spell pipeline to a PIL image, converting to and from NumPy only once
+
+    Args:
+        spells: Spell name, pipeline ("evanesco+lumos") or list of spell names
+        image: Input image
+        keep_alpha: Return an RGBA image if a spell produced an alpha channel
+    """
+    # One writable copy that every stage may work on in place
+    rgb = np.array(image.convert('RGB'))
+    rgb, alpha = run_pipeline(parse_pipeline(spells), rgb)
+    if keep_alpha and alpha is not None:
+        return Image.fromarray(np.dstack((rgb, alpha)), 'RGBA')
+    return Image.fromarray(rgb)
+
+# Response formats: name -> (PIL format, mimetype, keeps transparency)
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', False),
+    'webp': ('WEBP', 'image/webp', True),
+    'avif': ('AVIF', 'image/avif', True),
+}
+PREVIEW_MAX_SIZE = 256
+PREVIEW_QUALITY = 40
+
+def available_output_formats() -> List[str]:
+    """
+    Output formats this Pillow build can encode
+    """
+    return [name for name in OUTPUT_FORMATS if name == 'jpeg' or features.check(name)]
+
+def parse_output_options(output_format: Optional[str] = None,
+                         quality: Optional[str] = None,
+                         progressive: Optional[str] = None) -> Dict:
+    """
+    Validate response encoding options from request fields
+
+    Returns:
+        {'format', 'quality', 'progressive'}; quality None means the encoder default
+
+    Raises:
+        ValueError: On an unsupported format or a quality outside 1-100
+    """
+    output_format = (output_format or 'jpeg').lower()
+    if output_format == 'jpg':
+        output_format = 'jpeg'
+    if output_format not in available_output_formats():
+        raise ValueError(f"Unsupported output format: {output_format} "
+                         f"(available: {', '.join(available_output_formats())})")
+    if quality not in (None, ''):
+        try:
+            quality = int(quality)
+        except ValueError:
+            raise ValueError("quality must be an integer")
+        if not 1 <= quality <= 100:
+            raise ValueError("quality must be between 1 and 100")
+    else:
+        quality = None
+    return {
+        'format': output_format,
+        'quality': quality,
+        'progressive': output_format == 'jpeg' and (progressive or '').lower() in ('1', 'true', 'yes')
+    }
+
+def output_mimetype(options: Dict) -> str:
+    return OUTPUT_FORMATS[options['format']][1]
+
+def encode_image(image: Image.Image, options: Dict) -> bytes:
+    """
+    Encode a result image with parse_output_options options
+    """
+    pil_format, _, keeps_alpha = OUTPUT_FORMATS[options['format']]
+    if image.mode == 'RGBA' and not keeps_alpha:
+        image = image.convert('RGB')
+    save_options = {}
+    if options.get('quality') is not None:
+        save_options['quality'] = options['quality']
+    if pil_format == 'JPEG' and options.get('progressive'):
+        # Progressive scans let clients show a coarse image while the rest downloads
+        save_options.update(progressive=True, optimize=True)
+    elif pil_format == 'AVIF':
+        save_options['speed'] = 8
+
+    buffer = BytesIO()
+    image.save(buffer, format=pil_format, **save_options)
+    return buffer.getvalue()
+
+# Previews are WebP where available: about a third the size of a JPEG at this quality
+PREVIEW_OPTIONS = {
+    'format': 'webp' if 'webp' in available_output_formats() else 'jpeg',
+    'quality': PREVIEW_QUALITY,
+    'progressive': False
+}
+
+def encode_preview(image: Image.Image) -> bytes:
+    """
+    Small low-quality rendition of a result (PREVIEW_OPTIONS), for galleries and to show before the full image
+    """
+    preview = image.copy()
+    preview.thumbnail((PREVIEW_MAX_SIZE, PREVIEW_MAX_SIZE), Image.BILINEAR)
+    return encode_image(preview, PREVIEW_OPTIONS)
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def content_digest(data) -> str:
+    """
+    SHA-256 of an upload (bytes or any buffer), the content address of an image
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(namespace: str, digest: str, **params) -> str:
+    """
+    Cache key for a derived artifact of some content
+
+    Args:
+        namespace: Kind of artifact, e.g. 'result' or 'mask'
+        digest: Content digest of the input
+        params: Everything else the artifact depends on (spell, output format, ...)
+    """
+    description = json.dumps([namespace, digest, params], sort_keys=True, default=str)
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+class TransformCache:
+    """
+    Two-tier content-addressed cache for transform results and intermediates
+
+    Values are encoded bytes. The memory tier is an LRU bounded by a byte
+    budget; the optional disk tier keeps one file per key and evicts the least
+    recently used files once its own byte budget is exceeded. Disk hits are
+    promoted back into memory.
+    """
+
+    def __init__(self,
+                 memory_budget: int = 64 * 1024 * 1024,
+                 disk_dir: Optional[str] = None,
+                 disk_budget: int = 512 * 1024 * 1024):
+        """
+        Initialize the TransformCache
+
+        Args:
+            memory_budget: Bytes kept in memory (0 disables the memory tier)
+            disk_dir: Directory of the disk tier, None to disable it
+            disk_budget: Bytes kept on disk
+        """
+        self.memory_budget = max(0, int(memory_budget))
+        self.disk_dir = disk_dir
+        self.disk_budget = max(0, int(disk_budget))
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self.hits: Dict[str, int] = {'memory': 0, 'disk': 0}
+        self.misses = 0
+        self.evictions: Dict[str, int] = {'memory': 0, 'disk': 0}
+
+        if self.disk_dir:
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+                self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+            except OSError as e:
+                logger.error(f"Disabling transform disk cache at {self.disk_dir}: {e}")
+                self.disk_dir = None
+
+    @classmethod
+    def from_env(cls) -> "TransformCache":
+        """
+        Cache configured from TRANSFORM_CACHE_MEMORY_MB, TRANSFORM_CACHE_DIR and TRANSFORM_CACHE_DISK_MB
+        """
+        return cls(memory_budget=int(float(os.getenv("TRANSFORM_CACHE_MEMORY_MB", "64")) * 1024 * 1024),
+                   disk_dir=os.getenv("TRANSFORM_CACHE_DIR") or None,
+                   disk_budget=int(float(os.getenv("TRANSFORM_CACHE_DISK_MB", "512")) * 1024 * 1024))
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Look a key up in memory, then on disk; None on a miss
+        """
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.hits['memory'] += 1
+                return value
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits['disk'] += 1
+            self._memory_put(key, value)
+        return value
+
+    def put(self, key: str, value: bytes):
+        """
+        Store a value in both tiers
+        """
+        with self._lock:
+            self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def _memory_put(self, key: str, value: bytes):
+        # Caller must hold the lock
+        if len(value) > self.memory_budget:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = value
+        self._memory_bytes += len(value)
+        while self._memory_bytes > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions['memory'] += 1
+
+    def _disk_path(self, key: str) -> str:
+        # Fan out over subdirectories so no single directory grows huge
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _disk_entries(self):
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                yield path, info.st_size, info.st_mtime
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as cached_file:
+                value = cached_file.read()
+            # The modification time doubles as the LRU timestamp
+            os.utime(path)
+            return value
+        except OSError:
+            return None
+
+    def _disk_put(self, key: str, value: bytes):
+        if not self.disk_dir or len(value) > self.disk_budget:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            # Write to a temporary file first so readers never see a partial entry
+            handle, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(handle, 'wb') as cached_file:
+                cached_file.write(value)
+            os.replace(temporary_path, path)
+        except OSError as e:
+            logger.error(f"Error writing transform cache entry {key}: {e}")
+            return
+
+        with self._disk_lock:
+            self._disk_bytes += len(value) - previous_size
+            if self._disk_bytes > self.disk_budget:
+                self._disk_evict()
+
+    def _disk_evict(self):
+        """
+        Remove least recently used files until the disk tier is at 90% of its budget. Caller must hold the disk lock.
+        """
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        # Recount while scanning, so files removed by other processes are accounted for
+        self._disk_bytes = sum(size for _, size, _ in entries)
+        target = self.disk_budget * 0.9
+        for path, size, _ in entries:
+            if self._disk_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
+            self.evictions['disk'] += 1
+
+    def stats(self) -> Dict:
+        """
+        Hit/miss counters and tier sizes
+        """
+        with self._lock:
+            hits = self.hits['memory'] + self.hits['disk']
+            lookups = hits + self.misses
+            return {
+                'memory_hits': self.hits['memory'],
+                'disk_hits': self.hits['disk'],
+                'misses': self.misses,
+                'hit_ratio': round(hits / lookups, 3) if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'memory_budget_bytes': self.memory_budget,
+                'memory_evictions': self.evictions['memory'],
+                'disk_enabled': bool(self.disk_dir),
+                'disk_bytes': self._disk_bytes,
+                'disk_budget_bytes': self.disk_budget,
+                'disk_evictions': self.evictions['disk']
+            }
+
+
+# Shared cache configured from the environment
+default_cache = TransformCache.from_env()
@@ -0,0 +1,337 @@
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from transform import (MAX_WORKING_PIXELS, OUTPUT_FORMATS, PIPELINE_SEPARATOR, PREVIEW_OPTIONS, apply_spells,
+                       encode_image, encode_preview, load_working_image, output_mimetype, parse_output_options,
+                       parse_pipeline, pipeline_in_process)
+from transform_cache import TransformCache, content_digest, make_key
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Latency samples kept per pipeline for the percentiles in stats()
+LATENCY_WINDOW = 200
+
+
+class TransformQueueFull(Exception):
+    """
+    Raised when the transform queue is at capacity and a job cannot be accepted
+    """
+
+
+def run_transform(pipeline: str, image_bytes: bytes, full_resolution: bool = False,
+                  output: Optional[Dict] = None) -> Tuple[bytes, bytes]:
+    """
+    Decode an uploaded image, apply a spell pipeline and encode the result
+
+    Runs in the worker processes, so the request thread only hands over the
+    raw upload and gets the encoded result back. The spells run at no more
+    than MAX_WORKING_PIXELS; with full_resolution the result is scaled back up
+    to the size of the upload.
+
+    Args:
+        output: Encoding options from parse_output_options (default: baseline JPEG)
+
+    Returns:
+        (encoded result, encoded preview)
+    """
+    output = output or parse_output_options()
+    image, original_size = load_working_image(image_bytes)
+    # Formats with transparency keep Evanesco's alpha instead of a black background
+    result = apply_spells(pipeline, image, keep_alpha=OUTPUT_FORMATS[output['format']][2])
+    preview = encode_preview(result)
+    if full_resolution and result.size != original_size:
+        result = result.resize(original_size, Image.LANCZOS)
+    return encode_image(result, output), preview
+
+
+class TransformJob:
+    """
+    State of one transform job
+    """
+
+    def __init__(self, spell: str):
+        self.id = uuid.uuid4().hex
+        self.spell = spell
+        self.status = 'queued'
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.result: Optional[bytes] = None
+        self.preview: Optional[bytes] = None
+        self.mimetype = 'image/jpeg'
+        self.error: Optional[str] = None
+        self.cache_key: Optional[str] = None
+        self.preview_cache_key: Optional[str] = None
+        self.cached = False
+        self.done = threading.Event()
+
+    def to_dict(self) -> Dict:
+        info = {
+            'job_id': self.id,
+            'spell': self.spell,
+            'status': self.status,
+            'submitted_at': self.submitted_at,
+            'mimetype': self.mimetype,
+            'cached': self.cached
+        }
+        if self.finished_at is not None:
+            info['finished_at'] = self.finished_at
+            info['latency_seconds'] = round(self.finished_at - self.submitted_at, 3)
+        if self.error is not None:
+            info['error'] = self.error
+        return info
+
+
+class TransformJobQueue:
+    """
+    Bounded queue of image transform jobs
+
+    CPU-bound spells run in a pool of worker processes so a burst of uploads
+    neither holds Flask threads for seconds nor competes with hand tracking
+    for the GIL. At most max_pending jobs may be queued or running; further
+    submissions are rejected with TransformQueueFull. Finished results are
+    kept for result_ttl seconds so clients can poll for them. With a cache,
+    results are stored by (image content, spell) and repeated requests are
+    answered without running the spell again.
+
+    The executors are started lazily on the first job, so importing a module
+    that creates a queue (e.g. in a spawned child process) is cheap.
+    """
+
+    def __init__(self,
+                 num_workers: int = 2,
+                 max_pending: int = 8,
+                 result_ttl: float = 300.0,
+                 max_jobs: int = 256,
+                 cache: Optional[TransformCache] = None):
+        """
+        Initialize the TransformJobQueue
+
+        Args:
+            num_workers: Worker processes for CPU spells (and threads for in-process spells)
+            max_pending: Jobs that may be queued or running at the same time
+            result_ttl: Seconds a finished job and its result are kept
+            max_jobs: Upper bound on retained jobs, oldest finished jobs are dropped first
+            cache: Result cache, None to always run the spell
+        """
+        self.num_workers = max(1, int(num_workers))
+        self.max_pending = max(1, int(max_pending))
+        self.result_ttl = float(result_ttl)
+        self.max_jobs = max(self.max_pending, int(max_jobs))
+        self.cache = cache
+
+        self._jobs: "OrderedDict[str, TransformJob]" = OrderedDict()
+        self._latencies: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._process_pool = None
+        self._thread_pool = None
+        self.pending = 0
+        self.completed = 0
+        self.cached = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expired = 0
+
+    def _executor(self, spells: List[str]):
+        # Caller must hold the lock. Spells that need the server's state (Evanesco's
+        # warm rembg session) run on threads; ONNX Runtime releases the GIL.
+        if pipeline_in_process(spells):
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(max_workers=self.num_workers,
+                                                       thread_name_prefix='transform')
+            return self._thread_pool
+        if self._process_pool is None:
+            # Spawn keeps the server's threads (and their locks) out of the workers
+            self._process_pool = ProcessPoolExecutor(max_workers=self.num_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            logger.info(f"Transform process pool started with {self.num_workers} workers")
+        return self._process_pool
+
+    def submit(self, spells, image_bytes: bytes, full_resolution: bool = False,
+               output: Optional[Dict] = None) -> TransformJob:
+        """
+        Queue a transform job
+
+        Args:
+            spells: Spell name, pipeline ("evanesco+lumos") or list of spell names
+            image_bytes: Uploaded image
+            full_resolution: Return the result at the upload's size instead of the working resolution
+            output: Encoding options from parse_output_options (default: baseline JPEG)
+
+        Raises:
+            ValueError: On unknown spells
+            TransformQueueFull: If max_pending jobs are already queued or running
+        """
+        names = parse_pipeline(spells)
+        spell = PIPELINE_SEPARATOR.join(names)
+        output = output or parse_output_options()
+        cache_key = preview_cache_key = None
+        if self.cache is not None:
+            digest = content_digest(image_bytes)
+            cache_key = make_key('result', digest, spell=spell, output=output,
+                                 max_pixels=MAX_WORKING_PIXELS, full_resolution=full_resolution)
+            preview_cache_key = make_key('preview', digest, spell=spell, output=PREVIEW_OPTIONS,
+                                         max_pixels=MAX_WORKING_PIXELS)
+            cached = self.cache.get(cache_key)
+            cached_preview = self.cache.get(preview_cache_key) if cached is not None else None
+            if cached_preview is not None:
+                return self._cached_job(spell, cached, cached_preview, output)
+
+        with self._lock:
+            self._evict_expired()
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise TransformQueueFull(f"{self.pending} transform jobs pending")
+
+            executor = self._executor(names)
+            try:
+                future = executor.submit(run_transform, spell, image_bytes, full_resolution, output)
+            except BrokenProcessPool:
+                # The pool died after the last job finished; replace it and retry once
+                self._process_pool = None
+                executor = self._executor(names)
+                future = executor.submit(run_transform, spell, image_bytes, full_resolution, output)
+
+            job = TransformJob(spell)
+            job.mimetype = output_mimetype(output)
+            job.cache_key = cache_key
+            job.preview_cache_key = preview_cache_key
+            self._jobs[job.id] = job
+            self.pending += 1
+
+        future.add_done_callback(lambda completed: self._finish(job, completed, executor))
+        logger.debug(f"Queued transform job {job.id} ({spell})")
+        return job
+
+    def _cached_job(self, spell: str, result: bytes, preview: bytes, output: Dict) -> TransformJob:
+        """
+        An already finished job for a cached result
+        """
+        job = TransformJob(spell)
+        job.result = result
+        job.preview = preview
+        job.mimetype = output_mimetype(output)
+        job.cached = True
+        job.status = 'done'
+        job.finished_at = time.time()
+        job.done.set()
+        with self._lock:
+            self._jobs[job.id] = job
+            self.completed += 1
+            self.cached += 1
+        logger.debug(f"Transform job {job.id} ({spell}) served from cache")
+        return job
+
+    def _finish(self, job: TransformJob, future, executor):
+        try:
+            job.result, job.preview = future.result()
+            job.status = 'done'
+            if job.cache_key is not None:
+                self.cache.put(job.cache_key, job.result)
+                self.cache.put(job.preview_cache_key, job.preview)
+        except BrokenProcessPool as e:
+            # A worker died (e.g. out of memory); start a fresh pool for the next job
+            logger.error(f"Transform worker crashed during job {job.id} ({job.spell}): {e}")
+            with self._lock:
+                if self._process_pool is executor:
+                    self._process_pool = None
+            job.error = 'Transform worker crashed'
+            job.status = 'error'
+        except Exception as e:
+            logger.error(f"Transform job {job.id} ({job.spell}) failed: {e}")
+            job.error = str(e)
+            job.status = 'error'
+        job.finished_at = time.time()
+
+        with self._lock:
+            self.pending -= 1
+            if job.status == 'done':
+                self.completed += 1
+                latency = job.finished_at - job.submitted_at
+                self._latencies.setdefault(job.spell, deque(maxlen=LATENCY_WINDOW)).append(latency)
+            else:
+                self.failed += 1
+        job.done.set()
+
+    def get(self, job_id: str) -> Optional[TransformJob]:
+        """
+        Look up a job; None if it is unknown or has expired
+        """
+        with self._lock:
+            self._evict_expired()
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id: str, timeout: float) -> Optional[TransformJob]:
+        """
+        Long-poll: wait up to timeout seconds for a job to finish
+
+        Returns:
+            The job (finished or not), or None if it is unknown or has expired
+        """
+        job = self.get(job_id)
+        if job is not None and timeout > 0:
+            job.done.wait(timeout)
+        return job
+
+    def _evict_expired(self):
+        """
+        Drop finished jobs past their TTL and the oldest finished jobs beyond max_jobs. Caller must hold the lock.
+        """
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.finished_at is not None]
+        overflow = len(self._jobs) - self.max_jobs
+        for job in finished:
+            if now - job.finished_at > self.result_ttl or overflow > 0:
+                del self._jobs[job.id]
+                self.expired += 1
+                overflow -= 1
+
+    def stats(self) -> Dict:
+        """
+        Queue depth, job counters and per-pipeline latency percentiles
+        """
+        with self._lock:
+            latency = {}
+            for spell, samples in self._latencies.items():
+                values = np.array(samples)
+                latency[spell] = {
+                    'samples': len(values),
+                    'mean_seconds': round(float(values.mean()), 3),
+                    'p50_seconds': round(float(np.percentile(values, 50)), 3),
+                    'p95_seconds': round(float(np.percentile(values, 95)), 3)
+                }
+            return {
+                'workers': self.num_workers,
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'retained_jobs': len(self._jobs),
+                'completed': self.completed,
+                'served_from_cache': self.cached,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'expired': self.expired,
+                'result_ttl_seconds': self.result_ttl,
+                'latency': latency
+            }
+
+    def cleanup(self):
+        """
+        Shut the executors down
+        """
+        with self._lock:
+            pools = (self._process_pool, self._thread_pool)
+            self._process_pool = self._thread_pool = None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        logger.info("TransformJobQueue cleaned up")
@@ -17,6 +17,12 @@ router.post('/transfigure', upload.single('image'), async (req, res) => {
             contentType: req.file.mimetype // Use original mime type
         });
         formData.append('spell', spell);
+        // Optional output encoding options (format, quality, progressive, preview)
+        for (const field of ['format', 'quality', 'progressive', 'preview']) {
+            if (req.body[field] !== undefined) {
+                formData.append(field, req.body[field]);
+            }
+        }
 
         // Forward the request to Flask AI endpoint
         const response = await axios.post(
@@ -24,6 +24,22 @@ const HandTrackingPage = () => {
   const [sparkles, setSparkles] = useState([]);
 
   const FLASK_BACKEND_URL = 'http://localhost:5001/track_hands';
+  const FLASK_STREAM_URL = 'ws://localhost:5001/ws/track_hands';
+  // Frames sent over the stream that have not been answered yet
+  const MAX_FRAMES_IN_FLIGHT = 2;
+  const wsRef = useRef(null);
+  const framesInFlightRef = useRef(0);
+  // Per-stream counts behind framesInFlightRef. The server replaces frames it cannot keep up
+  // with by newer ones; those are never answered and only show up in its frames_dropped count.
+  const framesSentRef = useRef(0);
+  const resultsReceivedRef = useRef(0);
+  const framesDroppedRef = useRef(0);
+  // Identifies this page's webcam stream so the backend keeps a dedicated hand tracker for it
+  const sessionIdRef = useRef(
+    window.crypto && window.crypto.randomUUID
+      ? window.crypto.randomUUID()
+      : `${Date.now()}-${Math.random().toString(36).slice(2)}`
+  );
 
   // Color spells configuration
   const spells = {
@@ -94,6 +110,59 @@ const HandTrackingPage = () => {
     }
   };
 
+  /**
+   * Applies a hand tracking result from the backend (POST or stream) to the canvases.
+   * @param {Object} data - Response payload with hand_landmarks.
+   */
+  const handleTrackingResult = (data) => {
+    if (data.hand_landmarks && data.hand_landmarks.length > 0) {
+      drawHandLandmarks(data.hand_landmarks); // Draw landmarks on the main canvas
+      updateWandPosition(data.hand_landmarks[0]); // Update wand tip based on first hand
+    } else if (canvasRef.current) {
+      // Clear canvases if no hands are detected
+      const canvasCtx = canvasRef.current.getContext('2d');
+      canvasCtx.clearRect(0, 0, canvasRef.current.width, canvasRef.current.height);
+      clearWandEffects();
+    }
+  };
+
+  /**
+   * Opens the persistent hand tracking stream. Raw JPEG frames are sent as
+   * binary messages and landmark results come back on the same socket.
+   * If the stream cannot be used, frames fall back to per-frame POST requests.
+   */
+  const openTrackingStream = () => {
+    if (!window.WebSocket) return;
+    const ws = new WebSocket(`${FLASK_STREAM_URL}?session_id=${encodeURIComponent(sessionIdRef.current)}`);
+    ws.binaryType = 'arraybuffer';
+    ws.onopen = () => {
+      framesInFlightRef.current = 0;
+      framesSentRef.current = 0;
+      resultsReceivedRef.current = 0;
+      framesDroppedRef.current = 0;
+      console.log("Frontend Debug: Hand tracking stream connected.");
+    };
+    ws.onmessage = (event) => {
+      resultsReceivedRef.current += 1;
+      try {
+        const result = JSON.parse(event.data);
+        framesDroppedRef.current = result.frames_dropped || framesDroppedRef.current;
+        handleTrackingResult(result);
+      } catch (err) {
+        console.error("Frontend Error: Invalid hand tracking stream message:", err);
+      }
+      // Dropped frames count as answered, otherwise every drop would hold a slot for good
+      framesInFlightRef.current = Math.max(
+        0, framesSentRef.current - resultsReceivedRef.current - framesDroppedRef.current
+      );
+    };
+    ws.onclose = () => {
+      console.log("Frontend Debug: Hand tracking stream closed, falling back to HTTP.");
+      wsRef.current = null;
+    };
+    wsRef.current = ws;
+  };
+
   /**
    * Continuously captures frames from the webcam, sends them to the backend,
    * and processes the received hand landmark data. This function is called
@@ -124,6 +193,27 @@ const HandTrackingPage = () => {
     context.drawImage(video, 0, 0, canvas.width, canvas.height);
     context.restore();
 
+    const ws = wsRef.current;
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      // Stream raw JPEG bytes; the server drops stale frames if it falls behind
+      if (framesInFlightRef.current < MAX_FRAMES_IN_FLIGHT) {
+        framesInFlightRef.current += 1;
+        framesSentRef.current += 1;
+        canvas.toBlob((blob) => {
+          if (blob && ws.readyState === WebSocket.OPEN) {
+            ws.send(blob);
+          } else {
+            framesInFlightRef.current = Math.max(0, framesInFlightRef.current - 1);
+            framesSentRef.current -= 1;
+          }
+        }, 'image/jpeg', 0.8);
+      }
+      setIsProcessing(false);
+      drawWandEffects();
+      animationFrameId.current = requestAnimationFrame(sendFrameToBackend);
+      return;
+    }
+
     const imageDataUrl = canvas.toDataURL('image/jpeg', 0.8); // Get image data as base64 URL
 
     try {
@@ -132,20 +222,12 @@ const HandTrackingPage = () => {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ image: imageDataUrl }),
+        body: JSON.stringify({ image: imageDataUrl, session_id: sessionIdRef.current }),
       });
 
       if (response.ok) {
         const data = await response.json();
-        if (data.hand_landmarks && data.hand_landmarks.length > 0) {
-          drawHandLandmarks(data.hand_landmarks); // Draw landmarks on the main canvas
-          updateWandPosition(data.hand_landmarks[0]); // Update wand tip based on first hand
-        } else {
-          // Clear canvases if no hands are detected
-          const canvasCtx = canvasRef.current.getContext('2d');
-          canvasCtx.clearRect(0, 0, canvasRef.current.width, canvasRef.current.height);
-          clearWandEffects();
-        }
+        handleTrackingResult(data);
       } else {
         const errorText = await response.text();
         setError(`Backend processing error: ${response.status} - ${errorText}`);
@@ -411,10 +493,16 @@ const HandTrackingPage = () => {
     activeSpellRef.current = activeSpell;
     // *** DEBUGGING CHANGE END ***
 
+    openTrackingStream(); // Prefer the persistent stream over per-frame POSTs
     getWebcamAccess(); // Request webcam access and start frame sending
 
-    // Cleanup function: stops webcam stream and cancels animation frame
+    // Cleanup function: stops webcam stream, closes the tracking stream and cancels animation frame
     return () => {
+      if (wsRef.current) {
+        wsRef.current.onclose = null;
+        wsRef.current.close();
+        wsRef.current = null;
+      }
       if (videoRef.current && videoRef.current.srcObject) {
         videoRef.current.srcObject.getTracks().forEach(track => track.stop());
       }